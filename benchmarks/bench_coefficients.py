@@ -0,0 +1,58 @@
+""" file:   bench_coefficients.py
+    author: Jess Robertson, CSIRO Minerals
+    date:   June 2018
+
+    description: Benchmark coefficient generation and history sums
+
+    Compares the NumPy coefficients in maxr.integrator.history with the
+    OpenMP-parallel Cython extensions for history lengths up to 10^7. The
+    Cython loops only go parallel above maxr.ext.common.PARALLEL_MIN; the
+    Cython timings are repeated for each thread count up to the default set
+    by MAXR_NUM_THREADS or OpenMP.
+
+    Run with `python -m benchmarks.bench_coefficients` from the top level.
+"""
+
+from __future__ import print_function, division
+
+import timeit
+
+import numpy
+
+from maxr.integrator.history import _coefficients
+from maxr.ext.coefficients import IntegratorCoeffs
+from maxr.ext import history, get_num_threads, num_threads
+
+
+def best_of(func, repeat=5):
+    "Return the best time in seconds for a call to func"
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main(order=3):
+    "Print a table of timings"
+    threads = sorted(set([1, get_num_threads()]))
+    print('Order {0} coefficients'.format(order))
+    print('{0:>10} {1:>8} {2:>12} {3:>12} {4:>12} {5:>12}'.format(
+        'n', 'threads', 'numpy (s)', 'cython (s)', 'np dot (s)',
+        'cy dot (s)'))
+    for num in (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7):
+        states = numpy.random.random(num + 1)
+        coeffs = IntegratorCoeffs(num, order)
+        array = coeffs.as_array()
+        numpy_coeffs = best_of(lambda: _coefficients(num, order))
+        numpy_dot = best_of(lambda: (array * states[::-1]).sum())
+        for nthreads in threads:
+            with num_threads(nthreads):
+                print('{0:>10} {1:>8} {2:12.3e} {3:12.3e} {4:12.3e} '
+                      '{5:12.3e}'.format(
+                          num, nthreads, numpy_coeffs,
+                          best_of(lambda: IntegratorCoeffs(num, order)),
+                          numpy_dot,
+                          best_of(lambda: history.dot(coeffs, states))))
+
+
+if __name__ == '__main__':
+    main()
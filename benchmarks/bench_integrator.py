@@ -0,0 +1,44 @@
+""" file:   bench_integrator.py
+    author: Jess Robertson, CSIRO Minerals
+    date:   June 2018
+
+    description: Benchmark the particle integrator in the blinking vortex
+
+    Reports particle-steps per second for a range of ensemble sizes and
+    history lengths. The history sum reads the whole relative velocity
+    history every step, so throughput drops as the number of steps grows.
+
+    Run with `python -m benchmarks.bench_integrator` from the top level.
+"""
+
+from __future__ import print_function, division
+
+import time
+
+import numpy
+
+from maxr import Parameters
+from maxr.flow import blink
+from maxr.integrator.integrator import Integrator
+
+
+def main():
+    "Print a table of timings"
+    print('{0:>10} {1:>8} {2:>10} {3:>16}'.format(
+        'particles', 'steps', 'time (s)', 'particle-steps/s'))
+    for nparticles, nsteps in ((1000, 200), (10000, 200), (100000, 50),
+                               (2000, 1000)):
+        params = Parameters()
+        params.N, params.dt = nsteps, 1e-2
+        params.R, params.S = 0.6, 0.1
+        start = numpy.random.uniform(-1, 1, (nparticles, 2))
+        integrator = Integrator(blink(gamma=1, period=1), params)
+        tic = time.time()
+        integrator.integrate(start)
+        elapsed = time.time() - tic
+        print('{0:>10} {1:>8} {2:10.3f} {3:16.3e}'.format(
+            nparticles, nsteps, elapsed, nparticles * nsteps / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+""" file:   bench_interpolation.py
+    author: Jess Robertson, CSIRO Minerals
+    date:   June 2018
+
+    description: Benchmark flow interpolation on uniform grids
+
+    Compares scipy's RegularGridInterpolator against UniformGridInterpolator
+    (with the compiled kernel and with numpy) for a range of numbers of
+    query points on a 200 x 200 x 50 grid.
+
+    Run with `python -m benchmarks.bench_interpolation` from the top level.
+"""
+
+from __future__ import print_function, division
+
+import time
+
+import numpy
+from scipy.interpolate import RegularGridInterpolator
+
+from maxr.flow import UniformGridInterpolator
+
+
+def timeit(func, *args):
+    "Return the best of three runs"
+    best = None
+    for _ in range(3):
+        tic = time.time()
+        func(*args)
+        elapsed = time.time() - tic
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    "Print a table of timings"
+    axes = (numpy.linspace(-2, 2, 200), numpy.linspace(-2, 2, 200),
+            numpy.linspace(0, 2, 50))
+    values = numpy.random.normal(size=(200, 200, 50))
+    scipy_interp = RegularGridInterpolator(axes, values, bounds_error=False,
+                                           fill_value=numpy.nan)
+    compiled = UniformGridInterpolator(axes, values)
+    python = UniformGridInterpolator(axes, values)
+    python.compiled = False
+
+    print('{0:>10} {1:>10} {2:>10} {3:>10} {4:>9}'.format(
+        'points', 'scipy (s)', 'numpy (s)', 'ext (s)', 'speedup'))
+    for npoints in (10 ** 4, 10 ** 5, 10 ** 6):
+        points = numpy.random.uniform((-2, -2, 0), (2, 2, 2), (npoints, 3))
+        times = [timeit(interp, points)
+                 for interp in (scipy_interp, python, compiled)]
+        print('{0:>10} {1:10.4f} {2:10.4f} {3:10.4f} {4:9.1f}'.format(
+            npoints, times[0], times[1], times[2], times[0] / times[2]))
+
+
+if __name__ == '__main__':
+    main()
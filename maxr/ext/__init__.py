@@ -5,4 +5,6 @@
     description: Expose a unified interface for the cython extensions
 """
 
-from . import *
+from .common import get_num_threads, set_num_threads, num_threads
+
+__all__ = ['get_num_threads', 'set_num_threads', 'num_threads']
@@ -5,6 +5,7 @@
     description: Cython description of first-order history integral terms
 """
 
-from common cimport real_t, uint_t
+from maxr.ext.common cimport store_t, uint_t
 
-cdef void alpha(real_t *coeffs, uint_t n)
\ No newline at end of file
+cdef void alpha(store_t *coeffs, uint_t n) noexcept nogil
+cdef void alpha_update(store_t *coeffs, uint_t old_n, uint_t n) noexcept nogil
@@ -5,15 +5,60 @@
     description: Cython implementation of first-order history integral terms
 """
 
-from common cimport pow_3_2, uint_t, real_t
+from maxr.ext.common cimport pow_3_2, uint_t, real_t, store_t, series, \
+    load_series, NTERMS, NUM_THREADS, PARALLEL_MIN
 from libc.math cimport sqrt
+from cython.parallel cimport prange
 
-cdef void alpha(real_t *coeffs, uint_t n):
-    "First-order integration coefficients for history term"
-    cdef uint_t i
+from maxr.integrator import expansion
+
+# Asymptotic series for large indices, see maxr.integrator.expansion
+cdef real_t INTERIOR[NTERMS]
+cdef real_t BOUNDARY[NTERMS]
+load_series(INTERIOR, expansion.ALPHA_INTERIOR)
+load_series(BOUNDARY, expansion.ALPHA_BOUNDARY[0])
+cdef uint_t INTERIOR_CUTOFF = expansion.ALPHA_INTERIOR.cutoff
+cdef uint_t BOUNDARY_CUTOFF = expansion.ALPHA_BOUNDARY[0].cutoff
+
+cdef inline real_t interior(uint_t i) noexcept nogil:
+    "Interior coefficient at index i"
+    if i < INTERIOR_CUTOFF:
+        return 4/3. * (pow_3_2(i-1) + pow_3_2(i+1) - 2 * pow_3_2(i))
+    return series(INTERIOR, i)
+
+cdef void fill_interior(store_t *coeffs, uint_t start, uint_t stop) noexcept nogil:
+    "Interior coefficients for start <= i < stop, in parallel for long runs"
+    cdef Py_ssize_t i
+    if stop <= start:
+        return
+    if stop - start < PARALLEL_MIN:
+        for i in range(start, stop):
+            coeffs[i] = interior(i)
+    else:
+        for i in prange(start, stop, num_threads=NUM_THREADS,
+                        schedule='static'):
+            coeffs[i] = interior(i)
 
+cdef void boundary(store_t *coeffs, uint_t n) noexcept nogil:
+    "Right boundary coefficient for a history of length n"
+    if n < BOUNDARY_CUTOFF:
+        coeffs[n] = 4/3. * (pow_3_2(n-1) - pow_3_2(n) + 6/4. * sqrt(n))
+    else:
+        coeffs[n] = series(BOUNDARY, n)
+
+cdef void alpha_update(store_t *coeffs, uint_t old_n, uint_t n) noexcept nogil:
+    """Update first-order coefficients for a history of length old_n to
+    length n, only recalculating the entries which change"""
+    if old_n == 0:
+        alpha(coeffs, n)
+        return
+
+    fill_interior(coeffs, old_n, n)
+    boundary(coeffs, n)
+
+cdef void alpha(store_t *coeffs, uint_t n) noexcept nogil:
+    "First-order integration coefficients for history term"
     # Left, then middle, then right boundary
     coeffs[0] = 4/3.
-    for i in range(1, n):
-        coeffs[i] = 4/3. * (pow_3_2(i-1) + pow_3_2(i+1) - 2 * pow_3_2(i))
-    coeffs[n] = 4/3. * (pow_3_2(n-1) - pow_3_2(n) + 6/4. * sqrt(n))
\ No newline at end of file
+    fill_interior(coeffs, 1, n)
+    boundary(coeffs, n)
@@ -5,37 +5,86 @@
     description: Cython implementation of second-order history integral terms
 """
 
-from common cimport pow_3_2, pow_5_2, uint_t, real_t
-from alpha cimport alpha
+from maxr.ext.common cimport pow_3_2, pow_5_2, uint_t, real_t, store_t, \
+    series, load_series, NTERMS, NUM_THREADS, PARALLEL_MIN
+from maxr.ext.alpha cimport alpha
 
 from libc.math cimport sqrt
+from cython.parallel cimport prange
+
+from maxr.integrator import expansion
 
 # Define some compile-time constants
 DEF SQRT_2 = 1.4142135623730950488
 DEF SQRT_3 = 1.7320508075688772936
 
-cdef void beta(real_t *coeffs, uint_t n):
-    "Second-order integration coefficients for history term"
-    cdef uint_t i
+# Asymptotic series for large indices, see maxr.integrator.expansion
+cdef real_t INTERIOR[NTERMS]
+cdef real_t BOUNDARY[2][NTERMS]
+load_series(INTERIOR, expansion.BETA_INTERIOR)
+load_series(BOUNDARY[0], expansion.BETA_BOUNDARY[0])
+load_series(BOUNDARY[1], expansion.BETA_BOUNDARY[1])
+cdef uint_t INTERIOR_CUTOFF = expansion.BETA_INTERIOR.cutoff
+cdef uint_t BOUNDARY_CUTOFF = max(e.cutoff for e in expansion.BETA_BOUNDARY)
+
+cdef inline real_t interior(uint_t i) noexcept nogil:
+    "Interior coefficient at index i"
+    if i < INTERIOR_CUTOFF:
+        return 8/15. * (pow_5_2(i+2) - 3 * pow_5_2(i+1)
+                        + 3 * pow_5_2(i) - pow_5_2(i-1)) \
+               + 2/3. * (-pow_3_2(i+2) + 3 * pow_3_2(i+1)
+                         - 3 * pow_3_2(i) + pow_3_2(i-1))
+    return series(INTERIOR, i)
+
+cdef void fill_interior(store_t *coeffs, uint_t start, uint_t stop) noexcept nogil:
+    "Interior coefficients for start <= i < stop, in parallel for long runs"
+    cdef Py_ssize_t i
+    if stop <= start:
+        return
+    if stop - start < PARALLEL_MIN:
+        for i in range(start, stop):
+            coeffs[i] = interior(i)
+    else:
+        for i in prange(start, stop, num_threads=NUM_THREADS,
+                        schedule='static'):
+            coeffs[i] = interior(i)
+
+cdef void boundary(store_t *coeffs, uint_t n) noexcept nogil:
+    "Right boundary coefficients for a history of length n > 3"
+    if n < BOUNDARY_CUTOFF:
+        coeffs[n-1] = 8/15. * (-2 * pow_5_2(n) + 3 * pow_5_2(n-1)
+                               - pow_5_2(n-2)) \
+                      + 2/3. * (4 * pow_3_2(n) - 3 * pow_3_2(n-1)
+                                + pow_3_2(n-2))
+        coeffs[n] = 8/15. * (pow_5_2(n) - pow_5_2(n-1)) \
+                    + 2/3. * (-3 * pow_3_2(n) + pow_3_2(n-1)) + 2 * sqrt(n)
+    else:
+        coeffs[n-1] = series(BOUNDARY[0], n)
+        coeffs[n] = series(BOUNDARY[1], n)
 
+cdef void beta_update(store_t *coeffs, uint_t old_n, uint_t n) noexcept nogil:
+    """Update second-order coefficients for a history of length old_n to
+    length n, only recalculating the entries which change"""
+    if old_n <= 3 or n <= 3:
+        beta(coeffs, n)
+        return
+
+    fill_interior(coeffs, old_n-1, n-1)
+    boundary(coeffs, n)
+
+cdef void beta(store_t *coeffs, uint_t n) noexcept nogil:
+    "Second-order integration coefficients for history term"
     if n > 3:
         # Left boundary
-        coeffs[0] = 4 / 5 * SQRT_2
-        coeffs[1] = 14 / 5 * SQRT_3 - 12 / 5 * SQRT_2
-        coeffs[2] = 176 / 15 - 42 / 5 * SQRT_3 + 12 / 5 * SQRT_2
+        coeffs[0] = 4/5. * SQRT_2
+        coeffs[1] = 14/5. * SQRT_3 - 12/5. * SQRT_2
+        coeffs[2] = 176/15. - 42/5. * SQRT_3 + 12/5. * SQRT_2
 
         # Middle
-        for i in range(3, n-1):
-            coeffs[i] = 8/15. * (pow_5_2(i+2) - 3 * pow_5_2(i+1)
-                                  + 3 * pow_5_2(i) - pow_5_2(i-1)) \
-                          + 2/3. * (-pow_3_2(i+2) + 3 * pow_3_2(i+1)
-                                   - 3 * pow_3_2(i) + pow_3_2(i-1))
+        fill_interior(coeffs, 3, n-1)
 
         # Right boundary
-        coeffs[n-1] = 8/15 * (-2 * pow_5_2(n) + 3 * pow_5_2(n-1) - pow_5_2(n-2)) \
-                      + 2/3 * (4 * pow_3_2(n) - 3 * pow_3_2(n-1) + pow_3_2(n-2))
-        coeffs[n] = 8/15. * (pow_5_2(n) - pow_5_2(n-1)) \
-                    + 2/3. * (-3 * pow_3_2(n) + pow_3_2(n-1)) + 2 * sqrt(n)
+        boundary(coeffs, n)
 
     # First few have to be handled specially
     elif n == 1:
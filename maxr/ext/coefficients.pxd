@@ -5,11 +5,23 @@
     description: Cython definition of history integral terms
 """
 
-cimport common
-from common cimport uint_t, real_t
+cimport maxr.ext.common
+from maxr.ext.common cimport uint_t, real_t
 
 cdef class IntegratorCoeffs:
 
     cdef:
-        public uint_t n, order
-        real_t *_coeffs
\ No newline at end of file
+        readonly uint_t n, order, capacity
+        real_t *_coeffs
+        float *_coeffs_f
+        Py_ssize_t _shape[1]
+        Py_ssize_t _strides[1]
+        int _exports
+        bint _single
+        object _shm
+        unsigned char[::1] _shared
+
+        int _reserve(self, uint_t capacity) except -1
+        void _update(self, uint_t old_n, uint_t n) noexcept nogil
+        int _attach(self, shm) except -1
+        int _check_open(self) except -1
@@ -5,15 +5,20 @@
     description: Cython implementation of history integral terms
 """
 
-from libc.stdlib cimport malloc, free
+from libc.stdlib cimport realloc, free
+from cpython.buffer cimport PyBUF_WRITABLE, PyBUF_FORMAT
 from libc.math cimport sqrt
 import numpy as np
 cimport numpy as np
 
-from common cimport uint_t, real_t
-from alpha cimport alpha
-from beta cimport beta
-from gamma cimport gamma
+from maxr.ext.common cimport uint_t, real_t
+from maxr.ext.alpha cimport alpha_update
+from maxr.ext.beta cimport beta_update
+from maxr.ext.gamma cimport gamma_update
+
+# Shared memory blocks start with (n, order, itemsize) as uint64s, followed
+# by the coefficients
+cdef Py_ssize_t SHARED_HEADER = 64
 
 # Wrapper class
 cdef class IntegratorCoeffs:
@@ -21,43 +26,287 @@ cdef class IntegratorCoeffs:
     """
     Manages history coefficients for the particle integrator
 
+    Supports the buffer protocol, so `np.asarray(coeffs)` gives a read-only
+    view of the coefficients without copying.
+
+    The coefficients can be grown in place with `extend` and `resize` to keep
+    up with a growing history. The buffer grows geometrically and only the
+    coefficients which change with the history length are recalculated.
+
+    Coefficients can be stored in single precision with dtype='float32' to
+    halve the memory traffic in history sums. They're still calculated in
+    double precision and then rounded, so each coefficient has a relative
+    error of at most 2^-24 (about 6e-8). Since the coefficients are all
+    positive and sum to 2 sqrt(n), rounding the coefficients and states
+    changes the sum in a history integral over a time T by at most
+    4 sqrt(T) * 2^-24 * max|state|, and rounding the first state changes
+    the constant term 2 sqrt(T) * state[0] by at most 2 sqrt(T) * 2^-24 *
+    |state[0]|. The total is at most 6 sqrt(T) * 2^-24 * max|state| (about
+    2e-6 for T = 30 and unit states), and in practice the rounding errors
+    mostly cancel, giving 1e-8 to 1e-10. That's well below the
+    discretisation error of the first and second order schemes, but it
+    will dominate third order results with small steps (see
+    tests/test_history_cython.py).
+
+    Coefficients can be copied into a multiprocessing.shared_memory block
+    with `share`, and other processes can then `attach` to the block by
+    name rather than calculating their own copy. Pickling shared
+    coefficients just sends the name of the block, while unshared
+    coefficients are recalculated when they're unpickled. Each process
+    should `close` its copy when it's done (this also happens when the
+    coefficients are garbage collected).
+
     Parameters:
         n (uint_t) - the number of coefficients to return
         order (uint_t) - the order of the integrator
+        dtype - the storage type, either float64 (the default) or float32
+        shared - a SharedMemory block holding the coefficients, as created
+            by `share`. If given, the coefficients are used in place rather
+            than being calculated. Defaults to None.
     """
 
-    def __cinit__(self, uint_t n, uint_t order):
+    def __cinit__(self, uint_t n, uint_t order, dtype=np.float64,
+                  shared=None):
         "Constructor"
+        if n < 1:
+            raise ValueError("n must be greater than 0")
+        if order not in (1, 2, 3):
+            raise ValueError("Order must be one of 1, 2 or 3")
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError("dtype must be float32 or float64, "
+                             "got {0}".format(dtype))
         self.n = n
         self.order = order
-        self._coeffs = <real_t*> malloc((n+1) * sizeof(real_t))
-        if self._coeffs == NULL:
-            raise MemoryError()
-
-        # Update coefficients
-        if self.order == 1:
-            alpha(self._coeffs, self.n)
-        elif self.order == 2:
-            beta(self._coeffs, self.n)
-        elif self.order == 3:
-            gamma(self._coeffs, self.n)
-
-    def __getitem__(self, uint_t index):
+        self.capacity = 0
+        self._exports = 0
+        self._coeffs = NULL
+        self._coeffs_f = NULL
+        self._single = dtype == np.float32
+        if shared is not None:
+            self._attach(shared)
+        else:
+            self._reserve(n + 1)
+            self._update(0, n)
+
+    cdef int _attach(self, shm) except -1:
+        "Point the coefficients at a shared memory block"
+        cdef Py_ssize_t itemsize = sizeof(float) if self._single \
+            else sizeof(real_t)
+        header = tuple(np.frombuffer(shm.buf, np.uint64, 3))
+        if header != (self.n, self.order, itemsize):
+            raise ValueError("Shared memory block {0} holds coefficients "
+                             "for (n, order, itemsize) = {1}".format(
+                                 shm.name, header))
+        self._shm = shm
+        self._shared = shm.buf
+        if self._single:
+            self._coeffs_f = <float*> &self._shared[SHARED_HEADER]
+        else:
+            self._coeffs = <real_t*> &self._shared[SHARED_HEADER]
+        self.capacity = self.n + 1
+        return 0
+
+    cdef int _reserve(self, uint_t capacity) except -1:
+        "Make sure there's space for capacity coefficients"
+        cdef void *data
+        if capacity <= self.capacity:
+            return 0
+        if self._single:
+            data = realloc(self._coeffs_f, capacity * sizeof(float))
+            if data == NULL:
+                raise MemoryError()
+            self._coeffs_f = <float*> data
+        else:
+            data = realloc(self._coeffs, capacity * sizeof(real_t))
+            if data == NULL:
+                raise MemoryError()
+            self._coeffs = <real_t*> data
+        self.capacity = capacity
+        return 0
+
+    cdef void _update(self, uint_t old_n, uint_t n) noexcept nogil:
+        "Recalculate the coefficients which change from length old_n to n"
+        if self._single:
+            if self.order == 1:
+                alpha_update(self._coeffs_f, old_n, n)
+            elif self.order == 2:
+                beta_update(self._coeffs_f, old_n, n)
+            elif self.order == 3:
+                gamma_update(self._coeffs_f, old_n, n)
+        else:
+            if self.order == 1:
+                alpha_update(self._coeffs, old_n, n)
+            elif self.order == 2:
+                beta_update(self._coeffs, old_n, n)
+            elif self.order == 3:
+                gamma_update(self._coeffs, old_n, n)
+
+    def share(self):
+        """ Copy the coefficients into a new shared memory block
+
+            Returns:
+                an IntegratorCoeffs using the block. The caller is
+                responsible for calling `unlink` once every process is done
+                with it.
+        """
+        from multiprocessing.shared_memory import SharedMemory
+        values = np.asarray(self)
+        shm = SharedMemory(create=True, size=SHARED_HEADER + values.nbytes)
+        header = np.frombuffer(shm.buf, np.uint64, 3)
+        header[:] = self.n, self.order, values.itemsize
+        np.frombuffer(shm.buf, values.dtype, len(values),
+                      SHARED_HEADER)[:] = values
+        del header
+        return IntegratorCoeffs(self.n, self.order, self.dtype, shared=shm)
+
+    cdef int _check_open(self) except -1:
+        "Make sure we haven't closed our shared memory block"
+        if self._shm is not None and self._shared is None:
+            raise ValueError("Coefficients have been closed")
+        return 0
+
+    def close(self):
+        """ Detach from the shared memory block
+
+            The block itself stays around until `unlink` is called. Does
+            nothing for coefficients which aren't in shared memory, and the
+            coefficients can't be used once they're closed.
+        """
+        if self._shm is None or self._shared is None:
+            return
+        if self._exports > 0:
+            raise BufferError("Can't close coefficients while they're "
+                              "being viewed, release any views first")
+        # Drop our view first, otherwise the block can't be closed
+        self._shared = None
+        self._coeffs = NULL
+        self._coeffs_f = NULL
+        self._shm.close()
+
+    def unlink(self):
+        "Free the shared memory block once all processes have closed it"
+        if self._shm is None:
+            raise ValueError("Coefficients aren't in shared memory")
+        self._shm.unlink()
+
+    @property
+    def name(self):
+        "The name of the shared memory block, or None if not shared"
+        return self._shm.name if self._shm is not None else None
+
+    def __reduce__(self):
+        if self._shm is not None:
+            return attach, (self._shm.name,)
+        return IntegratorCoeffs, (self.n, self.order, self.dtype.str)
+
+    @property
+    def dtype(self):
+        "The numpy dtype of the stored coefficients"
+        return np.dtype(np.float32 if self._single else np.float64)
+
+    def resize(self, uint_t n):
+        """ Change the history length to n, recalculating only the
+            coefficients which change
+
+            Parameters:
+                n (uint_t) - the new number of coefficients
+        """
+        if n < 1:
+            raise ValueError("n must be greater than 0")
+        if self._exports > 0:
+            raise BufferError("Can't resize coefficients while they're "
+                              "being viewed, release any views first")
+        if self._shm is not None:
+            raise BufferError("Can't resize coefficients in shared memory")
+
+        # Grow the buffer geometrically so repeated extends are amortised
+        if n + 1 > self.capacity:
+            self._reserve(max(n + 1, 2 * self.capacity))
+        self._update(self.n, n)
+        self.n = n
+
+    def extend(self, uint_t k=1):
+        """ Extend the history length by k
+
+            Parameters:
+                k (uint_t) - the number of steps to extend by, defaults to 1
+        """
+        self.resize(self.n + k)
+
+    def __len__(self):
+        return self.n + 1
+
+    def __getitem__(self, Py_ssize_t index):
+        self._check_open()
+        if index < 0:
+            index += self.n + 1
+        if not 0 <= index <= self.n:
+            raise IndexError("coefficient index out of range")
+        if self._single:
+            return self._coeffs_f[index]
         return self._coeffs[index]
 
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        "Expose the coefficients as a read-only 1D buffer"
+        cdef Py_ssize_t itemsize
+        self._check_open()
+        if flags & PyBUF_WRITABLE:
+            raise BufferError("IntegratorCoeffs buffers are read-only")
+        if self._single:
+            itemsize = sizeof(float)
+            buffer.buf = <char *> self._coeffs_f
+        else:
+            itemsize = sizeof(real_t)
+            buffer.buf = <char *> self._coeffs
+        self._shape[0] = self.n + 1
+        self._strides[0] = itemsize
+        buffer.obj = self
+        buffer.len = self._shape[0] * itemsize
+        buffer.readonly = 1
+        buffer.itemsize = itemsize
+        buffer.format = NULL
+        if flags & PyBUF_FORMAT and self._single:
+            buffer.format = b'f'
+        elif flags & PyBUF_FORMAT:
+            buffer.format = b'd'
+        buffer.ndim = 1
+        buffer.shape = self._shape
+        buffer.strides = self._strides
+        buffer.suboffsets = NULL
+        buffer.internal = NULL
+        self._exports += 1
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        self._exports -= 1
+
     def __dealloc__(self):
         "Clean up memory on dealloc"
-        if self._coeffs != NULL:
-            free(self._coeffs)
+        if self._shm is not None:
+            self.close()
+            return
+        free(self._coeffs)
+        free(self._coeffs_f)
 
     def as_array(self):
         "Return a copy of the coefficients as a numpy array"
-        copy = np.empty(self.n + 1, dtype=np.double)
-        cdef uint_t i
-        for i in range(self.n + 1):
-            copy[i] = self._coeffs[i]
-        return copy
-
+        return np.array(self)
 
+def attach(name):
+    """
+    Attach to coefficients in a shared memory block
 
+    Parameters:
+        name (str) - the name of the block, as given by
+            `IntegratorCoeffs.name`
 
+    Returns:
+        an IntegratorCoeffs using the block without copying
+    """
+    from multiprocessing.shared_memory import SharedMemory
+    shm = SharedMemory(name=name)
+    header = np.frombuffer(shm.buf, np.uint64, 3)
+    n, order, itemsize = (int(v) for v in header)
+    del header
+    return IntegratorCoeffs(n, order, np.float32 if itemsize == 4
+                            else np.float64, shared=shm)
@@ -11,18 +11,49 @@ from libc.math cimport sqrt
 ctypedef double real_t
 ctypedef unsigned int uint_t
 
-# Power functions
-cdef inline real_t pow_3_2(int n):
+# Storage types for coefficients and histories - arithmetic is always done
+# in real_t, but buffers can be single precision to save memory bandwidth
+ctypedef fused store_t:
+    float
+    double
+
+# Number of terms in the asymptotic series for large indices, must match
+# maxr.integrator.expansion.NTERMS
+cdef enum:
+    NTERMS = 48
+
+# Loops shorter than this aren't worth starting OpenMP threads for
+cdef enum:
+    PARALLEL_MIN = 10000
+
+# Power functions - arguments are doubles so large indices don't overflow
+cdef inline real_t pow_3_2(real_t n) nogil:
     "Evaulate n ** 3/2"
-    return sqrt(n * n * n)
+    return n * sqrt(n)
 
-cdef inline real_t pow_5_2(int n):
+cdef inline real_t pow_5_2(real_t n) nogil:
     "Evaulate n ** 5/2"
-    return sqrt(n * n * n * n * n)
+    return n * n * sqrt(n)
 
-cdef inline real_t pow_7_2(int n):
+cdef inline real_t pow_7_2(real_t n) nogil:
     "Evaulate n ** 7/2"
-    return sqrt(n * n * n * n * n * n * n)
+    return n * n * n * sqrt(n)
+
+cdef inline real_t series(const real_t *coeffs, real_t n) nogil:
+    "Evaluate n ** (-1/2) * sum(coeffs[k] * n ** -k) with Horner's method"
+    cdef int k, nterms = NTERMS
+    cdef real_t result = 0, inverse = 1 / n
+
+    # Terms fall off like (5/n) ** k, so we can drop most for large n
+    if n > 10000:
+        nterms = 8
+    elif n > 100:
+        nterms = 20
+    for k in range(nterms - 1, -1, -1):
+        result = result * inverse + coeffs[k]
+    return result / sqrt(n)
+
+cdef void load_series(real_t *coeffs, expansion)
 
-# This gets updated automatically by setup.py...
-cdef int NUM_THREADS = 8
\ No newline at end of file
+# Number of OpenMP threads, set at runtime with maxr.ext.set_num_threads
+cdef int NUM_THREADS
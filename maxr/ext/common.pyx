@@ -3,4 +3,59 @@
     date:   March 2016
 
     description: Common inclusions for cython extensions
-"""
\ No newline at end of file
+"""
+
+cimport openmp
+
+import os
+from contextlib import contextmanager
+
+from maxr.integrator.expansion import NTERMS as _NTERMS
+
+def get_num_threads():
+    "Return the number of OpenMP threads used by the maxr extensions"
+    return NUM_THREADS
+
+def set_num_threads(n):
+    """
+    Set the number of OpenMP threads used by the maxr extensions
+
+    Parameters:
+        n (int) - the number of threads, must be at least one
+    """
+    global NUM_THREADS
+    n = int(n)
+    if n < 1:
+        raise ValueError("Number of threads must be at least 1, "
+                         "got {0}".format(n))
+    NUM_THREADS = n
+
+@contextmanager
+def num_threads(n):
+    """
+    Context manager to temporarily set the number of OpenMP threads
+
+    Parameters:
+        n (int) - the number of threads to use inside the context
+    """
+    old = NUM_THREADS
+    set_num_threads(n)
+    try:
+        yield
+    finally:
+        set_num_threads(old)
+
+# Default to MAXR_NUM_THREADS if it's set, otherwise leave it up to the
+# OpenMP runtime (which honours OMP_NUM_THREADS)
+set_num_threads(os.environ.get('MAXR_NUM_THREADS')
+                or openmp.omp_get_max_threads())
+
+if _NTERMS != NTERMS:
+    raise ImportError("maxr.ext is out of date with maxr.integrator.expansion, "
+                      "please rebuild the extensions")
+
+cdef void load_series(real_t *coeffs, expansion):
+    "Copy the asymptotic series for an Expansion into coeffs"
+    cdef int k
+    for k in range(NTERMS):
+        coeffs[k] = expansion.series[k]
@@ -5,7 +5,8 @@
     description: Cython description of third-order history integral terms
 """
 
-from common cimport real_t
-from common cimport uint_t
+from maxr.ext.common cimport store_t
+from maxr.ext.common cimport uint_t
 
-cdef void gamma(real_t *coeffs, uint_t n)
\ No newline at end of file
+cdef void gamma(store_t *coeffs, uint_t n) noexcept nogil
+cdef void gamma_update(store_t *coeffs, uint_t old_n, uint_t n) noexcept nogil
@@ -5,11 +5,15 @@
     description: Cython implementation of third-order history integral terms
 """
 
-from common cimport pow_3_2, pow_5_2, pow_7_2, uint_t, real_t
-from alpha cimport alpha
-from beta cimport beta
+from maxr.ext.common cimport pow_3_2, pow_5_2, pow_7_2, uint_t, real_t, \
+    store_t, series, load_series, NTERMS, NUM_THREADS, PARALLEL_MIN
+from maxr.ext.alpha cimport alpha
+from maxr.ext.beta cimport beta
 
 from libc.math cimport sqrt
+from cython.parallel cimport prange
+
+from maxr.integrator import expansion
 
 # Define some compile-time constants
 cdef real_t SQRT_2 = 1.4142135623730950488
@@ -17,10 +21,80 @@ cdef real_t SQRT_3 = 1.7320508075688772936
 cdef real_t SQRT_5 = 2.2360679774997896964
 cdef real_t SQRT_6 = 2.4494897427831780982
 
-cdef void gamma(real_t *coeffs, uint_t n):
-    "Third-order integration coefficients for history term"
+# Asymptotic series for large indices, see maxr.integrator.expansion
+cdef real_t INTERIOR[NTERMS]
+cdef real_t BOUNDARY[4][NTERMS]
+load_series(INTERIOR, expansion.GAMMA_INTERIOR)
+for _idx in range(4):
+    load_series(BOUNDARY[_idx], expansion.GAMMA_BOUNDARY[_idx])
+cdef uint_t INTERIOR_CUTOFF = expansion.GAMMA_INTERIOR.cutoff
+cdef uint_t BOUNDARY_CUTOFF = max(e.cutoff for e in expansion.GAMMA_BOUNDARY)
+
+cdef inline real_t interior(uint_t i) noexcept nogil:
+    "Interior coefficient at index i"
+    if i < INTERIOR_CUTOFF:
+        return (
+            16/105. * (pow_7_2(i+2) + pow_7_2(i-2) - 4 * pow_7_2(i+1)
+                - 4 * pow_7_2(i-1) + 6 * pow_7_2(i))
+            + 2/9. * (4 * pow_3_2(i+1) + 4 * pow_3_2(i-1) - pow_3_2(i+2)
+                - pow_3_2(i-2) - 6 * pow_3_2(i))
+        )
+    return series(INTERIOR, i)
+
+cdef void fill_interior(store_t *coeffs, uint_t start, uint_t stop) noexcept nogil:
+    "Interior coefficients for start <= i < stop, in parallel for long runs"
+    cdef Py_ssize_t i
+    if stop <= start:
+        return
+    if stop - start < PARALLEL_MIN:
+        for i in range(start, stop):
+            coeffs[i] = interior(i)
+    else:
+        for i in prange(start, stop, num_threads=NUM_THREADS,
+                        schedule='static'):
+            coeffs[i] = interior(i)
+
+cdef void boundary(store_t *coeffs, uint_t n) noexcept nogil:
+    "Right boundary coefficients for a history of length n > 6"
     cdef uint_t i
+    if n >= BOUNDARY_CUTOFF:
+        for i in range(4):
+            coeffs[n-3+i] = series(BOUNDARY[i], n)
+        return
+
+    coeffs[n-3] = (
+        16/105. * (pow_7_2(n) - 4 * pow_7_2(n-2) + 6 * pow_7_2(n-3)
+            - 4 * pow_7_2(n-4) + pow_7_2(n-5)) - 8/15. * pow_5_2(n)
+        + 4/9. * pow_3_2(n) + 8/9. * pow_3_2(n-2) - 4/3. * pow_3_2(n-3)
+        + 8/9. * pow_3_2(n-4) - 2/9. * pow_3_2(n-5)
+    )
+    coeffs[n-2] = (
+        16/105. * (pow_7_2(n-4) - 4 * pow_7_2(n-3) + 6 * pow_7_2(n-2)
+            - 3 * pow_7_2(n)) + 32/15. * pow_5_2(n) - 2 * pow_3_2(n)
+        - 4/3. * pow_3_2(n-2) + 8/9. * pow_3_2(n-3) - 2/9. * pow_3_2(n-4)
+    )
+    coeffs[n-1] = (
+        16/105. * (3 * pow_7_2(n) - 4 * pow_7_2(n-2) + pow_7_2(n-3))
+        - 8/3. * pow_5_2(n) + 4 * pow_3_2(n) + 8/9. * pow_3_2(n-2)
+        - 2/9. * pow_3_2(n-3)
+    )
+    coeffs[n] = (
+        16/105. * (pow_7_2(n-2) - pow_7_2(n)) + 16/15. * pow_5_2(n)
+        - 22/9. * pow_3_2(n) - 2/9. * pow_3_2(n-2) + 2 * sqrt(n)
+    )
 
+cdef void gamma_update(store_t *coeffs, uint_t old_n, uint_t n) noexcept nogil:
+    """Update third-order coefficients for a history of length old_n to
+    length n, only recalculating the entries which change"""
+    if old_n <= 6 or n <= 6:
+        gamma(coeffs, n)
+        return
+
+    fill_interior(coeffs, old_n-3, n-3)
+    boundary(coeffs, n)
+
+cdef void gamma(store_t *coeffs, uint_t n) noexcept nogil:
+    "Third-order integration coefficients for history term"
     if n > 6:
         # Left boundary
         coeffs[0] = 244/315. * SQRT_2
@@ -30,35 +104,10 @@ cdef void gamma(real_t *coeffs, uint_t n):
                    - 976/315. * SQRT_2
 
         # Middle
-        for i in range(4, n-3):
-            coeffs[i] = (
-                16/105. * (pow_7_2(i+2) + pow_7_2(i-2) - 4 * pow_7_2(i+1)
-                    - 4 * pow_7_2(i-1) + 6 * pow_7_2(i))
-                + 2/9. * (4 * pow_3_2(i+1) + 4 * pow_3_2(i-1) - pow_3_2(i+2)
-                    - pow_3_2(i-2) - 6 * pow_3_2(i))
-            )
+        fill_interior(coeffs, 4, n-3)
 
         # Right boundary
-        coeffs[n-3] = (
-            16/105. * (pow_7_2(n) - 4 * pow_7_2(n-2) + 6 * pow_7_2(n-3)
-                - 4 * pow_7_2(n-4) + pow_7_2(n-5)) - 8/15. * pow_5_2(n)
-            + 4/9. * pow_3_2(n) + 8/9. * pow_3_2(n-2) - 4/3. * pow_3_2(n-3)
-            + 8/9. * pow_3_2(n-4) - 2/9. * pow_3_2(n-5)
-        )
-        coeffs[n-2] = (
-            16/105. * (pow_7_2(n-4) - 4 * pow_7_2(n-3) + 6 * pow_7_2(n-2)
-                - 3 * pow_7_2(n)) + 32/15. * pow_5_2(n) - 2 * pow_3_2(n)
-            - 4/3. * pow_3_2(n-2) + 8/9. * pow_3_2(n-3) - 2/9. * pow_3_2(n-4)
-        )
-        coeffs[n-1] = (
-            16/105. * (3 * pow_7_2(n) - 4 * pow_7_2(n-2) + pow_7_2(n-3))
-            - 8/3. * pow_5_2(n) + 4 * pow_3_2(n) + 8/9. * pow_3_2(n-2)
-            - 2/9. * pow_3_2(n-3)
-        )
-        coeffs[n] = (
-            16/105. * (pow_7_2(n-2) - pow_7_2(n)) + 16/15. * pow_5_2(n)
-            - 22/9. * pow_3_2(n) - 2/9. * pow_3_2(n-2) + 2 * sqrt(n)
-        )
+        boundary(coeffs, n)
 
     # First few have to be handled specially
     elif n == 1:
@@ -0,0 +1,15 @@
+""" file:   history.pxd
+    author: Jess Robertson, CSIRO Minerals
+    date:   June 2018
+
+    description: Cython definition of history integral sums
+"""
+
+from maxr.ext.common cimport uint_t, real_t, store_t
+
+cdef real_t history_dot(const store_t *coeffs, const store_t *states,
+                        uint_t n) noexcept nogil
+
+cdef real_t history_integral(const store_t *coeffs, const store_t *states,
+                             Py_ssize_t stride, uint_t n,
+                             real_t dt) noexcept nogil
@@ -0,0 +1,119 @@
+""" file:   history.pyx
+    author: Jess Robertson, CSIRO Minerals
+    date:   June 2018
+
+    description: Cython implementation of history integral sums
+"""
+
+from cython.parallel cimport prange
+from libc.math cimport sqrt
+
+from maxr.ext.common cimport uint_t, real_t, store_t, NUM_THREADS, \
+    PARALLEL_MIN
+from maxr.ext.coefficients cimport IntegratorCoeffs
+
+cdef real_t history_dot(const store_t *coeffs, const store_t *states,
+                        uint_t n) noexcept nogil:
+    "Evaluate sum(coeffs[j] * states[n-j]) for j = 0..n"
+    cdef Py_ssize_t j
+    cdef real_t total = 0
+    if n < PARALLEL_MIN:
+        for j in range(n + 1):
+            total += <real_t> coeffs[j] * states[n - j]
+    else:
+        for j in prange(n + 1, num_threads=NUM_THREADS, schedule='static'):
+            total += <real_t> coeffs[j] * states[n - j]
+    return total
+
+cdef real_t history_integral(const store_t *coeffs, const store_t *states,
+                             Py_ssize_t stride, uint_t n,
+                             real_t dt) noexcept nogil:
+    """
+    Evaluate the history integral over n uniform steps of length dt
+
+    Calculates 2 * sqrt(n * dt) * states[0]
+    + sqrt(dt) * sum(coeffs[j] * states[n-j]), where consecutive states
+    are stride elements apart. Sums are accumulated in double precision
+    whatever the storage type.
+    """
+    cdef Py_ssize_t j
+    cdef real_t total = 0
+    if n < PARALLEL_MIN:
+        for j in range(n + 1):
+            total += <real_t> coeffs[j] * states[(n - j) * stride]
+    else:
+        for j in prange(n + 1, num_threads=NUM_THREADS, schedule='static'):
+            total += <real_t> coeffs[j] * states[(n - j) * stride]
+    return 2 * sqrt(n * dt) * states[0] + sqrt(dt) * total
+
+cdef int check_length(IntegratorCoeffs coeffs, Py_ssize_t length) except -1:
+    "Make sure a history matches the coefficients"
+    coeffs._check_open()
+    if length != coeffs.n + 1:
+        raise ValueError("Expected {0} states, got {1}".format(
+            coeffs.n + 1, length))
+    return 0
+
+def dot(IntegratorCoeffs coeffs not None, states):
+    """
+    Contract history coefficients against a state history
+
+    Equivalent to `(coeffs.as_array() * states[::-1]).sum()`, but without
+    the temporaries, and in parallel for long histories.
+
+    Parameters:
+        coeffs (IntegratorCoeffs) - the coefficients for the history
+        states (array) - the contiguous state history, oldest first, with
+            the same dtype as the coefficients
+    """
+    cdef const double[::1] dstates
+    cdef const float[::1] fstates
+    cdef real_t result
+    if coeffs._single:
+        fstates = states
+        check_length(coeffs, fstates.shape[0])
+        with nogil:
+            result = history_dot(coeffs._coeffs_f, &fstates[0], coeffs.n)
+    else:
+        dstates = states
+        check_length(coeffs, dstates.shape[0])
+        with nogil:
+            result = history_dot(coeffs._coeffs, &dstates[0], coeffs.n)
+    return result
+
+def integral(IntegratorCoeffs coeffs not None, states, real_t dt):
+    """
+    Integrate a state history sampled at uniform time steps
+
+    Equivalent to `maxr.integrator.history.integrator(states, times,
+    coeffs=coeffs)` with times spaced by dt, but without allocating any
+    temporaries. The GIL is released during the sum so threads can
+    integrate different histories concurrently.
+
+    Parameters:
+        coeffs (IntegratorCoeffs) - the coefficients for the history
+        states (array) - the state history, oldest first, with the same
+            dtype as the coefficients. Doesn't need to be contiguous, so
+            columns of a (steps, dims) history can be passed directly.
+        dt (float) - the time step between states
+    """
+    cdef const double[:] dstates
+    cdef const float[:] fstates
+    cdef real_t result
+    if dt < 0:
+        raise ValueError("Time step must be non-negative, got {0}".format(dt))
+    if coeffs._single:
+        fstates = states
+        check_length(coeffs, fstates.shape[0])
+        with nogil:
+            result = history_integral(
+                coeffs._coeffs_f, &fstates[0],
+                fstates.strides[0] // sizeof(float), coeffs.n, dt)
+    else:
+        dstates = states
+        check_length(coeffs, dstates.shape[0])
+        with nogil:
+            result = history_integral(
+                coeffs._coeffs, &dstates[0],
+                dstates.strides[0] // sizeof(real_t), coeffs.n, dt)
+    return result
@@ -0,0 +1,13 @@
+""" file:   interpolate.pxd
+    author: Jess Robertson, CSIRO Minerals
+    date:   June 2018
+
+    description: Cython definition of uniform grid interpolation
+"""
+
+from maxr.ext.common cimport real_t
+
+cdef real_t trilinear_point(const real_t[:, :, ::1] values,
+                            const real_t *lower, const real_t *upper,
+                            const real_t *inverse, const real_t *point,
+                            real_t fill_value) noexcept nogil
@@ -0,0 +1,96 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+""" file:   interpolate.pyx
+    author: Jess Robertson, CSIRO Minerals
+    date:   June 2018
+
+    description: Cython implementation of uniform grid interpolation
+"""
+
+from cython.parallel cimport prange
+from libc.math cimport floor
+import numpy as np
+
+from maxr.ext.common cimport real_t, NUM_THREADS, PARALLEL_MIN
+
+cdef real_t trilinear_point(const real_t[:, :, ::1] values,
+                            const real_t *lower, const real_t *upper,
+                            const real_t *inverse, const real_t *point,
+                            real_t fill_value) noexcept nogil:
+    "Interpolate at one point, finding the cell arithmetically"
+    cdef Py_ssize_t cell[3]
+    cdef real_t frac[3]
+    cdef real_t index, c00, c01, c10, c11
+    cdef Py_ssize_t i, j, k, axis, size
+
+    for axis in range(3):
+        # Written so that NaNs fail the bounds check too
+        if not (lower[axis] <= point[axis] <= upper[axis]):
+            return fill_value
+        size = values.shape[axis]
+        index = (point[axis] - lower[axis]) * inverse[axis]
+        cell[axis] = <Py_ssize_t> floor(index)
+        if cell[axis] > size - 2:
+            cell[axis] = size - 2
+        elif cell[axis] < 0:
+            cell[axis] = 0
+        frac[axis] = index - cell[axis]
+
+    i, j, k = cell[0], cell[1], cell[2]
+    c00 = values[i, j, k] * (1 - frac[0]) + values[i + 1, j, k] * frac[0]
+    c01 = values[i, j, k + 1] * (1 - frac[0]) \
+        + values[i + 1, j, k + 1] * frac[0]
+    c10 = values[i, j + 1, k] * (1 - frac[0]) \
+        + values[i + 1, j + 1, k] * frac[0]
+    c11 = values[i, j + 1, k + 1] * (1 - frac[0]) \
+        + values[i + 1, j + 1, k + 1] * frac[0]
+    c00 = c00 * (1 - frac[1]) + c10 * frac[1]
+    c01 = c01 * (1 - frac[1]) + c11 * frac[1]
+    return c00 * (1 - frac[2]) + c01 * frac[2]
+
+def trilinear(const real_t[:, :, ::1] values not None,
+              const real_t[::1] lower not None,
+              const real_t[::1] upper not None,
+              const real_t[:, ::1] points not None,
+              real_t fill_value, real_t[::1] out=None):
+    """
+    Trilinear interpolation on a uniform grid
+
+    Cell indices are calculated directly from the grid spacing rather than
+    by searching the axes. Points outside the grid (or with NaN coordinates)
+    get the fill value. The GIL is released, and large batches of points are
+    split between threads.
+
+    Parameters:
+        values (array) - the values on the grid, shape (nx, ny, nt), with at
+            least two points along each axis
+        lower, upper (array) - the first and last grid points along each
+            axis, shape (3,)
+        points (array) - the points to interpolate at, shape (n_points, 3)
+        fill_value (float) - the value for points outside the grid
+        out (array) - an array to put the results in, shape (n_points,).
+            Optional, a new array is allocated if not given.
+
+    Returns:
+        the interpolated values, shape (n_points,)
+    """
+    cdef real_t inverse[3]
+    cdef Py_ssize_t idx, axis, npoints = points.shape[0]
+    cdef int nthreads = NUM_THREADS if npoints >= PARALLEL_MIN else 1
+    if lower.shape[0] != 3 or upper.shape[0] != 3 or points.shape[1] != 3:
+        raise ValueError("Expected three dimensional points and bounds")
+    for axis in range(3):
+        if values.shape[axis] < 2:
+            raise ValueError("Need at least two grid points along each axis")
+        inverse[axis] = (values.shape[axis] - 1) / (upper[axis] - lower[axis])
+    if out is None:
+        out = np.empty(npoints)
+    elif out.shape[0] != npoints:
+        raise ValueError("Expected output for {0} points, got {1}".format(
+            npoints, out.shape[0]))
+
+    with nogil:
+        for idx in prange(npoints, num_threads=nthreads, schedule='static'):
+            out[idx] = trilinear_point(values, &lower[0], &upper[0],
+                                       &inverse[0], &points[idx, 0],
+                                       fill_value)
+    return np.asarray(out)
@@ -0,0 +1,17 @@
+""" file:   stepper.pxd
+    author: Jess Robertson, CSIRO Minerals
+    date:   June 2018
+
+    description: Cython definition of the particle stepping kernel
+"""
+
+from maxr.ext.common cimport uint_t, real_t
+
+cdef void step_block(const real_t[:, ::1] position,
+                     real_t[:, ::1] new_position, real_t[:, :, ::1] relative,
+                     real_t[:, :, ::1] velocities, real_t[:, :, ::1] forcing,
+                     real_t[:, ::1] history, const real_t[::1] coeffs,
+                     const real_t[:, :] velocity,
+                     const real_t[:, :, :] gradient, const real_t[:, :] dudt,
+                     uint_t index, real_t dt, real_t R, real_t S,
+                     Py_ssize_t start, Py_ssize_t stop) noexcept nogil
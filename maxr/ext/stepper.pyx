@@ -0,0 +1,152 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+""" file:   stepper.pyx
+    author: Jess Robertson, CSIRO Minerals
+    date:   June 2018
+
+    description: Cython implementation of the particle stepping kernel
+"""
+
+from cython.parallel cimport prange
+from libc.math cimport sqrt, M_PI
+
+from maxr.ext.common cimport uint_t, real_t, NUM_THREADS
+
+# Particles are updated in blocks so the history sum streams through
+# contiguous rows of the relative velocity history
+cdef enum:
+    BLOCK = 64
+
+# Adams-Bashforth weights, newest first
+cdef real_t AB2[2]
+cdef real_t AB3[3]
+AB2[:] = [3 / 2., -1 / 2.]
+AB3[:] = [23 / 12., -16 / 12., 5 / 12.]
+
+cdef void step_block(const real_t[:, ::1] position,
+                     real_t[:, ::1] new_position, real_t[:, :, ::1] relative,
+                     real_t[:, :, ::1] velocities, real_t[:, :, ::1] forcing,
+                     real_t[:, ::1] history, const real_t[::1] coeffs,
+                     const real_t[:, :] velocity,
+                     const real_t[:, :, :] gradient, const real_t[:, :] dudt,
+                     uint_t index, real_t dt, real_t R, real_t S,
+                     Py_ssize_t start, Py_ssize_t stop) noexcept nogil:
+    "Advance particles start <= p < stop by one step"
+    cdef Py_ssize_t p, i, k, m, slot, nweights
+    cdef real_t older[BLOCK][2]
+    cdef real_t w[2]
+    cdef real_t weight, advect, material, total, coeff
+    cdef real_t xi = R * sqrt(3 / (M_PI * S))
+    cdef real_t *weights = &AB2[0]
+    nweights = 2
+    if index >= 2:
+        weights, nweights = &AB3[0], 3
+    slot = index % 3
+
+    # Velocity term G = (R - 1) Du/Dt - R (w . grad) u - R w / S, and the
+    # particle velocity v = w + u
+    for p in range(start, stop):
+        for i in range(2):
+            w[i] = relative[index, p, i]
+        for i in range(2):
+            material = dudt[p, i] + gradient[p, i, 0] * velocity[p, 0] \
+                + gradient[p, i, 1] * velocity[p, 1]
+            advect = gradient[p, i, 0] * w[0] + gradient[p, i, 1] * w[1]
+            forcing[slot, p, i] = (R - 1) * material - R * advect \
+                - R / S * w[i]
+            velocities[slot, p, i] = w[i] + velocity[p, i]
+
+    # History sum over all the older relative velocities
+    for p in range(stop - start):
+        older[p][0] = older[p][1] = 0
+    for m in range(index + 1):
+        coeff = coeffs[index + 1 - m]
+        for p in range(start, stop):
+            older[p - start][0] += coeff * relative[m, p, 0]
+            older[p - start][1] += coeff * relative[m, p, 1]
+
+    # Adams-Bashforth for the positions and velocity term, then solve for
+    # the new relative velocity
+    for p in range(start, stop):
+        for i in range(2):
+            total = 0
+            for k in range(nweights):
+                total += weights[k] * velocities[(slot + 3 - k) % 3, p, i]
+            new_position[p, i] = position[p, i] + dt * total
+
+            total = 0
+            for k in range(nweights):
+                total += weights[k] * forcing[(slot + 3 - k) % 3, p, i]
+            relative[index + 1, p, i] = (
+                relative[index, p, i] + dt * total + xi * history[p, i]
+                - xi * sqrt(dt) * older[p - start][i]
+            ) / (1 + xi * sqrt(dt) * coeffs[0])
+            history[p, i] = sqrt(dt) * (
+                coeffs[0] * relative[index + 1, p, i] + older[p - start][i])
+
+def step(const real_t[:, ::1] position not None,
+         real_t[:, ::1] new_position not None,
+         real_t[:, :, ::1] relative not None,
+         real_t[:, :, ::1] velocities not None,
+         real_t[:, :, ::1] forcing not None,
+         real_t[:, ::1] history not None,
+         const real_t[::1] coeffs not None,
+         const real_t[:, :] velocity not None,
+         const real_t[:, :, :] gradient not None,
+         const real_t[:, :] dudt not None,
+         uint_t index, real_t dt, real_t R, real_t S):
+    """
+    Advance an ensemble of particles by one step of the Daitche scheme
+
+    Writes the new positions into new_position, and updates
+    relative[index + 1], the Adams-Bashforth buffers and the history
+    integral in place, using Adams-Bashforth of order min(index + 1, 3).
+    Only valid for index >= 1, since the first step needs the flow at the
+    new positions (see maxr.integrator.integrator).
+    The GIL is released and blocks of particles are updated in parallel.
+
+    Parameters:
+        position (array) - particle positions at the current step, shape
+            (P, 2)
+        new_position (array) - the particle positions at the next step are
+            written here, shape (P, 2). Only the current positions are
+            needed, so callers can keep as few steps as they like.
+        relative (array) - relative velocity history w = v - u, shape
+            (n_steps + 1, P, 2)
+        velocities, forcing (array) - Adams-Bashforth buffers for the
+            particle velocity and velocity term, shape (3, P, 2), with step
+            n stored at n % 3
+        history (array) - the history integral at the current step, shape
+            (P, 2), updated to the next step
+        coeffs (array) - third-order history coefficients for a history of
+            length index + 1
+        velocity, gradient, dudt (array) - the flow velocity, velocity
+            gradient (gradient[p, i, j] = du_i/dx_j) and time derivative at
+            the current positions
+        index (int) - the current step
+        dt, R, S (float) - timestep and non-dimensional parameters
+    """
+    cdef Py_ssize_t block, nblocks
+    cdef Py_ssize_t nparticles = position.shape[0]
+    if index < 1 or index + 1 >= relative.shape[0]:
+        raise IndexError("Step index {0} out of range".format(index))
+    if coeffs.shape[0] != index + 2:
+        raise ValueError("Expected {0} coefficients, got {1}".format(
+            index + 2, coeffs.shape[0]))
+    if velocities.shape[0] != 3 or forcing.shape[0] != 3:
+        raise ValueError("Adams-Bashforth buffers have the wrong number of "
+                         "steps")
+    for length in (new_position.shape[0], relative.shape[1],
+                   velocities.shape[1], forcing.shape[1], history.shape[0],
+                   velocity.shape[0], gradient.shape[0], dudt.shape[0]):
+        if length != nparticles:
+            raise ValueError("Expected arrays for {0} particles, got "
+                             "{1}".format(nparticles, length))
+
+    nblocks = (nparticles + BLOCK - 1) // BLOCK
+    with nogil:
+        for block in prange(nblocks, num_threads=NUM_THREADS,
+                            schedule='static'):
+            step_block(position, new_position, relative, velocities,
+                       forcing, history, coeffs, velocity, gradient, dudt,
+                       index, dt, R, S, block * BLOCK,
+                       min((block + 1) * BLOCK, nparticles))
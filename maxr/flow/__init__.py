@@ -1,5 +1,7 @@
 from .flow import Flow
+from .interpolation import UniformGridInterpolator
 from .generators import from_function
 from .blink import tick, tock, blink, vortex
 
-__all__ = ['Flow', 'from_function', 'tick', 'tock', 'blink', 'vortex']
+__all__ = ['Flow', 'UniformGridInterpolator', 'from_function', 'tick', 'tock',
+           'blink', 'vortex']
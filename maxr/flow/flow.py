@@ -8,31 +8,135 @@
 
 from __future__ import print_function, division
 
+from collections import OrderedDict
+
 import h5py
-from numpy import meshgrid, sqrt
+from numpy import meshgrid, sqrt, nan, memmap, asarray, atleast_1d, stack, \
+    broadcast_arrays
 from scipy.interpolate import RegularGridInterpolator
 import matplotlib.pyplot as plt
 
+from .interpolation import UniformGridInterpolator, is_uniform
+
 
 class Flow(object):
 
     """ Manager for gridded flow data
+
+        Evenly spaced grids (like the ones written by from_function) are
+        interpolated with UniformGridInterpolator, and anything else with
+        scipy's RegularGridInterpolator. Interpolators are cached, one per
+        field, so the grid and field values are only read from the file
+        once. Uncompressed contiguous fields (as written by from_function)
+        are memory-mapped rather than read into memory. Once the total size
+        of the cached fields exceeds the memory budget, the least recently
+        used interpolators are evicted.
+
+        Parameters:
+            filename - the HDF5 file holding the flow
+            max_bytes - the memory budget for cached fields, in bytes
+                (defaults to 1 GB)
+            mmap - whether to memory-map fields where possible (defaults to
+                True)
     """
 
-    def __init__(self, filename):
-        self.data = h5py.File(filename)
+    def __init__(self, filename, max_bytes=2 ** 30, mmap=True):
+        self.filename = filename
+        self.data = h5py.File(filename, 'r')
+        self.max_bytes = max_bytes
+        self.mmap = mmap
+        self.hits = self.misses = self.nbytes = 0
+        self._axes = None
+        self._interpolators = OrderedDict()
 
     def close(self):
         """ Close files gracefully
         """
+        self.invalidate()
         self.data.close()
 
     def __call__(self, key):
         """ Returns an interpolation for the given value for the snapshot at idx
+
+            Points outside the grid get NaN rather than raising, so that one
+            particle leaving the domain doesn't stop the others.
+        """
+        try:
+            interpolator = self._interpolators.pop(key)
+            self._interpolators[key] = interpolator  # most recently used
+            self.hits += 1
+            return interpolator
+        except KeyError:
+            self.misses += 1
+
+        if self._axes is None:
+            self._axes = tuple(self.data[axis][...] for axis in 'xyt')
+        values = self._load(key)
+        if all(is_uniform(axis) for axis in self._axes):
+            interpolator = UniformGridInterpolator(
+                points=self._axes, values=values, fill_value=nan)
+        else:
+            interpolator = RegularGridInterpolator(
+                points=self._axes, values=values, bounds_error=False,
+                fill_value=nan)
+        self._interpolators[key] = interpolator
+        self.nbytes += values.nbytes
+        self._evict()
+        return interpolator
+
+    def _load(self, key):
+        "Memory-map a field if we can, otherwise read it in"
+        dset = self.data[key]
+        offset = dset.id.get_offset()
+        if self.mmap and dset.chunks is None and offset is not None:
+            return memmap(self.filename, mode='r', dtype=dset.dtype,
+                          shape=dset.shape, offset=offset)
+        return dset[...]
+
+    def _evict(self):
+        "Drop least recently used interpolators until we're within budget"
+        while self.nbytes > self.max_bytes and len(self._interpolators) > 1:
+            _, interpolator = self._interpolators.popitem(last=False)
+            self.nbytes -= interpolator.values.nbytes
+
+    def invalidate(self, key=None):
+        """ Drop cached interpolators, e.g. after the file has changed
+
+            Parameters:
+                key - the field to drop. Optional, defaults to dropping
+                    everything (including the grid).
+        """
+        if key is None:
+            self._interpolators.clear()
+            self._axes, self.nbytes = None, 0
+        elif key in self._interpolators:
+            self.nbytes -= self._interpolators.pop(key).values.nbytes
+
+    @property
+    def domain(self):
+        """ The spatial extent ((xmin, xmax), (ymin, ymax)) of the grid
+        """
+        return tuple((self.data[axis][0], self.data[axis][-1])
+                     for axis in 'xy')
+
+    def velocity(self, xxs, yys, times):
+        """ Interpolate the velocity at the given points and times
+
+            This has the same signature as the analytic flows in
+            maxr.flow.blink, so it can be handed straight to an Integrator.
+
+            Parameters:
+                xxs, yys - arrays of point coordinates
+                times - an array of times
+
+            Returns:
+                the u and v velocity components, each with shape
+                (n_points, n_times)
         """
-        return RegularGridInterpolator(
-            points=(self.data['x'], self.data['y'], self.data['t']),
-            values=self.data[key])
+        xxs, yys, times = asarray(xxs), asarray(yys), atleast_1d(times)
+        points = stack(broadcast_arrays(
+            xxs[:, None], yys[:, None], times[None, :]), axis=-1)
+        return self('u')(points), self('v')(points)
 
     def info(self):
         """ Print some info about the keys defined here
@@ -0,0 +1,122 @@
+""" file: interpolation.py (maxr.flow)
+    author: Jess Robertson
+            CSIRO Mineral Resources
+    date:   June 2018
+
+    description: Fast interpolation on uniform grids
+"""
+
+from __future__ import print_function, division
+
+from itertools import product
+
+from numpy import asarray, array, diff, floor, clip, nan, \
+    ascontiguousarray, float64, intp
+
+try:
+    from ..ext import interpolate
+except ImportError:
+    interpolate = None
+
+
+def is_uniform(axis, rtol=1e-8):
+    """ Check whether grid points are evenly spaced
+
+        Parameters:
+            axis - the grid points along an axis
+            rtol - the relative tolerance on the spacing (defaults to 1e-8,
+                loose enough for the roundoff in numpy.linspace)
+    """
+    axis = asarray(axis, dtype=float)
+    if len(axis) < 2:
+        return False
+    spacing = (axis[-1] - axis[0]) / (len(axis) - 1)
+    return spacing > 0 and (abs(diff(axis) - spacing) <= rtol * spacing).all()
+
+
+class UniformGridInterpolator(object):
+
+    """ Trilinear interpolation on a uniform (x, y, t) grid
+
+        A drop-in replacement for scipy's RegularGridInterpolator for evenly
+        spaced grids like the ones written by from_function. The cell
+        containing each point is calculated directly from the grid spacing
+        rather than by binary searching the axes. Uses the compiled kernel
+        in maxr.ext.interpolate if the extensions are built, and vectorized
+        numpy otherwise.
+
+        Parameters:
+            points - the grid points along each of the three axes, which
+                must be evenly spaced and increasing
+            values - the values on the grid, with shape (nx, ny, nt)
+            fill_value - the value for points outside the grid (defaults to
+                NaN)
+    """
+
+    # Use the compiled kernel if the extensions are built
+    compiled = interpolate is not None
+
+    def __init__(self, points, values, fill_value=nan):
+        super(UniformGridInterpolator, self).__init__()
+        self.grid = tuple(asarray(axis, dtype=float) for axis in points)
+        if len(self.grid) != 3:
+            raise ValueError("Expected three axes, got {0}".format(
+                len(self.grid)))
+        if not all(is_uniform(axis) for axis in self.grid):
+            raise ValueError("Grid axes must be evenly spaced and "
+                             "increasing")
+        self.values = asarray(values)
+        if self.values.shape != tuple(len(axis) for axis in self.grid):
+            raise ValueError("Values with shape {0} don't match the "
+                             "grid".format(self.values.shape))
+        self.fill_value = fill_value
+        self.lower = array([axis[0] for axis in self.grid])
+        self.upper = array([axis[-1] for axis in self.grid])
+        self.shape = array(self.values.shape)
+        self.inverse = (self.shape - 1) / (self.upper - self.lower)
+
+    def __call__(self, xi):
+        """ Interpolate at the given points
+
+            Parameters:
+                xi - the points to interpolate at, with shape (..., 3)
+
+            Returns:
+                the interpolated values, with shape xi.shape[:-1]
+        """
+        xi = asarray(xi, dtype=float)
+        if xi.shape[-1] != 3:
+            raise ValueError("Expected points with shape (..., 3), got "
+                             "{0}".format(xi.shape))
+        points = ascontiguousarray(xi.reshape(-1, 3))
+        if self.compiled and self.values.dtype == float64 \
+                and self.values.flags.c_contiguous:
+            result = interpolate.trilinear(
+                self.values, self.lower, self.upper, points,
+                self.fill_value)
+        else:
+            result = self._interpolate(points)
+        return result.reshape(xi.shape[:-1])
+
+    def _interpolate(self, points):
+        "Interpolate with numpy"
+        outside = ~((points >= self.lower) & (points <= self.upper)).all(-1)
+        index = (points - self.lower) * self.inverse
+        index[outside] = 0
+        cell = clip(floor(index), 0, self.shape - 2).astype(intp)
+        frac = index - cell
+
+        # Sum over the corners of each cell
+        result = 0.
+        for corner in product((0, 1), repeat=3):
+            weight = 1.
+            for axis, offset in enumerate(corner):
+                weight = weight * (frac[:, axis] if offset
+                                   else 1 - frac[:, axis])
+            result = result + weight * self.values[
+                cell[:, 0] + corner[0], cell[:, 1] + corner[1],
+                cell[:, 2] + corner[2]]
+        result = asarray(result, dtype=float)
+        if outside.any():
+            result[outside] = self.fill_value
+        return result
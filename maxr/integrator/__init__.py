@@ -1 +1,4 @@
-from . import integrator, history
\ No newline at end of file
+from . import integrator, history, writer
+
+# maxr.integrator.shared and maxr.integrator.ensemble need python 3.8 or
+# later (for multiprocessing.shared_memory), so import them directly
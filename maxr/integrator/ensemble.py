@@ -0,0 +1,172 @@
+""" file: ensemble.py (maxr.integrator)
+    author: Jess Robertson
+            CSIRO Mineral Resources
+    date:   June 2018
+
+    description: Integration of large particle ensembles in a process pool
+"""
+
+from __future__ import print_function, division
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+
+import h5py
+from numpy import asarray, empty, arange
+
+from .integrator import Integrator
+
+# The flow function for this worker process, set up by _initialise
+_FLOW = None
+
+
+def _initialise(flow):
+    """ Set up a worker process
+
+        Opens the flow (from file if given a filename) once per worker, and
+        stops the compiled extensions starting their own threads since the
+        pool already uses every core.
+    """
+    global _FLOW
+    if isinstance(flow, str):
+        from ..flow import Flow
+        _FLOW = Flow(flow).velocity
+    else:
+        _FLOW = flow()
+
+    try:
+        from ..ext import set_num_threads
+        set_num_threads(1)
+    except ImportError:
+        pass
+
+
+def _integrate_chunk(parameters, positions, velocities, time):
+    "Integrate one chunk of particles in a worker"
+    return Integrator(_FLOW, parameters).integrate(
+        positions, velocities, time)
+
+
+class EnsembleIntegrator(object):
+
+    """ Integrate a large ensemble of independent particles in parallel
+
+        The initial positions are split into chunks which are integrated
+        with an Integrator in a pool of worker processes. Workers open the
+        flow themselves rather than being sent a copy, so only the initial
+        conditions and parameters are pickled on the way out. Results are
+        gathered into a single array, or written straight into an HDF5 file
+        as each chunk finishes so the whole ensemble never has to fit in
+        memory. Only `queued` chunks per worker are handed to the pool at
+        a time, and each chunk's result is dropped as soon as it's stored.
+
+        Parameters:
+            flow - either the path to a flow HDF5 file (see maxr.flow.Flow)
+                which each worker opens for itself, or a picklable function
+                taking no arguments which returns a flow function, for
+                example functools.partial(maxr.flow.blink, gamma=1,
+                period=1)
+            parameters - an instance of maxr.Parameters which contains
+                the parameters for the integration
+            max_workers - the number of worker processes. Optional, defaults
+                to the number of CPUs.
+            chunk_size - the number of particles in each chunk. Optional,
+                defaults to splitting the ensemble into four chunks per
+                worker so that the load stays balanced.
+            context - the multiprocessing start method (defaults to
+                'spawn', since forking a process which has already started
+                OpenMP threads or opened HDF5 files isn't safe)
+    """
+
+    # Chunks in flight per worker, so workers always have another chunk to
+    # start on while finished ones are being stored
+    queued = 2
+
+    def __init__(self, flow, parameters, max_workers=None, chunk_size=None,
+                 context='spawn'):
+        super(EnsembleIntegrator, self).__init__()
+        self.flow = flow
+        self.parameters = parameters
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.context = context
+
+    def chunks(self, nparticles):
+        """ Return a list of slices splitting up the particles
+
+            Parameters:
+                nparticles - the number of particles in the ensemble
+        """
+        size = self.chunk_size \
+            or -(-nparticles // (4 * self.max_workers)) or 1
+        return [slice(start, min(start + size, nparticles))
+                for start in arange(0, nparticles, size)]
+
+    def integrate(self, positions, velocities=None, time=0, filename=None,
+                  dataset='trajectory'):
+        """ Integrate the ensemble
+
+            Parameters:
+                positions - the initial particle positions, with shape
+                    (n_particles, 2)
+                velocities - the initial particle velocities. Optional,
+                    defaults to the fluid velocity at each particle.
+                time - the initial time (defaults to zero)
+                filename - an HDF5 file to write the trajectories to.
+                    Optional, defaults to returning them instead.
+                dataset - the name of the dataset in the HDF5 file (defaults
+                    to 'trajectory')
+
+            Returns:
+                the particle trajectories, with shape
+                (n_steps + 1, n_particles, 2), or None if they're written to
+                file
+        """
+        positions = asarray(positions, dtype=float)
+        if velocities is not None:
+            velocities = asarray(velocities, dtype=float)
+        shape = (self.parameters.N + 1,) + positions.shape
+
+        if filename is None:
+            result = empty(shape)
+            self._run(positions, velocities, time, result)
+            return result
+
+        with h5py.File(filename, 'w') as fhandle:
+            result = fhandle.create_dataset(dataset, shape=shape,
+                                            dtype=float)
+            for idx, label in enumerate(('t', 'particle', 'component')):
+                result.dims[idx].label = label
+            result.attrs['dt'] = self.parameters.dt
+            result.attrs['t0'] = time
+            self._run(positions, velocities, time, result)
+
+    def _run(self, positions, velocities, time, result):
+        "Farm chunks out to the pool, and store the results as they finish"
+        context = multiprocessing.get_context(self.context)
+        with ProcessPoolExecutor(self.max_workers, mp_context=context,
+                                 initializer=_initialise,
+                                 initargs=(self.flow,)) as pool:
+            chunks, futures = iter(self.chunks(len(positions))), {}
+
+            def submit(chunk):
+                "Hand a chunk to the pool"
+                future = pool.submit(
+                    _integrate_chunk, self.parameters, positions[chunk],
+                    velocities[chunk] if velocities is not None else None,
+                    time)
+                futures[future] = chunk
+
+            for chunk in islice(chunks, self.queued * self.max_workers):
+                submit(chunk)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result[:, futures.pop(future)] = future.result()
+                    chunk = next(chunks, None)
+                    if chunk is not None:
+                        submit(chunk)
+
+                # Let go of the finished futures, and with them the results
+                del done, future
@@ -0,0 +1,159 @@
+""" file: expansion.py (maxr.integrator)
+    author: Jess Robertson
+            CSIRO Mineral Resources
+    date:   June 2018
+
+    description: Cancellation-free evaluation of history coefficient formulas
+"""
+
+from __future__ import print_function, division
+
+from fractions import Fraction
+
+from numpy import asarray, array, empty, sqrt
+
+# Number of terms in the asymptotic series
+NTERMS = 48
+
+
+class Expansion(object):
+
+    """ A sum of shifted half-integer powers, sum(coeff * (n + offset) ** power)
+
+        The interior and right boundary history coefficients are all finite
+        difference stencils of this form. Evaluating them directly for large n
+        means subtracting numbers of size n ** (7/2) to get an answer of size
+        n ** (-1/2), so all precision is lost by n ~ 10^4. Instead, for large n
+        we expand each power binomially in 1/n and collect the terms exactly
+        with rational arithmetic - the positive powers cancel identically and
+        we're left with a rapidly converging series
+
+            n ** (-1/2) * sum(series[k] * n ** -k)
+
+        Parameters:
+            terms - a list of (coeff, power, offset) tuples, with coeff and
+                power given as Fractions (or ints)
+    """
+
+    def __init__(self, terms):
+        super(Expansion, self).__init__()
+        self.terms = [(Fraction(c), Fraction(p), int(o)) for c, p, o in terms]
+
+        # Switch to the series once it converges quickly
+        self.cutoff = 2 * max(abs(o) for _, _, o in self.terms) + 4
+        self.series = array([float(s) for s in self._series()])
+
+    def _series(self):
+        "Calculate the exact series coefficients"
+        half = Fraction(1, 2)
+        series = {}
+        for coeff, power, offset in self.terms:
+            # (n + offset) ** power = sum(binom(power, m) * offset ** m
+            #                             * n ** (power - m))
+            binom = Fraction(1)
+            for m in range(int(power + half) + NTERMS):
+                # Exponent is power - m = -1/2 - k
+                kidx = int(m - power - half)
+                series[kidx] = series.get(kidx, 0) + coeff * binom * offset ** m
+                binom *= (power - m) / (m + 1)
+
+        # All the positive powers should cancel
+        for kidx in range(min(series), 0):
+            if series[kidx] != 0:
+                raise ValueError("Expansion has a non-vanishing n ** {0} "
+                                 "term".format(-half - kidx))
+        return [series[kidx] for kidx in range(NTERMS)]
+
+    def direct(self, num):
+        "Evaluate the sum of powers directly"
+        num = asarray(num, dtype=float)
+        result = 0.
+        for coeff, power, offset in self.terms:
+            result = result + float(coeff) * (num + offset) ** float(power)
+        return result
+
+    def asymptotic(self, num):
+        "Evaluate the asymptotic series with Horner's method"
+        num = asarray(num, dtype=float)
+        inverse = 1 / num
+        result = 0.
+        for coeff in self.series[::-1]:
+            result = result * inverse + coeff
+        return result / sqrt(num)
+
+    def __call__(self, num):
+        """ Evaluate the expansion at num
+
+            Uses the direct formula below the cutoff and the asymptotic series
+            above it.
+        """
+        num = asarray(num)
+        if num.ndim == 0:
+            if num < self.cutoff:
+                return self.direct(num)[()]
+            return self.asymptotic(num)[()]
+
+        result = empty(num.shape)
+        small = num < self.cutoff
+        result[small] = self.direct(num[small])
+        result[~small] = self.asymptotic(num[~small])
+        return result
+
+
+def stencil(coeff, power, weights):
+    """ Build terms for coeff * sum(weight * (n + offset) ** power)
+
+        Parameters:
+            coeff - the overall coefficient
+            power - the power to raise each shifted index to
+            weights - a dict mapping offsets to weights
+    """
+    coeff, power = Fraction(coeff), Fraction(power)
+    return [(coeff * Fraction(weight), power, offset)
+            for offset, weight in weights.items()]
+
+
+## STENCILS
+# Interior coefficients are stencils in the index j, right boundary
+# coefficients are stencils in the length of the history num
+F = Fraction
+
+ALPHA_INTERIOR = Expansion(
+    stencil(F(4, 3), F(3, 2), {-1: 1, 1: 1, 0: -2}))
+ALPHA_BOUNDARY = [
+    Expansion(stencil(F(4, 3), F(3, 2), {-1: 1, 0: -1})
+              + stencil(2, F(1, 2), {0: 1}))]
+
+BETA_INTERIOR = Expansion(
+    stencil(F(8, 15), F(5, 2), {2: 1, 1: -3, 0: 3, -1: -1})
+    + stencil(F(2, 3), F(3, 2), {2: -1, 1: 3, 0: -3, -1: 1}))
+BETA_BOUNDARY = [
+    Expansion(stencil(F(8, 15), F(5, 2), {0: -2, -1: 3, -2: -1})
+              + stencil(F(2, 3), F(3, 2), {0: 4, -1: -3, -2: 1})),
+    Expansion(stencil(F(8, 15), F(5, 2), {0: 1, -1: -1})
+              + stencil(F(2, 3), F(3, 2), {0: -3, -1: 1})
+              + stencil(2, F(1, 2), {0: 1}))]
+
+GAMMA_INTERIOR = Expansion(
+    stencil(F(16, 105), F(7, 2), {2: 1, -2: 1, 1: -4, -1: -4, 0: 6})
+    + stencil(F(2, 9), F(3, 2), {1: 4, -1: 4, 2: -1, -2: -1, 0: -6}))
+GAMMA_BOUNDARY = [
+    Expansion(stencil(F(16, 105), F(7, 2),
+                      {0: 1, -2: -4, -3: 6, -4: -4, -5: 1})
+              + stencil(F(-8, 15), F(5, 2), {0: 1})
+              + stencil(1, F(3, 2), {0: F(4, 9), -2: F(8, 9), -3: F(-4, 3),
+                                     -4: F(8, 9), -5: F(-2, 9)})),
+    Expansion(stencil(F(16, 105), F(7, 2), {-4: 1, -3: -4, -2: 6, 0: -3})
+              + stencil(F(32, 15), F(5, 2), {0: 1})
+              + stencil(1, F(3, 2), {0: -2, -2: F(-4, 3), -3: F(8, 9),
+                                     -4: F(-2, 9)})),
+    Expansion(stencil(F(16, 105), F(7, 2), {0: 3, -2: -4, -3: 1})
+              + stencil(F(-8, 3), F(5, 2), {0: 1})
+              + stencil(1, F(3, 2), {0: 4, -2: F(8, 9), -3: F(-2, 9)})),
+    Expansion(stencil(F(16, 105), F(7, 2), {-2: 1, 0: -1})
+              + stencil(F(16, 15), F(5, 2), {0: 1})
+              + stencil(1, F(3, 2), {0: F(-22, 9), -2: F(-2, 9)})
+              + stencil(2, F(1, 2), {0: 1}))]
+
+INTERIOR = {1: ALPHA_INTERIOR, 2: BETA_INTERIOR, 3: GAMMA_INTERIOR}
+BOUNDARY = {1: ALPHA_BOUNDARY, 2: BETA_BOUNDARY, 3: GAMMA_BOUNDARY}
@@ -5,17 +5,205 @@
 
 from __future__ import print_function, division
 
-from numpy import arange, empty, sqrt, array
+import os
+import tempfile
+from collections import OrderedDict, namedtuple
+
+from numpy import arange, empty, sqrt, array, asarray, zeros, tensordot, \
+    moveaxis, matmul, exp, expm1, log, log10, logspace, outer, pi, where, \
+    multiply, diff, concatenate, ceil, log2, load, save
+from numpy.fft import rfft, irfft
+
+from .expansion import INTERIOR, BOUNDARY
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses entries nbytes max_bytes')
+
+
+class CoefficientCache(object):
+
+    """ A least-recently-used cache for history integration coefficients
+
+        Coefficient arrays are keyed on (num, order). Once the total size of
+        the cached arrays exceeds the memory budget, the least recently used
+        arrays are evicted. Cached arrays are returned read-only since they
+        are shared between callers.
+
+        Parameters:
+            max_bytes - the memory budget for the cached arrays, in bytes
+                (defaults to 64 MB). Set to zero to disable caching.
+            compute - a function taking (num, order) and returning the
+                coefficient array, where num can be any hashable key.
+                Defaults to the uniform step coefficients, keyed on the
+                length of the history.
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20, compute=None):
+        super(CoefficientCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.compute = compute
+        self.hits = self.misses = self.nbytes = 0
+        self._arrays = OrderedDict()
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def __contains__(self, key):
+        return key in self._arrays
+
+    def __call__(self, num, order=3):
+        """ Return the coefficients for the given length and order,
+            calculating them if they're not already cached
+        """
+        key = (num, order)
+        try:
+            coeffs = self._arrays.pop(key)
+            self._arrays[key] = coeffs  # mark as most recently used
+            self.hits += 1
+            return coeffs
+        except KeyError:
+            self.misses += 1
+
+        coeffs = (self.compute or _coefficients)(num, order)
+        coeffs.flags.writeable = False
+        if coeffs.nbytes <= self.max_bytes:
+            self._arrays[key] = coeffs
+            self.nbytes += coeffs.nbytes
+            self._evict()
+        return coeffs
+
+    def _evict(self):
+        "Drop least recently used arrays until we're within budget"
+        while self.nbytes > self.max_bytes:
+            _, coeffs = self._arrays.popitem(last=False)
+            self.nbytes -= coeffs.nbytes
+
+    def resize(self, max_bytes):
+        """ Change the memory budget, evicting arrays if required
+
+            Parameters:
+                max_bytes - the new memory budget, in bytes
+        """
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self):
+        """ Empty the cache and reset the hit/miss counters
+        """
+        self._arrays.clear()
+        self.hits = self.misses = self.nbytes = 0
+
+    def info(self):
+        """ Return a CacheInfo tuple with cache statistics
+        """
+        return CacheInfo(self.hits, self.misses, len(self._arrays),
+                         self.nbytes, self.max_bytes)
+
+
+class CoefficientStore(object):
+
+    """ An on-disk store for long coefficient vectors
+
+        Coefficients are kept as .npy files in a directory, keyed on the
+        order and a length rounded up to a power of two. Files are opened
+        as copy-on-write memory maps, so every process using the store
+        shares the same physical pages. Since only the right boundary
+        entries depend on the length of the history, a lookup just maps the
+        first num + 1 entries of the next longest file and overwrites the
+        last few with `boundary(num, order)`.
+
+        Use it as the `compute` function for a CoefficientCache, or call
+        `use_store` to switch `coefficients` over to it.
+
+        Parameters:
+            path - the directory to keep the coefficient files in, created
+                if it doesn't exist
+            min_length - histories shorter than this are just calculated
+                directly (defaults to 1024)
+    """
+
+    def __init__(self, path, min_length=1024):
+        super(CoefficientStore, self).__init__()
+        self.path = path
+        self.min_length = min_length
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def filename(self, length, order):
+        "Return the path to the file for the given length and order"
+        return os.path.join(
+            self.path, 'order{0}_{1}.npy'.format(order, length))
+
+    def __call__(self, num, order=3):
+        """ Return the coefficients for the given length and order,
+            creating the file which holds them if required
+        """
+        if num < self.min_length or num <= MIN_NUM.get(order, 0):
+            return _coefficients(num, order)
+        length = 2 ** int(ceil(log2(num)))
+        fname = self.filename(length, order)
+        if not os.path.exists(fname):
+            self._write(fname, length, order)
+
+        coeffs = load(fname, mmap_mode='c')[:num + 1]
+        right = boundary(num, order)
+        coeffs[-len(right):] = right
+        coeffs.flags.writeable = False
+        return coeffs
+
+    def _write(self, fname, length, order):
+        "Calculate coefficients and move them into place atomically"
+        handle, tmpname = tempfile.mkstemp(suffix='.npy', dir=self.path)
+        try:
+            with os.fdopen(handle, 'wb') as sink:
+                save(sink, _coefficients(length, order))
+            os.replace(tmpname, fname)
+        except BaseException:
+            os.remove(tmpname)
+            raise
+
+    def clear(self):
+        "Remove all the coefficient files from the store"
+        for fname in os.listdir(self.path):
+            if fname.startswith('order') and fname.endswith('.npy'):
+                os.remove(os.path.join(self.path, fname))
+
+
+# Process-wide cache used by `coefficients`
+CACHE = CoefficientCache()
+
+
+def use_store(path):
+    """ Keep long coefficient vectors used by `coefficients` on disk
+
+        Coefficients are then shared between processes using the same
+        store (see `CoefficientStore`). The store is also switched on at
+        import if the MAXR_COEFFICIENT_STORE environment variable is set.
+
+        Parameters:
+            path - the directory to keep the coefficient files in, or None
+                to go back to calculating coefficients in memory
+    """
+    CACHE.clear()
+    CACHE.compute = CoefficientStore(path) if path is not None else None
+
 
 # Just to make it easy for everyone
 def coefficients(num, order=3):
     """ Return the coefficients for the given order
 
+        Coefficients are memoized in `CACHE`, so the returned array is
+        read-only - take a copy if you need to modify it.
+
         Parameters:
             num - the number of coefficients to get (i.e. the length of your
                 state history vector)
             order - the order of the integrator scheme.
     """
+    return CACHE(num, order)
+
+
+def _coefficients(num, order):
+    "Calculate the coefficients for the given order without caching"
     if order == 3:
         return gamma(num)
     elif order == 2:
@@ -26,36 +214,590 @@ def coefficients(num, order=3):
         raise ValueError("Order must be one of 1, 2 or 3")
 
 
-def integrator(states, times, order=3):
+if os.environ.get('MAXR_COEFFICIENT_STORE'):
+    use_store(os.environ['MAXR_COEFFICIENT_STORE'])
+
+
+def integrator(states, times, order=3, coeffs=None):
     """ A history integrator which integrates a given history from the start to the end
 
+        If the time levels aren't evenly spaced the first and second order
+        schemes use weights calculated from the actual time levels (see
+        `variable_coefficients`). The third order scheme needs uniform
+        steps.
+
+        This sums over the whole history. For long runs where that's too
+        expensive, CompressedHistory integrates the recent steps exactly and
+        carries the older ones in a fixed number of auxiliary variables.
+
         Parameters:
             states - a vector of states (i.e. the history) to integrate
             times - the times corresponding to each state measurement
             order - the order of the integrator (defaults to third-order)
+            coeffs - precomputed coefficients for the history length and
+                order, for example a maxr.ext.coefficients.IntegratorCoeffs,
+                which are used without copying. Only valid for uniform
+                steps. Defaults to looking them up with `coefficients`.
     """
     _num = len(states)-1
     const = 2 * sqrt(times[-1] - times[0]) * states[0]
+    if not uniform(times):
+        if coeffs is not None:
+            raise ValueError("Precomputed coefficients are for uniform "
+                             "steps, but the time levels aren't evenly "
+                             "spaced")
+        weights = variable_coefficients(times, order)
+        return const + (weights * states).sum()
+    elif coeffs is None:
+        coeffs = coefficients(_num, order)
+    else:
+        coeffs = asarray(coeffs)
+        if len(coeffs) != _num + 1:
+            raise ValueError("Expected {0} coefficients, got "
+                             "{1}".format(_num + 1, len(coeffs)))
+    return const + sqrt(times[1] - times[0]) \
+        * (coeffs * states[::-1]).sum()
+
+
+def tail_weights(times, time):
+    """ Weights for integrating linearly interpolated states against the
+        history kernel
+
+        Returns weights such that (weights * states).sum() is the integral
+        of state / sqrt(time - tau) from times[0] to times[-1], where the
+        states are linearly interpolated between the given times. The
+        integrals over each segment are calculated analytically.
+
+        Parameters:
+            times - the times corresponding to each state measurement
+            time - the time at which the history integral is evaluated. Must
+                be later than times[-1].
+    """
+    rdist = sqrt(time - asarray(times))
+    width = diff(times)
+    start, end = rdist[:-1], rdist[1:]
+
+    # Integrals of 1 and (tau - times[i]) / width against the kernel over
+    # each segment, rearranged to avoid cancellation for distant segments
+    const = 2 * width / (start + end)
+    slope = 2/3 * width * (start + 2 * end) / (start + end) ** 2
+    weights = zeros(len(rdist))
+    weights[:-1] += slope
+    weights[1:] += const - slope
+    return weights
+
+
+def uniform(times, rtol=1e-10):
+    """ Check whether the time levels are evenly spaced
+
+        Parameters:
+            times - the times corresponding to each state measurement
+            rtol - the relative tolerance on the differences between steps
+    """
+    steps = diff(times)
+    if len(steps) == 0:
+        return True
+    return abs(steps - steps[0]).max() <= rtol * abs(steps[0])
+
+
+def _check_step(step, timestep, rtol=1e-10):
+    "Raise a ValueError unless a step matches the uniform timestep"
+    if abs(step - timestep) > rtol * abs(timestep):
+        raise ValueError("Expected evenly spaced time levels with a step of "
+                         "{0}, got a step of {1}".format(timestep, step))
+
+
+def variable_coefficients(times, order=2):
+    """ Return weights for a history with arbitrary time levels
+
+        Returns weights such that (weights * states).sum() integrates
+        state / sqrt(times[-1] - tau) from times[0] to times[-1]. Unlike the
+        uniform coefficients these are ordered like the states (oldest
+        first) and already include the step size. They aren't cached, since
+        adaptive steps rarely repeat and calculating them costs about the
+        same as the history sum itself.
+
+        The states are interpolated the same way as in the uniform schemes,
+        so for evenly spaced times the weights are the uniform coefficients
+        (reversed and scaled by the square root of the step). Results don't
+        jump when the time levels drift off uniform.
+
+        Parameters:
+            times - the times corresponding to each state measurement
+            order - the order of the integrator scheme, either 1 (piecewise
+                linear states) or 2 (piecewise quadratic states)
+    """
+    if order not in (1, 2):
+        raise ValueError("Variable step coefficients are only available "
+                         "for orders 1 and 2")
+    steps = diff(asarray(times, dtype=float))
+    if (steps <= 0).any():
+        raise ValueError("Time levels must be strictly increasing")
+    return _variable_coefficients(steps, order)
+
+
+def _variable_coefficients(steps, order):
+    "Calculate the variable step weights from the steps between levels"
+    times = concatenate([[0], steps.cumsum()])
+    if order == 1 or len(steps) < 2:
+        return tail_weights(times, times[-1])
+
+    # Moments of (tau - times[i]) ** k against the kernel over each
+    # segment. With z = sqrt(time - times[i]) - sqrt(time - tau) these are
+    # 2 * int(z ** k * (2 * start - z) ** k, 0, dist) which has no
+    # cancellation between large terms
+    rdist = sqrt(times[-1] - times)
+    start, end = rdist[:-1], rdist[1:]
+    dist = steps / (start + end)
+    mom0 = 2 * dist
+    mom1 = 2 * dist ** 2 * (start - dist / 3)
+    mom2 = 2 * dist ** 3 * (4/3 * start ** 2 - start * dist + dist ** 2 / 5)
+
+    # Each segment uses the quadratic through its own end points and the
+    # next time level, apart from the last which uses the previous one.
+    # This is the same interpolation as the uniform second order scheme
+    # (see `beta`), so the weights reduce to its coefficients for even steps
+    weights = zeros(len(times))
+    first, step = steps[:-1], steps[1:]
+    second = first + step
+    inner0, inner1, inner2 = mom0[:-1], mom1[:-1], mom2[:-1]
+    weights[:-2] += (inner2 - (first + second) * inner1
+                     + first * second * inner0) / (first * second)
+    weights[1:-1] -= (inner2 - second * inner1) / (first * step)
+    weights[2:] += (inner2 - first * inner1) / (second * step)
+
+    prev, step = steps[-2], steps[-1]
+    weights[-3] += (mom2[-1] - step * mom1[-1]) / (prev * (prev + step))
+    weights[-2] -= (mom2[-1] - (step - prev) * mom1[-1]
+                    - prev * step * mom0[-1]) / (prev * step)
+    weights[-1] += (mom2[-1] + prev * mom1[-1]) / (step * (prev + step))
+    return weights
+
+
+def integrator_batch(states, times, order=3, axis=-2):
+    """ Integrate a batch of histories which share the same time levels
+
+        Each history is contracted against the same coefficient vector in a
+        single matrix product, so one call covers the whole ensemble. The
+        default axis suits states shaped (n_particles, n_steps, n_dims);
+        use axis=-1 for states shaped (n_particles, n_steps). Uneven time
+        levels use the weights from `variable_coefficients`, as in
+        `integrator`.
+
+        Parameters:
+            states - an array of state histories, with time along `axis`
+                and any number of batch axes
+            times - the times corresponding to each state measurement
+            order - the order of the integrator (defaults to third-order)
+            axis - the time axis of states (defaults to -2)
+
+        Returns:
+            an array of history integrals with the time axis removed
+    """
+    states = moveaxis(asarray(states), axis, -2)
+    _num = states.shape[-2] - 1
+    const = 2 * sqrt(times[-1] - times[0]) * states[..., 0, :]
+    if not uniform(times):
+        return const + matmul(variable_coefficients(times, order), states)
     return const + sqrt(times[1] - times[0]) \
-        * (coefficients(_num, order) * states[::-1]).sum()
+        * matmul(coefficients(_num, order)[::-1], states)
+
+
+def integrate_all(states, times, order=3):
+    """ Integrate the history from the start to every time level
+
+        Equivalent to calling `integrator(states[:idx+1], times[:idx+1],
+        order)` for every idx (with zero for the first state), but runs in
+        O(n log n) rather than O(n^2). The left boundary and interior
+        coefficients form a Toeplitz kernel which is applied to the whole
+        history with an FFT convolution, and the right boundary
+        coefficients are then corrected for each time level.
+
+        Parameters:
+            states - a vector of states (i.e. the history) to integrate. The
+                first axis is time, any other axes are integrated separately.
+            times - the times corresponding to each state measurement,
+                which must be evenly spaced
+            order - the order of the integrator (defaults to third-order)
+    """
+    states, times = asarray(states, dtype=float), asarray(times)
+    num = len(states) - 1
+    if order not in MIN_NUM:
+        raise ValueError("Order must be one of 1, 2 or 3")
+    if not uniform(times):
+        raise ValueError("integrate_all needs evenly spaced time levels")
+    result = zeros(states.shape)
+    if num < 1:
+        return result
+
+    # Convolve with the kernel of left boundary and interior coefficients
+    left = LEFT[order]
+    kernel = empty(num + 1)
+    kernel[:len(left)] = left[:num + 1]
+    kernel[len(left):] = interior(arange(len(left), num + 1), order)
+    nfft = 1 << (2 * num + 1).bit_length()
+    trailing = (slice(None),) + (None,) * (states.ndim - 1)
+    result[:] = irfft(rfft(kernel, nfft)[trailing] * rfft(states, nfft, axis=0),
+                      nfft, axis=0)[:num + 1]
+
+    # Fix up the right boundary
+    nidx = arange(MIN_NUM[order] + 1, num + 1)
+    if len(nidx):
+        right = boundary(nidx, order)
+        width = len(right)
+        for ridx in range(width):
+            jidx = nidx - width + 1 + ridx
+            result[nidx] += (right[ridx] - kernel[jidx])[trailing] \
+                * states[width - 1 - ridx]
+
+    # Short histories don't have the general form so we just do them directly
+    for idx in range(1, min(MIN_NUM[order], num) + 1):
+        result[idx] = tensordot(coefficients(idx, order)[::-1],
+                                states[:idx + 1], axes=1)
+
+    # Add the constant term
+    result *= sqrt(times[1] - times[0])
+    result += 2 * sqrt(times - times[0])[trailing] * states[0]
+    result[0] = 0
+    return result
+
+
+class HistoryAccumulator(object):
+
+    """ A history integrator which is updated as new states are pushed
+
+        Pushing states one at a time with evenly spaced times and calling
+        `integral()` gives the same result as calling
+        `integrator(states, times, order)` on the history so far, but the
+        coefficient vector is maintained incrementally: only the right
+        boundary coefficients (and the one interior coefficient they
+        uncover) are recalculated when the history grows. States and
+        coefficients are kept in buffers which grow geometrically. Pushing
+        a state with a different step raises a ValueError.
+
+        States can be scalars or arrays (e.g. a velocity vector) as long as
+        they all have the same shape.
+
+        Parameters:
+            order - the order of the integrator (defaults to third-order)
+            capacity - the number of states to allocate space for initially
+    """
+
+    def __init__(self, order=3, capacity=64):
+        super(HistoryAccumulator, self).__init__()
+        if order not in MIN_NUM:
+            raise ValueError("Order must be one of 1, 2 or 3")
+        self.order = order
+        self.num = -1
+        self._capacity = max(capacity, 2)
+        self._coeffs = empty(self._capacity)
+        self._states = self._times = None
+
+    def __len__(self):
+        return self.num + 1
+
+    @property
+    def states(self):
+        "The state history"
+        return self._states[:self.num + 1]
+
+    @property
+    def times(self):
+        "The times corresponding to each state"
+        return self._times[:self.num + 1]
+
+    @property
+    def coefficients(self):
+        "The coefficients for the current history"
+        return self._coeffs[:self.num + 1]
+
+    def push(self, state, time):
+        """ Add a state to the end of the history
+
+            Parameters:
+                state - the new state
+                time - the time corresponding to the new state
+        """
+        state = asarray(state)
+        if self.num > 0:
+            _check_step(time - self._times[self.num],
+                        self._times[1] - self._times[0])
+        if self._states is None:
+            self._states = empty((self._capacity,) + state.shape)
+            self._times = empty(self._capacity)
+        elif self.num + 1 == self._capacity:
+            self._grow()
+        self.num += 1
+        self._states[self.num] = state
+        self._times[self.num] = time
+        if self.num > 0:
+            self._update_coefficients()
+
+    def _grow(self):
+        "Double the size of the buffers"
+        self._capacity *= 2
+        for attr in ('_coeffs', '_states', '_times'):
+            old = getattr(self, attr)
+            new = empty((self._capacity,) + old.shape[1:])
+            new[:len(old)] = old
+            setattr(self, attr, new)
+
+    def _update_coefficients(self):
+        "Update the coefficients after the history has grown by one"
+        num, order = self.num, self.order
+        if num - 1 <= MIN_NUM[order]:
+            # Short history - no shared structure, just recalculate
+            self._coeffs[:num + 1] = _coefficients(num, order)
+        else:
+            right = boundary(num, order)
+            start = num + 1 - len(right)
+            self._coeffs[start - 1] = interior(start - 1, order)
+            self._coeffs[start:num + 1] = right
+
+    def integral(self):
+        """ Return the history integral over the current history
+
+            Returns zero if there is only a single state in the history
+        """
+        if self.num < 1:
+            return zeros(self._states.shape[1:]) if self.num == 0 else 0
+        times, states = self.times, self.states
+        const = 2 * sqrt(times[-1] - times[0]) * states[0]
+        return const + sqrt(times[1] - times[0]) \
+            * tensordot(self._coeffs[self.num::-1], states, axes=1)
+
+
+def exponential_fit(tol, tmin, tmax):
+    """ Fit the history kernel 1/sqrt(t) with a sum of exponentials
+
+        Uses the identity 1/sqrt(t) = 2/sqrt(pi) * integral of
+        exp(-t exp(2u) + u) du over the real line, discretised with the
+        trapezoidal rule in u. The step and limits are refined until the
+        relative error is below tol everywhere in [tmin, tmax].
+
+        Parameters:
+            tol - the relative tolerance for the fit
+            tmin, tmax - the range of t over which the fit must be accurate
+
+        Returns:
+            weights, rates - arrays such that 1/sqrt(t) is approximately
+                sum(weights * exp(-rates * t))
+    """
+    if not 0 < tmin < tmax:
+        raise ValueError("Must have 0 < tmin < tmax")
+
+    # Limits - we lose at most tol/2 relative error from truncating each end
+    umin = log(tol / 4 * sqrt(pi / tmax))
+    umax = log(1 / sqrt(tmin))
+    while exp(-tmin * exp(2 * umax)) / (exp(umax) * sqrt(pi * tmin)) \
+            > tol / 2:
+        umax += 0.1
+
+    # Refine the step until we hit the tolerance
+    samples = logspace(log10(tmin), log10(tmax), 2000)
+    step = 1.
+    while step > 1e-3:
+        nodes = arange(umin, umax + step, step)
+        weights, rates = 2 * step * exp(nodes) / sqrt(pi), exp(2 * nodes)
+        approx = exp(-outer(samples, rates)).dot(weights)
+        if abs(approx * sqrt(samples) - 1).max() < tol:
+            return weights, rates
+        step /= 2
+    raise ValueError("Couldn't fit the kernel to a tolerance of {0}".format(tol))
+
+
+class CompressedHistory(object):
+
+    """ An approximate history integrator with constant memory
+
+        The most recent `window` steps are integrated exactly with the
+        Daitche coefficients for a history of that length. Everything
+        older is integrated against a sum-of-exponentials fit to the
+        kernel (see `exponential_fit`), which is carried as a fixed number
+        of auxiliary variables updated recursively each step. Memory and
+        work per step are then O(window + number of exponentials) no matter
+        how long the run is.
+
+        The tail uses linear interpolation between states, which is
+        second-order accurate, but the kernel is smooth there so the error
+        is small compared to that of the fit.
+
+        Push states with uniformly spaced times, as for `HistoryAccumulator`
+        (a different step raises a ValueError). `integral()` approximates
+        `integrator(states, times, order)`.
+
+        Parameters:
+            order - the order of the integrator for the exact window
+            window - the number of steps to integrate exactly
+            tol - relative tolerance for the kernel fit
+            tmax - the longest time that the kernel needs to be fit
+                over, usually the length of the run. Defaults to 10^6
+                timesteps.
+    """
+
+    def __init__(self, order=3, window=32, tol=1e-8, tmax=None):
+        super(CompressedHistory, self).__init__()
+        if window <= MIN_NUM[order]:
+            raise ValueError("window must be larger than "
+                             "{0}".format(MIN_NUM[order]))
+        self.order, self.window, self.tol, self.tmax = \
+            order, window, tol, tmax
+        self.num = -1
+        self.time = self.timestep = None
+        self._first = self._tail = self._buffer = None
+        self._coeffs = coefficients(window, order)[::-1].copy()
+
+    def __len__(self):
+        return self.num + 1
+
+    @property
+    def recent(self):
+        "The states in the exact window, oldest first"
+        nstates = min(self.num, self.window) + 1
+        start = self._head + self.window + 2 - nstates
+        return self._buffer[start:start + nstates]
+
+    def push(self, state, time):
+        """ Add a state to the end of the history
+
+            Parameters:
+                state - the new state
+                time - the time corresponding to the new state
+        """
+        state = asarray(state, dtype=float)
+        if self.num > 0:
+            _check_step(time - self.time, self.timestep)
+        if self._buffer is None:
+            # We keep two copies of the window in a ring buffer so that the
+            # window is always a contiguous slice
+            self._buffer = empty((2 * (self.window + 1),) + state.shape)
+            self._first, self._head = state, -1
+        elif self.num == 0:
+            self._setup(time - self.time)
+        if self.num >= self.window:
+            # Oldest segment in the window moves into the tail
+            oldest, next_oldest = self.recent[:2]
+            self._tail *= self._decay.reshape(self._decay.shape
+                                              + (1,) * state.ndim)
+            self._tail += multiply.outer(self._start, oldest) \
+                + multiply.outer(self._slope, next_oldest - oldest)
+
+        self.num += 1
+        self.time = time
+        self._head = (self._head + 1) % (self.window + 1)
+        self._buffer[self._head] = \
+            self._buffer[self._head + self.window + 1] = state
+
+    def _setup(self, timestep):
+        "Fit the kernel and set up the tail update once we know the timestep"
+        self.timestep = timestep
+        tmax = self.tmax or 1e6 * timestep
+        weights, rates = exponential_fit(
+            self.tol, self.window * timestep, tmax)
+
+        # Exact integrals of linearly interpolated states against each
+        # exponential over the segment entering the tail
+        zeta = rates * timestep
+        small = zeta < 1e-4
+        phi1 = where(small, 1 - zeta / 2 + zeta ** 2 / 6,
+                     -expm1(-zeta) / where(small, 1, zeta))
+        phi2 = where(small, 1 / 2 - zeta / 6 + zeta ** 2 / 24,
+                     (1 - phi1) / where(small, 1, zeta))
+        scale = timestep * weights * exp(-rates * self.window * timestep)
+        self._decay = exp(-zeta)
+        self._start, self._slope = scale * phi1, scale * phi2
+        self._weights = weights
+        self._tail = zeros(rates.shape + self._first.shape)
+
+    def integral(self):
+        """ Return the (approximate) history integral over the history so far
+
+            Returns zero if there is only a single state in the history
+        """
+        if self.num < 1:
+            return zeros(self._first.shape) if self.num == 0 else 0
+        const = 2 * sqrt(self.num * self.timestep) * self._first
+        if self.num < self.window:
+            coeffs = coefficients(self.num, self.order)[::-1]
+        else:
+            coeffs = self._coeffs
+        return const + self._tail.sum(axis=0) \
+            + sqrt(self.timestep) * tensordot(coeffs, self.recent, axes=1)
+
 
 ## COEFFICIENTS
-def alpha(num):
-    """ First-order integration coefficients for history term
+# For a long enough history each scheme has a few fixed coefficients at the
+# left boundary, interior coefficients which depend only on the index j, and
+# a few coefficients at the right boundary which depend on the length of the
+# history. The general form is used once num > MIN_NUM[order].
+MIN_NUM = {1: 0, 2: 3, 3: 6}
+LEFT = {
+    1: array([4/3]),
+    2: array([
+        4/5 * sqrt(2),
+        14/5 * sqrt(3) - 12/5 * sqrt(2),
+        176/15 - 42/5 * sqrt(3) + 12/5 * sqrt(2)]),
+    3: array([
+        244/315 * sqrt(2),
+        362/105 * sqrt(3) - 976/315 * sqrt(2),
+        5584/315 - 1448/105 * sqrt(3) + 488/105 * sqrt(2),
+        1130/63 * sqrt(5) - 22336/315 + 724/35 * sqrt(3)
+        - 976/315 * sqrt(2)])
+}
+
+
+def interior(jidx, order=3):
+    """ Interior integration coefficients for the given indices
+
+        These don't depend on the length of the history, so they can be
+        reused as the history grows. See `maxr.integrator.expansion` for how
+        these are evaluated without cancellation for large indices.
+
+        Parameters:
+            jidx - an array of coefficient indices
+            order - the order of the integrator scheme
+    """
+    try:
+        return INTERIOR[order](jidx)
+    except KeyError:
+        raise ValueError("Order must be one of 1, 2 or 3")
+
+
+def boundary(num, order=3):
+    """ Right boundary integration coefficients for a history of length num
+
+        Returns the last 1, 2 or 4 coefficients (for first, second and
+        third order respectively), which are the only ones which change
+        as the history grows. Only valid for num > MIN_NUM[order].
+
+        Parameters:
+            num - the number of coefficients (i.e. the length of your
+                state history vector)
+            order - the order of the integrator scheme
     """
-    if num > 0:
-        # Left boundary
-        _alpha = empty(num + 1)
-        _alpha[0] = 1
+    try:
+        return array([expansion(num) for expansion in BOUNDARY[order]])
+    except KeyError:
+        raise ValueError("Order must be one of 1, 2 or 3")
+
+
+def _general(num, order):
+    "Assemble the coefficient vector from the left, interior and right parts"
+    left = LEFT[order]
+    right = boundary(num, order)
+    _coeffs = empty(num + 1)
+    _coeffs[:len(left)] = left
+    _coeffs[len(left):-len(right)] = \
+        interior(arange(len(left), num + 1 - len(right)), order)
+    _coeffs[-len(right):] = right
+    return _coeffs
 
-        # Middle
-        jidx = arange(1, num)
-        _alpha[1:-1] = (jidx-1) ** (3/2) \
-                       + (jidx+1) ** (3/2) - 2 * jidx ** (3/2)
 
-        # Right boundary
-        _alpha[-1] = (num-1) ** (3/2) - num ** (3/2) + 6/4 * num ** (1/2)
-        return 4/3 * _alpha
+def alpha(num):
+    """ First-order integration coefficients for history term
+    """
+    if num > MIN_NUM[1]:
+        return _general(num, 1)
 
     else:
         raise ValueError("num must be greater than 1")
@@ -64,27 +806,8 @@ def alpha(num):
 def beta(num):
     """ Second-order integration coefficients for history term
     """
-    if num > 3:
-        # Left boundary
-        _beta = empty(num + 1)
-        _beta[0] = 4 / 5 * sqrt(2)
-        _beta[1] = 14 / 5 * sqrt(3) - 12 / 5 * sqrt(2)
-        _beta[2] = 176 / 15 - 42 / 5 * sqrt(3) + 12 / 5 * sqrt(2)
-
-        # Middle
-        jidx = arange(3, num - 1)
-        _beta[3:-2] = 8/15 * ((jidx+2) ** (5/2) - 3 * (jidx+1) ** (5/2)
-                              + 3 * jidx ** (5/2) - (jidx-1) ** (5/2)) \
-                      + 2/3 * (-(jidx+2) ** (3/2) + 3 * (jidx+1) ** (3/2)
-                               - 3 * jidx ** (3/2) + (jidx-1) ** (3/2))
-
-        # Right boundary
-        _beta[-2] = 8/15 * (-2 * num ** (5/2) + 3 * (num-1) ** (5/2)
-                            - (num-2) ** (5/2)) \
-                   + 2/3 * (4 * num ** (3/2) - 3 * (num-1) ** (3/2)
-                            + (num-2) ** (3/2))
-        _beta[-1] = 8/15 * (num ** (5/2) - (num-1) ** (5/2)) \
-                   + 2/3 * (-3 * num ** (3/2) + (num-1) ** (3/2)) + 2 * num ** (1/2)
+    if num > MIN_NUM[2]:
+        _beta = _general(num, 2)
 
     # First few have to be handled specially
     elif num == 1:
@@ -107,44 +830,8 @@ def beta(num):
 def gamma(num):
     """ Third-order integration coefficients for history term
     """
-    if num > 6:
-        # Left boundary
-        _gamma = empty(num + 1)
-        _gamma[0] = 244/315 * sqrt(2)
-        _gamma[1] = 362/105 * sqrt(3) - 976/315 * sqrt(2)
-        _gamma[2] = 5584/315 - 1448/105 * sqrt(3) + 488/105 * sqrt(2)
-        _gamma[3] = 1130/63 * sqrt(5) - 22336/315 + 724/35 * sqrt(3) \
-                   - 976/315 * sqrt(2)
-
-        # Middle
-        jidx = arange(4, num - 2)
-        _gamma[4:-3] = 16/105 * ((jidx+2) ** (7/2) + (jidx-2) ** (7/2)
-                                 - 4 * (jidx+1) ** (7/2)
-                                 - 4 * (jidx-1) ** (7/2)
-                                 + 6 * jidx ** (7/2)) \
-                      + 2/9 * (4 * (jidx+1) ** (3/2) + 4 * (jidx-1) ** (3/2)
-                               - (jidx+2) ** (3/2) - (jidx-2) ** (3/2)
-                               - 6 * jidx ** (3/2))
-
-        # Right boundary
-        _gamma[-4] = 16/105 * (num ** (7/2) - 4 * (num-2) ** (7/2)
-                               + 6 * (num-3) ** (7/2) - 4 * (num-4) ** (7/2)
-                               + (num-5) ** (7/2)) \
-                    - 8/15 * num ** (5/2) + 4/9 * num ** (3/2) \
-                    + 8/9 * (num-2) ** (3/2) - 4/3 * (num-3) ** (3/2) \
-                    + 8/9 * (num-4) ** (3/2) - 2/9 * (num-5) ** (3/2)
-        _gamma[-3] = 16/105 * ((num-4) ** (7/2) - 4 * (num-3) ** (7/2)
-                               + 6 * (num-2) ** (7/2) - 3 * num ** (7/2)) \
-                    + 32/15 * num ** (5/2) \
-                    - 2 * num ** (3/2) - 4/3 * (num-2) ** (3/2) \
-                    + 8/9 * (num-3) ** (3/2) - 2/9 * (num-4) ** (3/2)
-        _gamma[-2] = 16/105 * (3 * num ** (7/2) - 4 * (num-2) ** (7/2)
-                               + (num-3) ** (7/2)) \
-                    - 8/3 * num ** (5/2) + 4 * num ** (3/2) \
-                    + 8/9 * (num-2) ** (3/2) - 2/9 * (num-3) ** (3/2)
-        _gamma[-1] = 16/105 * ((num-2) ** (7/2) - num ** (7/2)) \
-                    + 16/15 * num ** (5/2) - 22/9 * num ** (3/2) \
-                    - 2/9 * (num-2) ** (3/2) + 2 * num ** (1/2)
+    if num > MIN_NUM[3]:
+        _gamma = _general(num, 3)
 
     # First few have to be handled specially
     elif num == 1:
@@ -8,33 +8,659 @@
 
 from __future__ import print_function, division
 
+import os
+import tempfile
+
+import h5py
+from numpy import asarray, empty, zeros, sqrt, pi, concatenate, stack, \
+    matmul, array, arange, full, nan, isfinite, flatnonzero, \
+    ascontiguousarray, empty_like, isclose, where
+from numpy.linalg import solve
+
+from .history import coefficients
+from ..parameters import Parameters
+
+try:
+    from ..ext import stepper
+    from ..ext.coefficients import IntegratorCoeffs
+except ImportError:
+    stepper = IntegratorCoeffs = None
+
+# Version of the checkpoint file layout
+CHECKPOINT_VERSION = 1
+
+# Adams-Bashforth weights, newest first, indexed by order
+ADAMS_BASHFORTH = {
+    1: array([1.]),
+    2: array([3., -1.]) / 2,
+    3: array([23., -16., 5.]) / 12
+}
+
 
 class Integrator(object):
 
     """ The class which does the integration!
 
         We use the scheme from Daitsche (2013) which is third-order accurate
-        in the timestep (see http://arxiv.org/pdf/1210.2576.pdf)
+        in the timestep (see http://arxiv.org/pdf/1210.2576.pdf). All the
+        particles are advanced together, with the flow evaluated once per
+        step for the whole ensemble. The relative velocity w = v - u is
+        integrated with third-order Adams-Bashforth for the velocity term
+        and the third-order history coefficients for the history term, and
+        the positions with third-order Adams-Bashforth for v = w + u. The
+        first step uses a second-order Taylor step for the positions and
+        the trapezoidal rule for the velocity term, and the second step uses
+        second-order Adams-Bashforth.
+
+        The velocity gradients and time derivatives needed for the velocity
+        term are calculated with central differences (or one-sided ones
+        where the flow is NaN on one side, like at the edges of a gridded
+        Flow), with the spatial stencil evaluated in one flow call at the
+        current time and the time stencil in another at the particles. The
+        rest of each step is done by maxr.ext.stepper (without the GIL)
+        when the extensions are available, and with numpy otherwise.
+
+        Particles stop when they leave the domain, when their position,
+        velocity or the flow velocity at the particle stops being finite
+        (e.g. a gridded Flow returns NaN outside its grid), or when the
+        optional `terminate` function says so. Once stopped particles make
+        up more than the `compaction` fraction of the arrays, the live
+        particles are compacted into new contiguous arrays so the work per
+        step stays proportional to the number still moving. `particles` maps
+        the current array lanes back to the original particle indices, and
+        `exits` records the step at which each particle stopped (or -1 if
+        it hasn't).
 
         Parameters:
-            flow - a function which, when given (x, t), returns a
-                velocity vector u.
+            flow - a function which, given arrays of x and y positions and
+                an array of times, returns the (u, v) velocity components
+                with shape (n_points, n_times) (i.e. the same convention as
+                maxr.flow.blink and maxr.flow.from_function)
             parameters - an instance of maxr.Parameters which contains
-                the parameters for the integration.
+                the parameters for the integration. The timestep dt, number
+                of steps N, and non-dimensional parameters R and S are used.
+            domain - the bounds ((xmin, xmax), (ymin, ymax)) of the flow
+                domain, e.g. Flow.domain. Optional, defaults to no bounds.
+            terminate - a function which, given the particle positions,
+                velocities (both with shape (n_particles, 2)) and the time,
+                returns a boolean array which is True for particles to stop.
+                Optional.
+            compaction - the fraction of stopped particles at which the
+                live particles are compacted (defaults to 0.25)
     """
 
-    def __init__(self, flow, parameters):
+    # Spacings for the finite difference derivatives of the flow
+    spacing = 1e-5
+    time_spacing = 1e-5
+
+    # Use the compiled kernel in maxr.ext.stepper for the per-particle
+    # arithmetic if the extensions are built
+    compiled = stepper is not None
+
+    def __init__(self, flow, parameters, domain=None, terminate=None,
+                 compaction=0.25):
         super(Integrator, self).__init__()
         self.flow = flow
         self.parameters = parameters
+        self.domain = domain
+        self.terminate = terminate
+        self.compaction = compaction
+        self.index = 0
+        self.time = None
+        self.particles = self.exits = None
+        self._positions = self._relative = self._coeffs = None
+        self._keep, self._base, self._speeds = None, 0, None
 
-    def integrate(self):
+    def integrate(self, positions, velocities=None, time=0, writer=None):
         """ Integrate me!
+
+            Parameters:
+                positions - the initial particle positions, with shape
+                    (n_particles, 2)
+                velocities - the initial particle velocities. Optional,
+                    defaults to the fluid velocity at each particle.
+                time - the initial time (defaults to zero)
+                writer - a maxr.integrator.writer.TrajectoryWriter to stream
+                    the particle positions and velocities to as we go.
+                    Optional, the writer is closed once we're done. Only
+                    the current and next positions are kept in memory.
+
+            Returns:
+                the particle trajectories, with shape
+                (n_steps + 1, n_particles, 2), or None if they were
+                streamed to a writer. Positions after a particle stops are
+                NaN.
+        """
+        if writer is None:
+            self.reset(positions, velocities, time)
+            while self.index < self.parameters.N:
+                self.step()
+            return self.trajectory
+
+        self.reset(positions, velocities, time, keep=2)
+        with writer:
+            writer.write(self.index, self._scatter(self.positions),
+                         self._scatter(self.velocities))
+            for _ in range(self.parameters.N):
+                self.step()
+                writer.write(self.index, self._scatter(self.positions),
+                             self._scatter(self.velocities))
+
+    def reset(self, positions, velocities=None, time=0, keep=None):
+        """ Set up the initial conditions and allocate the history arrays
+
+            Parameters:
+                positions - the initial particle positions, with shape
+                    (n_particles, 2)
+                velocities - the initial particle velocities. Optional,
+                    defaults to the fluid velocity at each particle.
+                time - the initial time (defaults to zero)
+                keep - the number of steps of positions (and particle
+                    velocities) to keep in memory, at least two for the
+                    current and next steps. Optional, defaults to keeping
+                    the positions for the whole trajectory. The relative
+                    velocities are always kept for every step, since the
+                    history term needs them.
+        """
+        if keep is not None and keep < 2:
+            raise ValueError("Need to keep at least two steps of positions, "
+                             "got {0}".format(keep))
+        positions = asarray(positions, dtype=float)
+        nsteps, nparticles = self.parameters.N, len(positions)
+        self.index, self.time = 0, time
+        self._keep, self._base, self._speeds = keep, 0, None
+        if keep is None:
+            self._positions = empty((nsteps + 1, nparticles, 2))
+        else:
+            self._positions = empty((keep, nparticles, 2))
+            self._speeds = empty((keep, nparticles, 2))
+        self._relative = empty((nsteps + 1, nparticles, 2))
+
+        # Adams-Bashforth needs the last three velocities and velocity
+        # terms, step n is stored in slot n % 3
+        self._velocity = zeros((3, nparticles, 2))
+        self._forcing = zeros((3, nparticles, 2))
+        self._history = zeros((nparticles, 2))
+
+        self._positions[0] = positions
+        self._fluid = self._evaluate(positions, time)
+        if velocities is None:
+            self._relative[0] = 0
+        else:
+            self._relative[0] = asarray(velocities) - self._fluid[0]
+        self._record()
+
+        self.particles = arange(nparticles)
+        self.exits = full(nparticles, -1)
+        self._alive = self.exits < 0
+        self._finished = []
+        self._check()
+
+    def steps(self, chunk=1):
+        """ Step through the rest of the run, yielding as we go
+
+            Integrates from the current step (so call `reset` or `restore`
+            first) up to the number of steps in the parameters. Every
+            `chunk` steps, and at the end of the run, we yield views of the
+            particle positions and velocities for the steps taken since the
+            last yield, so reductions like binning or Poincare sections can
+            consume the run as it goes. The current time is available from
+            the integrator while the generator is paused.
+
+            Only the last chunk + 1 steps of positions and velocities are
+            kept, in buffers which are reused for each chunk, so copy the
+            views if you want to keep them around. Since the whole
+            trajectory isn't kept, `trajectory` is None once we start.
+
+            Parameters:
+                chunk - the number of steps to take between yields (defaults
+                    to one)
+
+            Yields:
+                the index of the current step, and views of the positions
+                and velocities of the particles in the arrays (see
+                `particles`), each with shape
+                (n_steps_taken_since_last_yield, n_lanes, 2)
+        """
+        if chunk < 1:
+            raise ValueError("Chunk must be at least one step, "
+                             "got {0}".format(chunk))
+        if self._positions is None:
+            raise ValueError("No initial conditions, call reset first")
+        if self._keep != chunk + 1 or self._base != self.index:
+            self._roll(chunk + 1)
+        start = self.index
+        while self.index < self.parameters.N:
+            self.step()
+            if self.index - start == chunk or self.index == self.parameters.N:
+                rows = slice(start + 1 - self._base,
+                             self.index + 1 - self._base)
+                yield self.index, self._positions[rows], self._speeds[rows]
+                start = self.index
+
+    def _roll(self, keep):
+        """ Start keeping only the last `keep` steps of positions and
+            velocities, beginning with the current step
+        """
+        positions = empty((keep,) + self._positions.shape[1:])
+        positions[0] = self.positions
+        self._speeds = empty_like(positions)
+        self._speeds[0] = self.velocities
+        self._positions, self._keep, self._base = positions, keep, self.index
+
+    def _record(self):
+        "Keep the current particle velocities if we're keeping positions"
+        if self._speeds is not None:
+            self._speeds[self.index - self._base] = self.velocities
+
+    def step(self):
+        """ Advance all the particles by one timestep
+        """
+        if self._positions is None:
+            raise ValueError("No initial conditions, call reset first")
+        if self.index >= self.parameters.N:
+            raise IndexError("Already taken all {0} steps, increase the "
+                             "number of steps in the parameters".format(
+                                 self.parameters.N))
+        dt, R, S = self.parameters.dt, self.parameters.R, self.parameters.S
+        idx = self.index
+        if IntegratorCoeffs is not None:
+            # Grow the coefficients in place, which only recalculates the
+            # ones next to the right boundary
+            if self._coeffs is None or self._coeffs.n > idx + 1:
+                self._coeffs = IntegratorCoeffs(idx + 1, 3)
+            else:
+                self._coeffs.resize(idx + 1)
+            coeffs = self._coeffs
+        else:
+            coeffs = coefficients(idx + 1, 3)
+        if idx + 1 - self._base == len(self._positions):
+            # Out of rows, so start again with the current step
+            self._positions[0] = self._positions[idx - self._base]
+            if self._speeds is not None:
+                self._speeds[0] = self._speeds[idx - self._base]
+            self._base = idx
+        position = self._positions[idx - self._base]
+        new_position = self._positions[idx + 1 - self._base]
+        if idx > 0 and self.compiled:
+            velocity, gradient, dudt = self._fluid
+            stepper.step(position, new_position, self._relative,
+                         self._velocity, self._forcing, self._history,
+                         coeffs, velocity, gradient, dudt, idx, dt, R, S)
+        else:
+            self._step(asarray(coeffs), position, new_position)
+        self.index += 1
+        self.time += dt
+        if idx > 0:
+            self._fluid = self._evaluate(new_position, self.time)
+        self._record()
+        self._check()
+
+    def _check(self):
+        """ Stop particles which have left the domain, gone non-finite or
+            been terminated, and compact the arrays if enough have stopped
+        """
+        positions, relative = self.positions, self._relative[self.index]
+        velocity = self._fluid[0]
+        stopped = ~(isfinite(positions).all(axis=-1)
+                    & isfinite(relative).all(axis=-1)
+                    & isfinite(velocity).all(axis=-1))
+        if self.domain is not None:
+            for axis, (lower, upper) in enumerate(self.domain):
+                stopped |= (positions[:, axis] < lower) \
+                    | (positions[:, axis] > upper)
+        if self.terminate is not None:
+            stopped |= asarray(self.terminate(
+                positions, relative + velocity, self.time), dtype=bool)
+
+        stopped &= self._alive
+        if stopped.any():
+            self.exits[self.particles[stopped]] = self.index
+            self._alive &= ~stopped
+        if (~self._alive).sum() > self.compaction * len(self._alive):
+            self.compact()
+
+    def compact(self):
+        """ Move the live particles into new contiguous arrays
+
+            The trajectories of stopped particles are set aside (and put
+            back in by `trajectory` and `history`).
+        """
+        count, live = self.index + 1, flatnonzero(self._alive)
+        dead = flatnonzero(~self._alive)
+        rows = count - self._base
+        if len(dead):
+            self._finished.append((
+                self.particles[dead],
+                self._positions[:rows, dead] if self._keep is None else None,
+                self._relative[:count, dead]))
+        for key, used in (('_positions', rows), ('_speeds', rows),
+                          ('_relative', count)):
+            old = getattr(self, key)
+            if old is None:
+                continue
+            new = empty((old.shape[0], len(live), 2))
+            new[:used] = old[:used, live]
+            setattr(self, key, new)
+        for key in ('_velocity', '_forcing'):
+            setattr(self, key, ascontiguousarray(getattr(self, key)[:, live]))
+        self._history = self._history[live]
+        if self._fluid is not None:
+            self._fluid = tuple(values[live] for values in self._fluid)
+        self.particles = self.particles[live]
+        self._alive = self._alive[live]
+
+    def _scatter(self, values):
+        """ Scatter per-lane values (with the particles along the second
+            last axis) back out to every particle, with NaN for particles
+            which have stopped
+        """
+        result = full(values.shape[:-2] + (len(self.exits), 2), nan)
+        result[..., self.particles, :] = values
+        stopped = (self.exits >= 0) & (self.exits < self.index)
+        result[..., stopped, :] = nan
+        return result
+
+    def _assemble(self, array, which):
+        "Put the set aside trajectories back in with the live ones"
+        count = self.index + 1
+        if not self._finished and (self.exits < 0).all():
+            return array[:count]
+        result = full((count, len(self.exits), 2), nan)
+        for finished in self._finished:
+            values = finished[which]
+            result[:len(values), finished[0]] = values
+        result[:, self.particles] = array[:count]
+        stopped = (self.exits >= 0) \
+            & (arange(count)[:, None] > self.exits[None, :])
+        result[stopped] = nan
+        return result
+
+    def _step(self, coeffs, position, new_position):
+        """ Take a step with numpy from the current positions, writing
+            the new ones into `new_position` and updating everything but
+            the flow velocities at the new positions (except on the first
+            step, which needs them)
+        """
+        dt, R, S = self.parameters.dt, self.parameters.R, self.parameters.S
+        xi = R * sqrt(3 / (pi * S))
+        idx, slot = self.index, self.index % 3
+        relative = self._relative[idx]
+        velocity, gradient, dudt = self._fluid
+
+        # Velocity term G = (R - 1) Du/Dt - R (w . grad) u - R w / S
+        self._velocity[slot] = relative + velocity
+        self._forcing[slot] = (R - 1) * (dudt + _advect(gradient, velocity)) \
+            - R * _advect(gradient, relative) - R / S * relative
+
+        # History term: the new relative velocity appears on both sides, so
+        # split off its coefficient and solve for it
+        older = matmul(coeffs[:0:-1], self._relative[:idx + 1].reshape(
+            idx + 1, -1)).reshape(position.shape)
+        rhs = relative + xi * self._history - xi * sqrt(dt) * older
+        diagonal = 1 + xi * sqrt(dt) * coeffs[0]
+
+        if idx == 0:
+            # Adams-Bashforth would only be first order here, which spoils
+            # the global accuracy, so take a second-order Taylor step for
+            # the positions and use the trapezoidal rule for the velocity
+            # term (which is linear in w, so we can solve for it)
+            acceleration = self._forcing[0] + dudt \
+                + _advect(gradient, self._velocity[0])
+            new_position[...] = position + dt * self._velocity[0] \
+                + dt ** 2 / 2 * acceleration
+            self._fluid = self._evaluate(new_position, self.time + dt)
+            velocity, gradient, dudt = self._fluid
+            rhs += dt / 2 * (self._forcing[0] + (R - 1)
+                             * (dudt + _advect(gradient, velocity)))
+            system = dt / 2 * R * gradient
+            system[:, 0, 0] += diagonal + dt / 2 * R / S
+            system[:, 1, 1] += diagonal + dt / 2 * R / S
+            self._relative[1] = solve(system, rhs[..., None])[..., 0]
+        else:
+            weights = ADAMS_BASHFORTH[min(idx + 1, 3)]
+            slots = [(idx - k) % 3 for k in range(len(weights))]
+            new_position[...] = position + dt * matmul(
+                weights, self._velocity[slots].reshape(len(slots), -1)
+            ).reshape(position.shape)
+            forcing = matmul(
+                weights, self._forcing[slots].reshape(len(slots), -1)
+            ).reshape(position.shape)
+            self._relative[idx + 1] = (rhs + dt * forcing) / diagonal
+
+        self._history[...] = sqrt(dt) * (coeffs[0] * self._relative[idx + 1]
+                                         + older)
+
+    def _evaluate(self, positions, time):
+        """ Evaluate the flow velocity, velocity gradient and time
+            derivative at each particle, in two calls to the flow (7 samples
+            per particle)
+
+            Returns:
+                velocity, gradient and time derivative arrays with shapes
+                (n_particles, 2), (n_particles, 2, 2) and (n_particles, 2).
+                gradient[p, i, j] is the derivative of velocity component i
+                with respect to coordinate j.
+        """
+        nparticles = len(positions)
+        if nparticles == 0:
+            return empty((0, 2)), empty((0, 2, 2)), empty((0, 2))
+        xxs, yys = positions[:, 0], positions[:, 1]
+        step, tstep = self.spacing, self.time_spacing
+
+        # The spatial stencil is only needed at the current time, and the
+        # time stencil only at the particles
+        uus, vvs = self.flow(
+            concatenate([xxs, xxs + step, xxs - step, xxs, xxs]),
+            concatenate([yys, yys, yys, yys + step, yys - step]),
+            array([time]))
+        values = stack([asarray(uus), asarray(vvs)], axis=-1)
+        values = values.reshape(5, nparticles, 2)
+        uus, vvs = self.flow(xxs, yys, array([time - tstep, time + tstep]))
+        nearby = stack([asarray(uus), asarray(vvs)], axis=-1)
+
+        velocity = values[0]
+        gradient = stack([_difference(velocity, values[2], values[1], step),
+                          _difference(velocity, values[4], values[3], step)],
+                         axis=-1)
+        dudt = _difference(velocity, nearby[:, 0], nearby[:, 1], tstep)
+        return velocity, gradient, dudt
+
+    def checkpoint(self, filename):
+        """ Save the integrator state to an HDF5 file so that it can be
+            restarted with `restore`
+
+            Everything needed to carry on exactly where we left off is
+            saved: the positions (for every step so far, or just the
+            current step if only the latest positions are being kept) and
+            the relative velocities for every step so far (the history
+            term needs all of them), the Adams-Bashforth
+            and history buffers, the step index and time, the step at which
+            each particle stopped, and the parameters (as attributes on the
+            root group). Arrays are stored
+            contiguously so they can be read back in one go. The file is
+            written to a temporary file alongside and moved into place, so
+            a job killed part way through leaves any previous checkpoint
+            intact.
+
+            Parameters:
+                filename - the file to write the checkpoint to
+        """
+        if self._positions is None:
+            raise ValueError("No initial conditions, call reset first")
+        dirname = os.path.dirname(os.path.abspath(filename))
+        handle, tmpname = tempfile.mkstemp(suffix='.hdf5', dir=dirname)
+        os.close(handle)
+        try:
+            with h5py.File(tmpname, 'w') as fhandle:
+                fhandle.attrs['version'] = CHECKPOINT_VERSION
+                fhandle.attrs['index'] = self.index
+                fhandle.attrs['time'] = self.time
+                params = fhandle.create_group('parameters')
+                for key, value in self.parameters.items():
+                    params.attrs[key] = value
+                if self._keep is None:
+                    fhandle['position'] = self.trajectory
+                else:
+                    fhandle['position'] = self._scatter(self.positions)[None]
+                fhandle['relative'] = self.history
+                fhandle['exits'] = self.exits
+                for key in ('velocity', 'forcing', 'history'):
+                    fhandle['buffers/' + key] = \
+                        self._scatter(getattr(self, '_' + key))
+                for dset in ('position', 'relative'):
+                    for idx, axis in enumerate(('t', 'particle',
+                                                'component')):
+                        fhandle[dset].dims[idx].label = axis
+            with open(tmpname, 'rb+') as sink:
+                os.fsync(sink.fileno())
+            os.replace(tmpname, filename)
+        except BaseException:
+            os.remove(tmpname)
+            raise
+
+        # Make sure the rename itself is on disk
+        handle = os.open(dirname, os.O_RDONLY)
+        try:
+            os.fsync(handle)
+        finally:
+            os.close(handle)
+
+    @classmethod
+    def restore(cls, flow, filename, parameters=None, **kwargs):
+        """ Make an integrator from a checkpoint written by `checkpoint`
+
+            Carry on integrating from the checkpointed step with `step` or
+            `steps`.
+
+            Parameters:
+                flow - the flow function (see Integrator)
+                filename - the checkpoint file
+                parameters - an instance of maxr.Parameters. Optional,
+                    defaults to the parameters saved in the checkpoint.
+                    Pass parameters with a larger number of steps to extend
+                    a run; the timestep and non-dimensional parameters
+                    must match the checkpoint.
+
+            Other keyword arguments (e.g. domain) are passed to Integrator.
+
+            Returns:
+                an Integrator ready to take the next step
+        """
+        with h5py.File(filename, 'r') as fhandle:
+            version = fhandle.attrs.get('version')
+            if version != CHECKPOINT_VERSION:
+                raise ValueError("Unknown checkpoint version {0} in "
+                                 "{1}".format(version, filename))
+            saved = {key: _scalar(value)
+                     for key, value in fhandle['parameters'].attrs.items()}
+            if parameters is None:
+                parameters = Parameters()
+                parameters.__setstate__(saved)
+            for key in ('dt', 'R', 'S'):
+                if not isclose(getattr(parameters, key), saved[key],
+                               rtol=1e-12, atol=0):
+                    raise ValueError(
+                        "Parameter {0} = {1} doesn't match the checkpoint, "
+                        "which has {0} = {2}".format(
+                            key, getattr(parameters, key), saved[key]))
+            index = int(fhandle.attrs['index'])
+            if index > parameters.N:
+                raise ValueError("Checkpoint is at step {0}, past the {1} "
+                                 "steps in the parameters".format(
+                                     index, parameters.N))
+
+            integrator = cls(flow, parameters, **kwargs)
+            integrator.index = index
+            integrator.time = float(fhandle.attrs['time'])
+            nsaved, nparticles = fhandle['position'].shape[:2]
+            if nsaved < index + 1:
+                # Only the current positions were kept
+                integrator._keep, integrator._base = 2, index
+                integrator._positions = empty((2, nparticles, 2))
+                integrator._speeds = empty((2, nparticles, 2))
+                fhandle['position'].read_direct(
+                    integrator._positions, dest_sel=slice(0, 1),
+                    source_sel=slice(nsaved - 1, nsaved))
+            else:
+                integrator._positions = empty(
+                    (parameters.N + 1, nparticles, 2))
+                fhandle['position'].read_direct(
+                    integrator._positions, dest_sel=slice(0, index + 1))
+            integrator._relative = empty((parameters.N + 1, nparticles, 2))
+            fhandle['relative'].read_direct(integrator._relative,
+                                            dest_sel=slice(0, index + 1))
+            for key in ('velocity', 'forcing', 'history'):
+                setattr(integrator, '_' + key, fhandle['buffers/' + key][...])
+            integrator.exits = fhandle['exits'][...]
+
+        # Set aside the particles which had already stopped
+        integrator.particles = arange(nparticles)
+        integrator._alive = integrator.exits < 0
+        integrator._finished, integrator._fluid = [], None
+        if not integrator._alive.all():
+            integrator.compact()
+
+        integrator._fluid = integrator._evaluate(
+            integrator.positions, integrator.time)
+        integrator._record()
+        return integrator
+
+    @property
+    def trajectory(self):
+        """ Return the particle positions so far, with shape
+            (n_steps_taken + 1, n_particles, 2) and NaN after each particle
+            stops. This is a view unless some particles have stopped, and
+            None if only the latest positions are being kept (see `reset`).
+        """
+        if self._positions is None or self._keep is not None:
+            return None
+        return self._assemble(self._positions, 1)
+
+    @property
+    def positions(self):
+        """ Return the current positions of the particles in the arrays
+            (see `particles`), with shape (n_lanes, 2)
         """
-        pass
+        if self._positions is None:
+            return None
+        return self._positions[self.index - self._base]
+
+    @property
+    def velocities(self):
+        """ Return the current velocities v = w + u of the particles in the
+            arrays (see `particles`), with shape (n_lanes, 2)
+        """
+        if self._relative is None:
+            return None
+        return self._relative[self.index] + self._fluid[0]
 
     @property
     def history(self):
-        """ Return history
+        """ Return history of the relative velocity w = v - u, with shape
+            (n_steps_taken + 1, n_particles, 2) and NaN after each particle
+            stops. This is a view unless some particles have stopped.
         """
-        pass
+        if self._relative is None:
+            return None
+        return self._assemble(self._relative, 2)
+
+
+def _scalar(value):
+    "Convert numpy scalars read from HDF5 attributes to python values"
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _difference(center, lower, upper, step):
+    """ Take central differences, falling back to one-sided differences
+        where the flow isn't finite on one side (e.g. at the edges of a
+        gridded Flow)
+    """
+    result = (upper - lower) / (2 * step)
+    result = where(isfinite(upper), result, (center - lower) / step)
+    return where(isfinite(lower), result, (upper - center) / step)
+
+
+def _advect(gradient, vector):
+    "Calculate (vector . grad) u given the velocity gradient"
+    return gradient[..., 0] * vector[:, :1] + gradient[..., 1] * vector[:, 1:]
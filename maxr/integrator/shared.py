@@ -0,0 +1,84 @@
+""" file: shared.py (maxr.integrator)
+    author: Jess Robertson
+            CSIRO Mineral Resources
+    date:   June 2018
+
+    description: Numpy arrays in shared memory for process pools
+"""
+
+from __future__ import print_function, division
+
+from multiprocessing.shared_memory import SharedMemory
+
+from numpy import ndarray, dtype as as_dtype, prod
+
+
+class SharedArray(object):
+
+    """ A numpy array living in a multiprocessing.shared_memory block
+
+        Use these for coefficient tables and per-particle histories which
+        are handed out to a process pool. Pickling a SharedArray only sends
+        the name, shape and dtype of the block, and unpickling attaches to
+        the same block, so workers all see one copy of the data without any
+        serialization.
+
+        The process which creates the array should call `unlink` once all
+        the workers are finished with it.
+
+        Parameters:
+            shape - the shape of the array
+            dtype - the numpy dtype of the array (defaults to float)
+            name - the name of an existing block to attach to. Defaults to
+                None, which creates a new (zeroed) block.
+    """
+
+    def __init__(self, shape, dtype=float, name=None):
+        super(SharedArray, self).__init__()
+        self.shape = tuple(shape) if hasattr(shape, '__len__') else (shape,)
+        self.dtype = as_dtype(dtype)
+        nbytes = int(prod(self.shape)) * self.dtype.itemsize
+        if name is None:
+            self.shm = SharedMemory(create=True, size=max(nbytes, 1))
+        else:
+            self.shm = SharedMemory(name=name)
+            if self.shm.size < nbytes:
+                raise ValueError("Shared memory block {0} is too small for "
+                                 "an array of shape {1}".format(
+                                     name, self.shape))
+        self.array = ndarray(self.shape, self.dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def from_array(cls, array):
+        """ Copy an array into a new shared memory block
+
+            Parameters:
+                array - the array to copy
+        """
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @property
+    def name(self):
+        "The name of the shared memory block"
+        return self.shm.name
+
+    def close(self):
+        "Detach from the shared memory block"
+        self.array = None
+        self.shm.close()
+
+    def unlink(self):
+        "Free the shared memory block once all processes have closed it"
+        self.shm.unlink()
+
+    def __reduce__(self):
+        return SharedArray, (self.shape, self.dtype.str, self.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
@@ -0,0 +1,166 @@
+""" file: writer.py (maxr.integrator)
+    author: Jess Robertson
+            CSIRO Mineral Resources
+    date:   June 2018
+
+    description: Streaming particle trajectories to HDF5
+"""
+
+from __future__ import print_function, division
+
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import h5py
+from numpy import empty, arange, float64
+
+# Variables written for each particle
+VARIABLES = ('position', 'velocity')
+
+
+class TrajectoryWriter(object):
+
+    """ Stream particle positions and velocities into a chunked HDF5 file
+
+        Steps are copied into an in-memory buffer, and every `chunk` steps
+        the buffer is handed to a background thread which writes it to disk,
+        so the I/O overlaps with integrating the next block of steps. Only
+        two buffers are ever in flight, so if the disk falls behind the
+        integrator waits for it rather than piling up steps in memory.
+
+        The file has 'position' and 'velocity' datasets with shape
+        (n_steps + 1, n_particles, 2) and dimensions labelled 't',
+        'particle' and 'component' (following from_function in
+        maxr.flow.generators), and a 't' dataset with the time of each step
+        attached as the time dimension scale.
+
+        Use it as a context manager, or call `close` when finished to flush
+        the last steps to disk. Any error raised while writing is re-raised
+        in the integrating thread.
+
+        Parameters:
+            filename - the HDF5 file to write to (this is overwritten)
+            nparticles - the number of particles
+            nsteps - the number of steps (the file will hold nsteps + 1
+                snapshots including the initial conditions)
+            dt - the timestep
+            time - the initial time (defaults to zero)
+            chunk - the number of steps buffered before each write, which is
+                also the HDF5 chunk length in time. Defaults to 64.
+            compression - an h5py compression filter (e.g. 'gzip' or
+                'lzf'). Optional, defaults to no compression.
+            compression_opts - options for the compression filter
+    """
+
+    def __init__(self, filename, nparticles, nsteps, dt, time=0, chunk=64,
+                 compression=None, compression_opts=None):
+        super(TrajectoryWriter, self).__init__()
+        self.filename = filename
+        self.nparticles, self.nsteps = nparticles, nsteps
+        self.chunk = max(1, min(chunk, nsteps + 1))
+        self.fhandle = h5py.File(filename, 'w')
+
+        # Time is the dimension scale for the first axis
+        shape = (nsteps + 1, nparticles, 2)
+        self.fhandle['t'] = time + dt * arange(nsteps + 1)
+        self.fhandle['t'].make_scale('t')
+        for key in VARIABLES:
+            dset = self.fhandle.create_dataset(
+                key, shape=shape, dtype=float64,
+                chunks=(self.chunk, self._particle_chunk(), 2),
+                compression=compression, compression_opts=compression_opts)
+            for idx, axis in enumerate(('t', 'particle', 'component')):
+                dset.dims[idx].label = axis
+            dset.dims[0].attach_scale(self.fhandle['t'])
+
+        # Buffers are recycled between the writer thread and the integrator
+        self._spare = Queue()
+        for _ in range(2):
+            self._spare.put(empty((len(VARIABLES), self.chunk, nparticles, 2)))
+        self._pending = Queue()
+        self._buffer, self._start, self._count = self._spare.get(), 0, 0
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _particle_chunk(self):
+        "Split particles so HDF5 chunks are around a megabyte"
+        return max(1, min(self.nparticles, 2 ** 16 // self.chunk))
+
+    def write(self, index, positions, velocities):
+        """ Add a step to the buffer, handing it off to be written if full
+
+            Steps must be written in order.
+
+            Parameters:
+                index - the step number
+                positions, velocities - the particle positions and
+                    velocities, with shape (n_particles, 2)
+        """
+        self._check()
+        if index != self._start + self._count:
+            raise ValueError("Expected step {0}, got step {1}".format(
+                self._start + self._count, index))
+        if index > self.nsteps:
+            raise IndexError("Step {0} is past the end of the file, which "
+                             "holds {1} steps".format(index, self.nsteps))
+        self._buffer[0, self._count] = positions
+        self._buffer[1, self._count] = velocities
+        self._count += 1
+        if self._count == self.chunk:
+            self.flush()
+
+    def flush(self):
+        """ Hand the buffered steps off to the writer thread
+        """
+        if self._count:
+            self._pending.put((self._start, self._count, self._buffer))
+            self._start += self._count
+            self._buffer, self._count = self._spare.get(), 0
+            self._check()
+
+    def close(self):
+        """ Write any remaining steps, wait for the writer thread and close
+            the file
+        """
+        if self.fhandle is None:
+            return
+        try:
+            self.flush()
+            self._pending.put(None)
+            self._thread.join()
+            self._check()
+        finally:
+            self.fhandle.close()
+            self.fhandle = None
+
+    def _run(self):
+        "Write buffers to disk until told to stop"
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            start, count, buffer = item
+            try:
+                if self._error is None:
+                    for idx, key in enumerate(VARIABLES):
+                        self.fhandle[key][start:start + count] = \
+                            buffer[idx, :count]
+            except Exception as err:
+                self._error = err
+            self._spare.put(buffer)
+
+    def _check(self):
+        "Re-raise errors from the writer thread"
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
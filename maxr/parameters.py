@@ -106,6 +106,14 @@ class Parameters(dict):
         else:
             super(Parameters, self).__setattr__(key, value)
 
+    def __reduce__(self):
+        # Restore the values directly so that non-dimensional parameters
+        # which have been set by hand survive pickling
+        return self.__class__, (), dict(self)
+
+    def __setstate__(self, state):
+        super(Parameters, self).update(state)
+
     def nondimensionalise(self):
         """ Calculate non dimensional parameters for the integration
         """
@@ -7,7 +7,6 @@
 
 from os import path, listdir
 from logging import getLogger
-from multiprocessing import cpu_count
 
 import numpy
 
@@ -32,35 +31,15 @@ PATH_TO_EXTENSIONS = path.join(*(
     + EXTENSIONS_MODULE
 ))
 
-def update_thread_count():
-    """ Update the thread count for OpenMP extensions
-
-        Uses one thread per core, with the estimate of the number of cores from
-        multiprocessing.cpu_count.
-    """
-    LOGGER.info('Updating thread count for cython code to %d', cpu_count())
-    num_threads = cpu_count()  # We're just going for 1 thread/CPU here
-    fname = path.join(PATH_TO_EXTENSIONS, 'common.pxd')
-    with open(fname, 'r') as src:
-        content = src.readlines()  # this is short, just slurp it
-    with open(fname, 'w') as sink:
-        for line in content:
-            if line.startswith('cdef int NUM_THREADS'):
-                sink.write('cdef int NUM_THREADS = {0}'.format(num_threads))
-            else:
-                sink.write(line)
-
 def get_extensions():
     """ Find our extensions to build.
 
-        Also updates the thread count for OpenMP extensions to the number of CPUs
-        availble on the current machine.
+        The number of OpenMP threads is set at runtime, see
+        maxr.ext.set_num_threads.
 
         Returns:
             a list of Extension objects to pass to setup
     """
-    update_thread_count()
-
     # Get the extensions
     if HAVE_CYTHON:
         files = [f for f in listdir(PATH_TO_EXTENSIONS) if f.endswith('.pyx')]
@@ -89,7 +68,6 @@ class cython_sdist(sdist):
     def run(self):
         # Make sure the compiled Cython files in the distribution are up-to-date
         from Cython.Build import cythonize
-        update_thread_count()
         cythonize([path.join(PATH_TO_EXTENSIONS, f)
                    for f in listdir(PATH_TO_EXTENSIONS)
                    if f.endswith('.pyx')])
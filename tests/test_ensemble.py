@@ -0,0 +1,139 @@
+""" file: test_ensemble.py
+"""
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import tempfile
+import unittest
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from unittest import mock
+
+import h5py
+from numpy import allclose, linspace, stack, array_equal, empty
+
+from maxr import Parameters
+from maxr.flow import Flow, blink, from_function
+from maxr.integrator import ensemble as ensemble_module
+from maxr.integrator.ensemble import EnsembleIntegrator
+from maxr.integrator.integrator import Integrator
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+
+    "Thread pool which keeps weak references to the futures it hands out"
+
+    def __init__(self, max_workers, mp_context=None, initializer=None,
+                 initargs=()):
+        super(RecordingExecutor, self).__init__(max_workers)
+        self.futures = []
+
+    def submit(self, *args, **kwargs):
+        future = super(RecordingExecutor, self).submit(*args, **kwargs)
+        self.futures.append(weakref.ref(future))
+        return future
+
+
+class RecordingResult(object):
+
+    "Result array which counts the futures still alive at each write"
+
+    def __init__(self, shape):
+        self.array = empty(shape)
+        self.executors, self.alive = [], []
+
+    def __setitem__(self, key, value):
+        self.array[key] = value
+        self.alive.append(sum(ref() is not None
+                              for executor in self.executors
+                              for ref in executor.futures))
+
+
+class TestEnsembleIntegrator(unittest.TestCase):
+
+    """ Tests for integrating ensembles in a process pool
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.params = Parameters()
+        self.params.N, self.params.dt = 20, 0.01
+        self.params.R, self.params.S = 0.6, 0.5
+        self.positions = stack([linspace(-1, 1, 10),
+                                linspace(-0.5, 0.5, 10)], axis=-1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_chunks(self):
+        "Chunks should cover every particle exactly once"
+        ensemble = EnsembleIntegrator(None, self.params, max_workers=2,
+                                      chunk_size=3)
+        chunks = ensemble.chunks(10)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(sum(c.stop - c.start for c in chunks), 10)
+        self.assertEqual(len(EnsembleIntegrator(
+            None, self.params, max_workers=2).chunks(10)), 5)
+
+    def test_futures(self):
+        "Finished chunks shouldn't be kept around"
+        ensemble = EnsembleIntegrator(None, self.params, max_workers=1,
+                                      chunk_size=1)
+        result = RecordingResult((21, 10, 2))
+
+        def executor(*args, **kwargs):
+            "Make a thread pool and let the result watch it"
+            pool = RecordingExecutor(*args, **kwargs)
+            result.executors.append(pool)
+            return pool
+
+        with mock.patch.object(ensemble_module, 'ProcessPoolExecutor',
+                               executor), \
+                mock.patch.object(ensemble_module, '_FLOW',
+                                  blink(gamma=1, period=1)):
+            ensemble._run(self.positions, None, 0, result)
+        self.assertEqual(len(result.executors[0].futures), 10)
+        self.assertEqual(len(result.alive), 10)
+        self.assertLessEqual(max(result.alive), 2 * ensemble.queued)
+        expected = Integrator(blink(gamma=1, period=1), self.params)\
+            .integrate(self.positions)
+        self.assertTrue(allclose(result.array, expected, atol=1e-12))
+
+    def test_factory(self):
+        "Ensemble should match integrating everything at once"
+        ensemble = EnsembleIntegrator(partial(blink, gamma=1, period=1),
+                                      self.params, max_workers=2,
+                                      chunk_size=4)
+        result = ensemble.integrate(self.positions)
+        expected = Integrator(blink(gamma=1, period=1), self.params)\
+            .integrate(self.positions)
+        self.assertEqual(result.shape, (21, 10, 2))
+        self.assertTrue(allclose(result, expected, atol=1e-12))
+
+    def test_flow_file(self):
+        "Workers should open flow files themselves and write to disk"
+        flowfile = os.path.join(self.tempdir, 'flow.hdf5')
+        outfile = os.path.join(self.tempdir, 'out.hdf5')
+        from_function(blink(gamma=1, period=1), flowfile)
+        ensemble = EnsembleIntegrator(flowfile, self.params, max_workers=2,
+                                      chunk_size=5)
+        self.assertIsNone(ensemble.integrate(self.positions, time=0.5,
+                                             filename=outfile))
+
+        flow = Flow(flowfile)
+        try:
+            expected = Integrator(flow.velocity, self.params)\
+                .integrate(self.positions, time=0.5)
+        finally:
+            flow.close()
+        with h5py.File(outfile, 'r') as fhandle:
+            result = fhandle['trajectory']
+            self.assertEqual(result.dims[1].label, 'particle')
+            self.assertTrue(array_equal(result[...], expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,8 +8,12 @@ import numpy
 import matplotlib.pyplot as plt
 import os
 
+from scipy.interpolate import RegularGridInterpolator
+
 from maxr import flow
 from maxr.flow.blink import blink, tick, tock
+from maxr.flow.interpolation import UniformGridInterpolator, is_uniform, \
+    interpolate
 
 
 class TestBlink(unittest.TestCase):
@@ -38,6 +42,64 @@ class TestBlink(unittest.TestCase):
         plt.legend(loc='best')
 
 
+class TestUniformGridInterpolator(unittest.TestCase):
+
+    """ Tests for interpolation on uniform grids
+    """
+
+    def setUp(self):
+        self.axes = (numpy.linspace(-2, 2, 21), numpy.linspace(-1, 1, 11),
+                     numpy.linspace(0, 2, 7))
+        self.values = numpy.random.normal(size=(21, 11, 7))
+        self.expected = RegularGridInterpolator(
+            self.axes, self.values, bounds_error=False, fill_value=numpy.nan)
+        points = numpy.random.uniform((-2.5, -1.2, -0.2), (2.5, 1.2, 2.2),
+                                      (500, 3))
+        points[0] = (2, 1, 2)
+        points[1] = (-2, -1, 0)
+        points[2] = (0.2, 0.4, 1 / 3)
+        points[3] = (0.1, numpy.nan, 1)
+        self.points = points.reshape(50, 10, 3)
+
+    def check(self, interpolator):
+        "Check an interpolator against scipy"
+        result = interpolator(self.points)
+        self.assertEqual(result.shape, (50, 10))
+        self.assertTrue(numpy.allclose(result, self.expected(self.points),
+                                       rtol=0, atol=1e-12, equal_nan=True))
+        self.assertTrue(numpy.isfinite(result.ravel()[:3]).all())
+        self.assertTrue(numpy.isnan(result.ravel()[3]))
+
+    def test_numpy(self):
+        "Numpy interpolation should match scipy"
+        interpolator = UniformGridInterpolator(self.axes, self.values)
+        interpolator.compiled = False
+        self.check(interpolator)
+
+    @unittest.skipIf(interpolate is None, "Extensions aren't built")
+    def test_compiled(self):
+        "Compiled interpolation should match scipy"
+        interpolator = UniformGridInterpolator(self.axes, self.values)
+        self.assertTrue(interpolator.compiled)
+        self.check(interpolator)
+        self.assertRaises(ValueError, interpolate.trilinear, self.values,
+                          interpolator.lower, interpolator.upper,
+                          numpy.zeros((4, 3)), 0., numpy.zeros(3))
+
+    def test_checks(self):
+        "Non-uniform grids and mismatched values should be rejected"
+        self.assertTrue(is_uniform(self.axes[0]))
+        self.assertFalse(is_uniform([0, 1, 3]))
+        self.assertFalse(is_uniform([1, 0]))
+        axes = (self.axes[0] ** 3,) + self.axes[1:]
+        self.assertRaises(ValueError, UniformGridInterpolator, axes,
+                          self.values)
+        self.assertRaises(ValueError, UniformGridInterpolator, self.axes,
+                          self.values[1:])
+        interpolator = UniformGridInterpolator(self.axes, self.values)
+        self.assertRaises(ValueError, interpolator, numpy.zeros((4, 2)))
+
+
 class TestFlow(unittest.TestCase):
 
     """ Tests for Flow class
@@ -66,6 +128,45 @@ class TestFlow(unittest.TestCase):
         for key in ('u', 'v', 'du/dx', 'dv/dy', 'du/dt'):
             self.assertTrue(self.flow(key) is not None)
 
+    def test_cache(self):
+        "Interpolators should be cached until invalidated"
+        interpolator = self.flow('u')
+        self.assertTrue(self.flow('u') is interpolator)
+        self.assertEqual((self.flow.hits, self.flow.misses), (1, 1))
+        self.assertTrue(isinstance(self.flow._load('u'), numpy.memmap))
+        self.flow.mmap = False
+        self.assertFalse(isinstance(self.flow._load('u'), numpy.memmap))
+        self.flow.invalidate('u')
+        self.assertEqual(self.flow.nbytes, 0)
+        self.assertFalse(self.flow('u') is interpolator)
+        self.flow.invalidate()
+        self.assertFalse(self.flow('u') is interpolator)
+
+    def test_eviction(self):
+        "Least recently used interpolators should be evicted"
+        self.flow.max_bytes = 2 * self.flow.data['u'].nbytes
+        keys = ('u', 'v', 'du/dx')
+        for key in keys:
+            self.flow(key)
+        self.assertEqual(list(self.flow._interpolators), ['v', 'du/dx'])
+        self.assertEqual(self.flow.nbytes, self.flow.max_bytes)
+        self.flow('v')
+        self.flow('u')
+        self.assertEqual(list(self.flow._interpolators), ['v', 'u'])
+
+    def test_uniform(self):
+        "Uniform grids should use the fast interpolator"
+        self.assertTrue(isinstance(self.flow('u'), UniformGridInterpolator))
+
+    def test_outside(self):
+        "Points outside the grid should get NaN rather than raising"
+        self.assertEqual(self.flow.domain, ((-2, 2), (-2, 2)))
+        uus, vvs = self.flow.velocity(numpy.array([0.25, 3]),
+                                      numpy.array([0.25, 0]), [0.5, 5])
+        self.assertEqual(uus.shape, (2, 2))
+        self.assertTrue(numpy.isfinite(uus[0, 0]))
+        self.assertTrue(numpy.isnan(vvs[1]).all() and numpy.isnan(uus[0, 1]))
+
     def test_flow_info(self):
         "Flow info should be accessible"
         self.flow.info()
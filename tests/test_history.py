@@ -3,13 +3,18 @@
 
 from __future__ import print_function, division
 
+import os
+import shutil
+import tempfile
+import tracemalloc
 import unittest
 from collections import defaultdict
 
-from numpy import array, sqrt, pi, linspace, sin, cos, arange, median
+from numpy import array, sqrt, pi, linspace, sin, cos, arange, median, allclose, \
+    exp, log2, memmap, load
 from scipy.special import fresnel
 
-from maxr.integrator import history
+from maxr.integrator import history, expansion
 
 
 def solution(time):
@@ -23,10 +28,12 @@ def solution(time):
 def evaluate_history_integral(func, times, order=1):
     """ Evaluate the history integral for a given driving function func
     """
-    return array([0] + [
-        history.integrator(func(times[:idx+1]), times[:idx+1],
-                           order=order)
-        for idx in range(1, len(times))])
+    accumulator = history.HistoryAccumulator(order)
+    result = []
+    for state, time in zip(func(times), times):
+        accumulator.push(state, time)
+        result.append(accumulator.integral())
+    return array(result)
 
 
 class TestHistory(unittest.TestCase):
@@ -67,6 +74,13 @@ class TestHistory(unittest.TestCase):
             self.assertTrue(
                 median(numeric - exact) < 1e-5)
 
+    def test_tail_weights(self):
+        "Tail weights should integrate a constant exactly"
+        times = linspace(0, 1, 101) ** 2
+        self.assertTrue(allclose(
+            history.tail_weights(times, 1.5).sum(),
+            2 * (sqrt(1.5) - sqrt(0.5))))
+
     def test_range_steps(self):
         """ Integrators should work for all orders at all steps
         """
@@ -81,3 +95,407 @@ class TestHistory(unittest.TestCase):
                 times = linspace(self.tmin, self.tmax, num)
                 err = evaluate_history_integral(sin, times, order=order) - solution(times)
                 error[order].append(abs(err).max())
+
+
+class TestCoefficientCache(unittest.TestCase):
+
+    """ Tests for the coefficient cache
+    """
+
+    def setUp(self):
+        self.cache = history.CoefficientCache()
+
+    def test_hits_and_misses(self):
+        "Repeated lookups should hit the cache"
+        first = self.cache(50, 3)
+        second = self.cache(50, 3)
+        self.assertTrue(first is second)
+        self.assertEqual(self.cache.info()[:3], (1, 1, 1))
+
+    def test_values(self):
+        "Cached coefficients should match uncached ones"
+        for order in (1, 2, 3):
+            for num in range(1, 20):
+                self.assertTrue(allclose(
+                    self.cache(num, order), history._coefficients(num, order)))
+
+    def test_read_only(self):
+        "Cached arrays should not be writeable"
+        coeffs = self.cache(10, 3)
+        self.assertRaises(ValueError, coeffs.__setitem__, 0, 1)
+
+    def test_eviction(self):
+        "Least recently used arrays should be evicted to stay within budget"
+        self.cache.resize(3 * 8 * 101)
+        for num in (100, 99, 98):
+            self.cache(num, 3)
+        self.cache(100, 3)  # touch so that 99 is the oldest
+        self.cache(97, 3)
+        self.assertTrue((99, 3) not in self.cache)
+        self.assertTrue((100, 3) in self.cache)
+        self.assertTrue(self.cache.nbytes <= self.cache.max_bytes)
+
+    def test_oversize(self):
+        "Arrays larger than the budget should not be cached"
+        self.cache.resize(0)
+        self.cache(100, 3)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_clear(self):
+        "Clearing should reset everything"
+        self.cache(10, 2)
+        self.cache.clear()
+        self.assertEqual(self.cache.info()[:4], (0, 0, 0, 0))
+
+
+class TestVariableSteps(unittest.TestCase):
+
+    """ Tests for the history integrator with non-uniform time steps
+    """
+
+    @staticmethod
+    def graded(nsteps, tmax=20):
+        "Time levels bunched up towards the start"
+        return tmax * linspace(0, 1, nsteps + 1) ** 1.5
+
+    def test_uniform(self):
+        "Weights should match the uniform coefficients for even steps"
+        for nsteps in (1, 2, 3, 4, 10, 100):
+            times = linspace(0, 10, nsteps + 1)
+            for order in (1, 2):
+                self.assertTrue(allclose(
+                    history.variable_coefficients(times, order),
+                    sqrt(times[1]) * history.coefficients(nsteps, order)[::-1],
+                    rtol=1e-12, atol=0))
+
+    def test_continuous(self):
+        "Nudging the time levels off uniform should barely change results"
+        times = linspace(0, 10, 101)
+        nudged = times.copy()
+        nudged[1:-1] += 1e-9 * sin(arange(1, 100))
+        self.assertFalse(history.uniform(nudged))
+        for order in (1, 2):
+            self.assertAlmostEqual(
+                history.integrator(sin(times), times, order),
+                history.integrator(sin(nudged), nudged, order), 10)
+
+    def test_constant(self):
+        "Weights should integrate a constant exactly"
+        times = self.graded(37)
+        for order in (1, 2):
+            self.assertAlmostEqual(
+                history.variable_coefficients(times, order).sum(),
+                2 * sqrt(times[-1]))
+
+    def test_convergence(self):
+        "Error should drop as h^2 and h^3 for the first and second order"
+        for order in (1, 2):
+            errors = []
+            for nsteps in (200, 400, 800):
+                times = self.graded(nsteps)
+                errors.append(abs(history.integrator(sin(times), times, order)
+                                  - solution(times[-1])))
+            rates = log2(array(errors[:-1]) / array(errors[1:]))
+            self.assertTrue((rates > order + 0.6).all())
+
+    def test_third_order(self):
+        "Third order shouldn't be available for non-uniform steps"
+        times = self.graded(20)
+        self.assertRaises(ValueError, history.integrator,
+                          sin(times), times, 3)
+
+    def test_coeffs(self):
+        "Uniform coefficients shouldn't be used with non-uniform steps"
+        times = self.graded(50)
+        self.assertRaises(ValueError, history.integrator, sin(times), times,
+                          2, history.coefficients(50, 2))
+
+
+class TestCoefficientStore(unittest.TestCase):
+
+    """ Tests for the on-disk coefficient store
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = history.CoefficientStore(self.path, min_length=16)
+
+    def tearDown(self):
+        history.use_store(None)
+        shutil.rmtree(self.path)
+
+    def test_values(self):
+        "Stored coefficients should match calculated ones"
+        for order in (1, 2, 3):
+            for num in (3, 10, 16, 17, 31, 32, 33, 100, 1000):
+                self.assertTrue(allclose(
+                    self.store(num, order), history._coefficients(num, order),
+                    rtol=1e-14, atol=0))
+
+    def test_files(self):
+        "Lengths should be rounded up to powers of two"
+        for num in (20, 25, 32, 33):
+            self.store(num, 3)
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['order3_32.npy', 'order3_64.npy'])
+        self.store.clear()
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_memmap(self):
+        "Lookups should be read-only maps which leave the file alone"
+        coeffs = self.store(40, 3)
+        self.assertTrue(isinstance(coeffs, memmap))
+        self.assertFalse(coeffs.flags.writeable)
+        self.assertTrue(allclose(load(self.store.filename(64, 3)),
+                                 history._coefficients(64, 3)))
+
+    def test_use_store(self):
+        "Coefficients should be looked up from the store once it's in use"
+        history.use_store(self.path)
+        history.CACHE.compute.min_length = 16
+        self.assertTrue(isinstance(history.coefficients(100, 2), memmap))
+        self.assertEqual(os.listdir(self.path), ['order2_128.npy'])
+        history.use_store(None)
+        self.assertFalse(isinstance(history.coefficients(100, 2), memmap))
+
+
+class TestCoefficients(unittest.TestCase):
+
+    """ Tests for the coefficients for long histories
+    """
+
+    def test_sum(self):
+        "Coefficients should integrate a constant exactly"
+        for order in (1, 2, 3):
+            for num in (10, 100, 10 ** 4, 10 ** 6):
+                self.assertTrue(allclose(
+                    history.coefficients(num, order).sum(), 2 * sqrt(num),
+                    rtol=1e-12))
+
+    def test_asymptotic(self):
+        "Interior coefficients should approach 1/sqrt(j)"
+        jidx = array([10 ** 4, 10 ** 5, 10 ** 6])
+        for order in (1, 2, 3):
+            self.assertTrue(allclose(
+                history.interior(jidx, order) * sqrt(jidx), 1, rtol=1e-7))
+
+    def test_expansion(self):
+        "Asymptotic series should agree with the direct formula"
+        for expansions in (expansion.INTERIOR, expansion.BOUNDARY):
+            for exps in expansions.values():
+                for expn in (exps if isinstance(exps, list) else [exps]):
+                    num = arange(expn.cutoff, expn.cutoff + 10)
+                    self.assertTrue(allclose(
+                        expn.direct(num), expn.asymptotic(num),
+                        rtol=1e-10, atol=0))
+
+
+class TestHistoryAccumulator(unittest.TestCase):
+
+    """ Tests for the incremental history integrator
+    """
+
+    def test_matches_integrator(self):
+        "Accumulated integrals should match integrating each prefix"
+        times = linspace(0, 10, 60)
+        for order in (1, 2, 3):
+            accumulator = history.HistoryAccumulator(order, capacity=4)
+            for idx, time in enumerate(times):
+                accumulator.push(sin(time), time)
+                if idx > 0:
+                    expected = history.integrator(
+                        sin(times[:idx+1]), times[:idx+1], order)
+                    self.assertTrue(allclose(accumulator.integral(), expected))
+                    self.assertTrue(allclose(
+                        accumulator.coefficients,
+                        history.coefficients(idx, order)))
+
+    def test_vector_states(self):
+        "Accumulator should handle vector-valued states"
+        times = linspace(0, 5, 30)
+        states = array([sin(times), cos(times)]).T
+        accumulator = history.HistoryAccumulator()
+        for state, time in zip(states, times):
+            accumulator.push(state, time)
+        expected = [history.integrator(states[:, idx], times)
+                    for idx in (0, 1)]
+        self.assertTrue(allclose(accumulator.integral(), expected))
+
+    def test_single_state(self):
+        "History integral over a single state should be zero"
+        accumulator = history.HistoryAccumulator()
+        accumulator.push(1.0, 0.0)
+        self.assertEqual(accumulator.integral(), 0)
+
+    def test_uneven(self):
+        "Pushing a state with a different step should raise"
+        accumulator = history.HistoryAccumulator()
+        for time in (0, 0.1, 0.2):
+            accumulator.push(sin(time), time)
+        self.assertRaises(ValueError, accumulator.push, 1.0, 0.35)
+        self.assertEqual(len(accumulator), 3)
+
+
+class TestIntegrateAll(unittest.TestCase):
+
+    """ Tests for the all-prefix history integrator
+    """
+
+    def test_matches_integrator(self):
+        "All-prefix integrals should match integrating each prefix"
+        for order in (1, 2, 3):
+            for nsteps in list(range(2, 12)) + [50, 100]:
+                times = linspace(0, 10, nsteps)
+                states = cos(times) + 0.3
+                expected = array([0] + [
+                    history.integrator(states[:idx+1], times[:idx+1], order)
+                    for idx in range(1, nsteps)])
+                self.assertTrue(allclose(
+                    history.integrate_all(states, times, order), expected,
+                    atol=1e-9))
+
+    def test_vector_states(self):
+        "Trailing axes should be integrated separately"
+        times = linspace(0, 10, 100)
+        states = array([sin(times), cos(times)]).T
+        result = history.integrate_all(states, times)
+        for idx in (0, 1):
+            self.assertTrue(allclose(
+                result[:, idx], history.integrate_all(states[:, idx], times)))
+
+    def test_solution(self):
+        "All-prefix integrals should converge to the analytic solution"
+        times = linspace(0, 20, 500)
+        self.assertTrue(abs(
+            history.integrate_all(sin(times), times) - solution(times)
+        ).max() < 1e-5)
+
+    def test_uneven(self):
+        "Uneven time levels should raise"
+        times = linspace(0, 1, 50) ** 1.5
+        self.assertRaises(ValueError, history.integrate_all, sin(times),
+                          times)
+
+
+class TestIntegratorBatch(unittest.TestCase):
+
+    """ Tests for the batched history integrator
+    """
+
+    def setUp(self):
+        self.times = linspace(0, 10, 200)
+        phases = linspace(0, 1, 5)
+        self.states = sin(self.times[None, :] + phases[:, None])
+
+    def test_particles(self):
+        "Batched integrals should match integrating each particle"
+        expected = [history.integrator(state, self.times)
+                    for state in self.states]
+        self.assertTrue(allclose(
+            history.integrator_batch(self.states, self.times, axis=-1),
+            expected))
+
+    def test_dims(self):
+        "Batches shaped (n_particles, n_steps, n_dims) should work"
+        states = array([self.states, 2 * self.states]).transpose(1, 2, 0)
+        result = history.integrator_batch(states, self.times, order=2)
+        self.assertEqual(result.shape, (5, 2))
+        for pidx, state in enumerate(self.states):
+            expected = history.integrator(state, self.times, order=2)
+            self.assertTrue(allclose(result[pidx], [expected, 2 * expected]))
+
+    def test_uneven(self):
+        "Uneven time levels should use the variable step weights"
+        times = 10 * linspace(0, 1, 200) ** 1.5
+        states = sin(times[None, :] + linspace(0, 1, 5)[:, None])
+        for order in (1, 2):
+            expected = [history.integrator(state, times, order)
+                        for state in states]
+            self.assertTrue(allclose(
+                history.integrator_batch(states, times, order, axis=-1),
+                expected))
+        self.assertRaises(ValueError, history.integrator_batch, states,
+                          times, 3, -1)
+
+
+class TestCompressedHistory(unittest.TestCase):
+
+    """ Tests for the sum-of-exponentials history integrator
+    """
+
+    def test_fit(self):
+        "Exponential fits should be within tolerance"
+        times = linspace(0.1, 100, 1000)
+        for tol in (1e-4, 1e-8):
+            weights, rates = history.exponential_fit(tol, 0.1, 100)
+            approx = exp(-times[:, None] * rates).dot(weights)
+            self.assertTrue(abs(approx * sqrt(times) - 1).max() < tol)
+
+    def test_solution(self):
+        "Compressed history should approximate the full history integral"
+        times = linspace(0, 20, 1000)
+        compressed = history.CompressedHistory(window=16, tol=1e-8)
+        result = []
+        for time in times:
+            compressed.push(sin(time), time)
+            result.append(compressed.integral())
+        self.assertTrue(abs(array(result) - solution(times)).max() < 1e-4)
+        self.assertTrue(abs(
+            array(result) - history.integrate_all(sin(times), times, 2)
+        ).max() < 1e-4)
+        self.assertEqual(len(compressed.recent), 17)
+
+    def test_window(self):
+        """ Windowed history integrals should stay close to the full sum,
+            with memory that doesn't grow with the length of the history
+
+            Windowing comes from CompressedHistory, which integrates the
+            last `window` steps exactly and carries the older ones in a
+            fixed number of auxiliary variables. With 1000 steps over
+            [0, 30] the difference from the full sum at the end is about
+            2e-5, 5e-5 and 2e-6 for windows of 8, 32 and 128 steps.
+        """
+        times = linspace(0, 30, 1000)
+        full = history.integrator(sin(times), times)
+        for window in (8, 32, 128):
+            compressed = history.CompressedHistory(window=window, tol=1e-8)
+            for time in times:
+                compressed.push(sin(time), time)
+            self.assertTrue(abs(compressed.integral() - full) < 1e-4)
+            self.assertTrue(abs(compressed.integral()
+                                - solution(times[-1])) < 1e-4)
+            self.assertEqual(len(compressed.recent), window + 1)
+
+        # Keeping every state would take another 2.4 MB here
+        compressed = history.CompressedHistory(window=32, tol=1e-8)
+        state = linspace(0, 1, 100)
+        tracemalloc.start()
+        try:
+            for step in range(4000):
+                compressed.push(sin(0.01 * step) * state, 0.01 * step)
+                if step == 999:
+                    before = tracemalloc.get_traced_memory()[0]
+            compressed.integral()
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(after - before, 3000 * state.nbytes / 100)
+
+    def test_vector_states(self):
+        "Compressed history should handle vector-valued states"
+        times = linspace(0, 5, 500)
+        states = array([sin(times), cos(times)]).T
+        compressed = history.CompressedHistory(window=8)
+        for state, time in zip(states, times):
+            compressed.push(state, time)
+        expected = [history.integrator(states[:, idx], times)
+                    for idx in (0, 1)]
+        self.assertTrue(allclose(compressed.integral(), expected, atol=1e-4))
+
+    def test_uneven(self):
+        "Pushing a state with a different step should raise"
+        compressed = history.CompressedHistory(window=8)
+        for time in (0, 0.1, 0.2):
+            compressed.push(sin(time), time)
+        self.assertRaises(ValueError, compressed.push, 1.0, 0.35)
+        self.assertEqual(len(compressed), 3)
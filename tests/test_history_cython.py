@@ -2,10 +2,15 @@
 """
 
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
-from maxr.integrator.history import coefficients
+from maxr.integrator.history import coefficients, integrator
 from maxr.ext.coefficients import IntegratorCoeffs
+from maxr.ext import history
+
+from .test_history import solution
 
 class BaseHarness(unittest.TestCase):
 
@@ -20,6 +25,137 @@ class BaseHarness(unittest.TestCase):
                 IntegratorCoeffs(length, self.order).as_array(),
                 coefficients(length, self.order)))
 
+    def test_zero_copy(self):
+        "Coefficients should be viewable as a read-only array without copying"
+        coeffs = IntegratorCoeffs(20, self.order)
+        view = np.asarray(coeffs)
+        self.assertTrue(view.base is not None)
+        self.assertFalse(view.flags.writeable)
+        self.assertEqual(len(coeffs), 21)
+        self.assertEqual(coeffs[-1], view[-1])
+        self.assertTrue(np.allclose(view, coefficients(20, self.order)))
+
+    def test_integrator(self):
+        "Cython coefficients should be usable in the history integrator"
+        times = np.linspace(0, 10, 101)
+        states = np.sin(times)
+        self.assertTrue(np.allclose(
+            integrator(states, times, self.order,
+                       coeffs=IntegratorCoeffs(100, self.order)),
+            integrator(states, times, self.order)))
+
+    def test_extend(self):
+        "Extended coefficients should match freshly calculated ones"
+        coeffs = IntegratorCoeffs(1, self.order)
+        for length in range(2, 60):
+            coeffs.extend()
+            self.assertTrue(np.allclose(
+                coeffs.as_array(), coefficients(length, self.order)))
+        self.assertTrue(coeffs.capacity >= 60)
+
+    def test_resize(self):
+        "Resized coefficients should match freshly calculated ones"
+        coeffs = IntegratorCoeffs(5, self.order)
+        for length in (40, 20, 3, 1000, 8):
+            coeffs.resize(length)
+            self.assertEqual(len(coeffs), length + 1)
+            self.assertTrue(np.allclose(
+                coeffs.as_array(), coefficients(length, self.order)))
+
+    def test_resize_exported(self):
+        "Resizing should fail while the buffer is being viewed"
+        coeffs = IntegratorCoeffs(10, self.order)
+        view = memoryview(coeffs)
+        self.assertRaises(BufferError, coeffs.extend, 100)
+        view.release()
+        coeffs.extend(100)
+        self.assertEqual(coeffs.n, 110)
+
+    def test_dot(self):
+        "History sums should match numpy, including the parallel path"
+        for length in (5, 50, 20000):
+            coeffs = IntegratorCoeffs(length, self.order)
+            states = np.random.random(length + 1)
+            self.assertTrue(np.allclose(
+                history.dot(coeffs, states),
+                (coeffs.as_array() * states[::-1]).sum()))
+        self.assertRaises(ValueError, history.dot, coeffs, states[1:])
+
+    def test_large_n(self):
+        "Cython coefficients should stay accurate for long histories"
+        for length in (10 ** 3, 10 ** 4, 10 ** 6):
+            self.assertTrue(np.allclose(
+                IntegratorCoeffs(length, self.order).as_array(),
+                coefficients(length, self.order), rtol=1e-11, atol=0))
+
+    def test_integral(self):
+        "Cython history sums should match the Python integrator"
+        times = np.linspace(0, 10, 201)
+        history_2d = np.column_stack([np.sin(times), np.cos(times)])
+        coeffs = IntegratorCoeffs(200, self.order)
+        for states in history_2d.T:
+            self.assertTrue(np.allclose(
+                history.integral(coeffs, states, times[1]),
+                integrator(states, times, self.order)))
+        self.assertRaises(ValueError, history.integral,
+                          coeffs, history_2d[1:, 0], times[1])
+
+    def test_integral_threaded(self):
+        "History sums should run concurrently in threads"
+        times = np.linspace(0, 10, 20001)
+        coeffs = IntegratorCoeffs(20000, self.order)
+        histories = [np.sin(freq * times) for freq in range(1, 9)]
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(
+                lambda states: history.integral(coeffs, states, times[1]),
+                histories))
+        for states, result in zip(histories, results):
+            self.assertAlmostEqual(
+                result, history.integral(coeffs, states, times[1]))
+
+    def test_single(self):
+        "Single precision coefficients should be rounded double ones"
+        coeffs = IntegratorCoeffs(1000, self.order, dtype='float32')
+        self.assertEqual(coeffs.dtype, np.float32)
+        self.assertEqual(np.asarray(coeffs).dtype, np.float32)
+        self.assertTrue(np.array_equal(
+            np.asarray(coeffs),
+            IntegratorCoeffs(1000, self.order).as_array().astype('float32')))
+        coeffs.extend(50000)
+        self.assertTrue(np.allclose(
+            coeffs.as_array(), coefficients(51000, self.order),
+            rtol=2 ** -24, atol=0))
+        self.assertRaises(ValueError, IntegratorCoeffs, 10, self.order,
+                          dtype='int32')
+
+    def test_single_integral(self):
+        """ Single precision history sums should be within the documented
+            bound of the double precision ones and the exact solution
+        """
+        tmax = 30
+        for offset in (0, 1.1):
+            # A non-zero offset checks the rounding of the constant term
+            # 2 sqrt(T) * states[0] as well as the sum
+            bound = 6 * np.sqrt(tmax) * 2 ** -24 * (1 + offset)
+            for length in (1000, 100000):
+                times = np.linspace(0, tmax, length + 1)
+                states = np.sin(times) + offset
+                double = history.integral(
+                    IntegratorCoeffs(length, self.order), states, times[1])
+                single = history.integral(
+                    IntegratorCoeffs(length, self.order, dtype='float32'),
+                    states.astype('float32'), times[1])
+                self.assertTrue(abs(single - double) < bound)
+                self.assertTrue(abs(
+                    single - integrator(states, times, self.order))
+                    < bound)
+                if not offset:
+                    self.assertTrue(abs(single - solution(tmax))
+                                    < abs(double - solution(tmax)) + bound)
+        self.assertRaises(ValueError, history.integral,
+                          IntegratorCoeffs(length, self.order, 'float32'),
+                          states, times[1])
+
 class TestFirstOrderIntegrator(BaseHarness):
     order = 1
 
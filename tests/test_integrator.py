@@ -0,0 +1,382 @@
+""" file: test_integrator.py
+"""
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+
+from numpy import zeros, zeros_like, sin, cos, sqrt, pi, roots, array, \
+    allclose, linspace, stack, concatenate, isnan, isfinite, \
+    flatnonzero
+from scipy.special import wofz
+
+from maxr import Parameters
+from maxr.flow import Flow, blink, from_function
+from maxr.integrator.history import coefficients
+from maxr.integrator.integrator import Integrator, stepper
+from maxr.integrator.writer import TrajectoryWriter
+
+
+def still(xxs, yys, times):
+    "Fluid at rest"
+    velocity = zeros((len(xxs), len(times)))
+    return velocity, velocity
+
+
+def rotation(xxs, yys, times):
+    "Solid body rotation about the origin"
+    return (-yys[:, None] + zeros_like(times),
+            xxs[:, None] + zeros_like(times))
+
+
+def shaking(xxs, yys, times):
+    "Uniform flow oscillating in x"
+    velocity = sin(times) + zeros((len(xxs), 1))
+    return velocity, zeros_like(velocity)
+
+
+def drift(xxs, yys, times):
+    "Uniform flow in x, with a little shear so particles differ"
+    return (1 + 0.1 * yys[:, None] + zeros_like(times),
+            zeros((len(xxs), len(times))))
+
+
+def relaxation(velocity, time, R, S):
+    """ Relative velocity of a particle released into fluid at rest
+
+        Solves dw/dt = -R w / S - R sqrt(3 / pi S) d/dt int(w / sqrt(t - tau))
+        by Laplace transform.
+    """
+    xi = R * sqrt(3 / (pi * S))
+    root1, root2 = roots([1, xi * sqrt(pi), R / S]).astype(complex)
+    term = lambda root: root * wofz(-1j * root * sqrt(time))
+    return (velocity * (term(root1) - term(root2)) / (root1 - root2)).real
+
+
+class TestIntegrator(unittest.TestCase):
+
+    """ Tests for the Daitche integrator
+    """
+
+    def parameters(self, nsteps, tmax, R=0.6, S=0.5):
+        "Make parameters for nsteps steps up to tmax"
+        params = Parameters()
+        params.N, params.dt = nsteps, tmax / nsteps
+        params.R, params.S = R, S
+        return params
+
+    def test_shapes(self):
+        "Trajectories and histories should cover every step"
+        integrator = Integrator(rotation, self.parameters(20, 1))
+        self.assertTrue(integrator.trajectory is None)
+        self.assertRaises(ValueError, integrator.step)
+        trajectory = integrator.integrate(zeros((7, 2)) + 1)
+        self.assertEqual(trajectory.shape, (21, 7, 2))
+        self.assertEqual(integrator.history.shape, (21, 7, 2))
+        self.assertAlmostEqual(integrator.time, 1)
+        self.assertRaises(IndexError, integrator.step)
+
+    def test_writer(self):
+        "Streamed trajectories should match the ones kept in memory"
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'trajectory.hdf5')
+            params = self.parameters(50, 1)
+            integrator = Integrator(blink(gamma=1, period=1), params)
+            angles = linspace(0, 2 * pi, 7)
+            start = stack([cos(angles), sin(angles)], axis=-1) / 4
+            writer = TrajectoryWriter(filename, 7, params.N, params.dt,
+                                      time=1, chunk=8, compression='gzip')
+            self.assertTrue(integrator.integrate(start, time=1,
+                                                 writer=writer) is None)
+            self.assertTrue(writer.fhandle is None)
+            self.assertEqual(integrator._positions.shape, (2, 7, 2))
+            self.assertTrue(integrator.trajectory is None)
+            trajectory = Integrator(blink(gamma=1, period=1),
+                                    params).integrate(start, time=1)
+            self.assertRaises(ValueError, writer.write, 0, start, start)
+            with h5py.File(filename, 'r') as fhandle:
+                self.assertTrue(allclose(fhandle['position'][...],
+                                         trajectory))
+                self.assertTrue(allclose(fhandle['velocity'][-1],
+                                         integrator.velocities))
+                self.assertTrue(allclose(fhandle['t'][[0, -1]], [1, 2]))
+                self.assertEqual(fhandle['velocity'].dims[1].label,
+                                 'particle')
+                self.assertEqual(fhandle['position'].chunks[0], 8)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_checkpoint(self):
+        "Restarting from a checkpoint should give an identical trajectory"
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'checkpoint.hdf5')
+            params = self.parameters(40, 1)
+            params.R = 0.8
+            angles = linspace(0, 2 * pi, 7)
+            start = stack([cos(angles), sin(angles)], axis=-1) / 4
+            flow = blink(gamma=1, period=1)
+            expected = Integrator(flow, params).integrate(start, time=0.1)
+
+            integrator = Integrator(flow, params)
+            self.assertRaises(ValueError, integrator.checkpoint, filename)
+            integrator.reset(start, time=0.1)
+            for _ in range(17):
+                integrator.step()
+            integrator.checkpoint(filename)
+            self.assertEqual(os.listdir(tempdir), ['checkpoint.hdf5'])
+
+            restored = Integrator.restore(flow, filename)
+            self.assertEqual(restored.index, 17)
+            self.assertAlmostEqual(restored.parameters.R, 0.8)
+            while restored.index < params.N:
+                restored.step()
+            self.assertTrue(allclose(restored.trajectory, expected,
+                                     rtol=0, atol=1e-14))
+
+            short = self.parameters(10, 1)
+            self.assertRaises(ValueError, Integrator.restore, flow, filename,
+                              short)
+            longer = self.parameters(80, 2)
+            longer.R = 0.8
+            self.assertEqual(
+                Integrator.restore(flow, filename, longer).index, 17)
+            for key, value in (('R', 0.6), ('S', 1.), ('dt', 0.01)):
+                other = self.parameters(80, 2)
+                other.R = 0.8
+                setattr(other, key, value)
+                self.assertRaises(ValueError, Integrator.restore, flow,
+                                  filename, other)
+
+            # Only the current positions are saved when that's all we keep
+            integrator.reset(start, time=0.1, keep=3)
+            for _ in range(17):
+                integrator.step()
+            integrator.checkpoint(filename)
+            restored = Integrator.restore(flow, filename)
+            self.assertTrue(restored.trajectory is None)
+            while restored.index < params.N:
+                restored.step()
+            self.assertTrue(allclose(restored.positions, expected[-1],
+                                     rtol=0, atol=1e-14))
+            self.assertRaises(ValueError, integrator.reset, start, keep=1)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_steps(self):
+        "Stepping through a run should yield views of each block of steps"
+        params = self.parameters(20, 1)
+        start = zeros((3, 2)) + 1
+        expected, speeds = Integrator(rotation, params), []
+        expected.reset(start)
+        while expected.index < params.N:
+            expected.step()
+            speeds.append(expected.velocities)
+        integrator = Integrator(rotation, params)
+        self.assertRaises(ValueError, next, integrator.steps())
+        integrator.reset(start)
+        self.assertRaises(ValueError, next, integrator.steps(chunk=0))
+        blocks = []
+        for index, positions, velocities in integrator.steps(chunk=6):
+            self.assertTrue(positions.base is not None)
+            self.assertEqual(integrator._positions.shape, (7, 3, 2))
+            blocks.append((index, positions.copy(), velocities.copy()))
+        self.assertEqual([block[0] for block in blocks], [6, 12, 18, 20])
+        self.assertEqual([len(block[1]) for block in blocks], [6, 6, 6, 2])
+        self.assertTrue(allclose(concatenate([b[1] for b in blocks]),
+                                 expected.trajectory[1:], rtol=0,
+                                 atol=1e-14))
+        self.assertTrue(allclose(concatenate([b[2] for b in blocks]),
+                                 speeds, rtol=0, atol=1e-14))
+        self.assertTrue(integrator.trajectory is None)
+        self.assertEqual(list(integrator.steps()), [])
+
+    def test_domain(self):
+        "Particles leaving the domain should stop and be compacted away"
+        params = self.parameters(40, 1)
+        start = stack([linspace(-1, 0.9, 8), linspace(-0.5, 0.5, 8)], axis=-1)
+        integrator = Integrator(drift, params, domain=((-2, 1), (-1, 1)))
+        trajectory = integrator.integrate(start)
+        exits = integrator.exits
+        self.assertTrue((exits[-2:] > 0).all() and (exits[:2] == -1).all())
+        self.assertLess(len(integrator.particles), 8)
+        self.assertTrue(set(integrator.particles) >= set(
+            particle for particle in range(8) if exits[particle] < 0))
+        self.assertTrue(isnan(trajectory[-1, -1]).all())
+
+        # Particles should follow the same paths as they would on their own
+        for particle in range(8):
+            alone = Integrator(drift, params).integrate(start[[particle]])
+            last = exits[particle] if exits[particle] >= 0 else params.N
+            self.assertTrue(allclose(trajectory[:last + 1, particle],
+                                     alone[:last + 1, 0], rtol=0, atol=1e-12))
+            self.assertTrue(isnan(trajectory[last + 1:, particle]).all())
+            if exits[particle] >= 0:
+                self.assertTrue(trajectory[last, particle, 0] > 1)
+                self.assertTrue(trajectory[last - 1, particle, 0] <= 1)
+
+    def test_checkpoint_stopped(self):
+        "Stopped particles should survive checkpointing"
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'checkpoint.hdf5')
+            params, domain = self.parameters(40, 1), ((-2, 1), (-1, 1))
+            start = stack([linspace(-1, 0.9, 8), zeros(8)], axis=-1)
+            expected = Integrator(drift, params, domain=domain)\
+                .integrate(start)
+
+            integrator = Integrator(drift, params, domain=domain)
+            integrator.reset(start)
+            for _ in range(25):
+                integrator.step()
+            integrator.checkpoint(filename)
+            self.assertTrue((integrator.exits >= 0).any())
+            restored = Integrator.restore(drift, filename, domain=domain)
+            self.assertEqual(len(restored.particles),
+                             (restored.exits < 0).sum())
+            while restored.index < params.N:
+                restored.step()
+            self.assertTrue(allclose(restored.trajectory, expected,
+                                     rtol=0, atol=1e-14, equal_nan=True))
+
+            # Also when stepping through the rest of the run in chunks
+            restored = Integrator.restore(drift, filename, domain=domain)
+            for index, positions, _ in restored.steps(chunk=10):
+                lanes = flatnonzero(restored.exits[restored.particles] < 0)
+                steps = slice(index - len(positions) + 1, index + 1)
+                self.assertTrue(allclose(
+                    positions[:, lanes],
+                    expected[steps, restored.particles[lanes]],
+                    rtol=0, atol=1e-14))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_gridded(self):
+        "Particles should carry on from the edges of a gridded flow"
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'flow.hdf5')
+            from_function(blink(gamma=1, period=1), filename)
+            flow = Flow(filename)
+            try:
+                # Start at the first gridded time, with one particle right
+                # next to the edge of the grid
+                params = self.parameters(20, 0.5)
+                start = array([[0.25, 0], [0, 0.25], [-0.25, 0],
+                               [2 - 5e-6, 0.5]])
+                integrator = Integrator(flow.velocity, params,
+                                        domain=flow.domain)
+                integrator.reset(start, time=0)
+                for values in integrator._fluid:
+                    self.assertTrue(isfinite(values).all())
+                while integrator.index < params.N:
+                    integrator.step()
+            finally:
+                flow.close()
+            self.assertTrue((integrator.exits[:3] < 0).all())
+            self.assertNotEqual(integrator.exits[3], 0)
+            self.assertTrue(isfinite(integrator.trajectory[:, :3]).all())
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_terminate(self):
+        "Termination functions should stop particles"
+        integrator = Integrator(
+            rotation, self.parameters(20, 0.3),
+            terminate=lambda positions, velocities, time:
+            (positions[:, 1] > 0.5) & (velocities[:, 0] < 0))
+        angles = linspace(0, pi / 2, 4, endpoint=False)
+        trajectory = integrator.integrate(
+            stack([cos(angles), sin(angles)], axis=-1))
+        self.assertEqual(list(integrator.exits >= 0),
+                         [False, True, True, True])
+        self.assertEqual(integrator.exits[3], 0)
+        self.assertEqual(integrator.history.shape, trajectory.shape)
+        self.assertEqual(len(integrator.particles), 1)
+
+    def test_tracer(self):
+        "Neutrally buoyant particles should follow the fluid"
+        integrator = Integrator(rotation, self.parameters(200, 2 * pi, R=1))
+        angles = linspace(0, 2 * pi, 5)
+        start = stack([cos(angles), sin(angles)], axis=-1)
+        trajectory = integrator.integrate(start)
+        self.assertTrue(allclose(integrator.history, 0))
+        self.assertTrue(allclose(trajectory[-1], start, atol=1e-4))
+
+    def test_relaxation(self):
+        "Particles released into still fluid should slow down correctly"
+        errors = []
+        for nsteps in (100, 200, 400):
+            integrator = Integrator(still, self.parameters(nsteps, 1))
+            integrator.integrate([[0, 0]], velocities=[[1, 0]])
+            errors.append(abs(integrator.history[-1, 0, 0]
+                              - relaxation(1, 1, 0.6, 0.5)))
+        self.assertTrue(errors[-1] < 1e-5)
+        self.assertTrue(errors[0] > errors[1] > errors[2])
+
+    def test_convergence(self):
+        "Errors should drop at least eightfold as the timestep halves"
+        reference = Integrator(shaking, self.parameters(3200, 2))
+        reference.integrate([[0, 0]])
+        errors = []
+        for nsteps in (50, 100, 200):
+            integrator = Integrator(shaking, self.parameters(nsteps, 2))
+            integrator.integrate([[0, 0]])
+            errors.append(abs(integrator.history[-1, 0, 0]
+                              - reference.history[-1, 0, 0]))
+        errors = array(errors)
+        self.assertTrue((errors[:-1] / errors[1:] > 8).all())
+
+    def test_default_velocity(self):
+        "Particles should start with the fluid velocity by default"
+        integrator = Integrator(rotation, self.parameters(10, 1))
+        integrator.reset([[1, 0]])
+        self.assertTrue(allclose(integrator.history, 0))
+        integrator.reset([[1, 0]], velocities=[[0, 0]])
+        self.assertTrue(allclose(integrator.history, [[[0, -1]]]))
+
+    def test_compiled(self):
+        "Compiled and numpy steps should agree"
+        if not Integrator.compiled:
+            self.skipTest('maxr.ext.stepper is not built')
+        start = stack([linspace(0.5, 1, 100), linspace(-1, 0.2, 100)],
+                      axis=-1)
+        trajectories, histories = [], []
+        for compiled in (True, False):
+            integrator = Integrator(blink(gamma=1, period=1),
+                                    self.parameters(50, 1))
+            integrator.compiled = compiled
+            trajectories.append(integrator.integrate(start))
+            histories.append(integrator.history)
+        self.assertTrue(allclose(*trajectories, rtol=0, atol=1e-12))
+        self.assertTrue(allclose(*histories, rtol=0, atol=1e-12))
+
+    def test_compiled_checks(self):
+        "Compiled kernel should check array shapes"
+        if not Integrator.compiled:
+            self.skipTest('maxr.ext.stepper is not built')
+        integrator = Integrator(rotation, self.parameters(10, 1))
+        integrator.integrate(zeros((5, 2)) + 1)
+        args = [integrator._positions[2], integrator._positions[3],
+                integrator._relative,
+                integrator._velocity, integrator._forcing,
+                integrator._history, coefficients(3, 3)] \
+            + list(integrator._fluid) + [2, 0.1, 0.6, 0.5]
+        stepper.step(*args)
+        self.assertRaises(IndexError, stepper.step,
+                          *(args[:-4] + [10] + args[-3:]))
+        self.assertRaises(ValueError, stepper.step,
+                          *(args[:6] + [coefficients(4, 3)] + args[7:]))
+        self.assertRaises(ValueError, stepper.step,
+                          *(args[:5] + [zeros((4, 2))] + args[6:]))
+        self.assertRaises(ValueError, stepper.step,
+                          *(args[:1] + [zeros((4, 2))] + args[2:]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@
 """
 
 from __future__ import print_function, division
+import pickle
 import unittest
 
 from maxr import Parameters
@@ -35,5 +36,13 @@ class TestParameters(unittest.TestCase):
         self.assertRaises(KeyError, lambda *a: self.p.__setitem__(*a),
                           'foo', 'bar')
 
+    def test_pickle(self):
+        "Parameters should survive pickling, including hand-set R and S"
+        self.p.dt = 0.5
+        self.p.R, self.p.S = 0.3, 0.7
+        other = pickle.loads(pickle.dumps(self.p))
+        self.assertEqual(other, self.p)
+        self.assertEqual((other.R, other.S, other.timestep), (0.3, 0.7, 0.5))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
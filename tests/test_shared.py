@@ -0,0 +1,171 @@
+""" file: test_shared.py
+"""
+
+from __future__ import print_function, division
+
+import os
+import pickle
+import subprocess
+import sys
+import unittest
+from multiprocessing import Pool
+
+import numpy as np
+
+from maxr.integrator import history
+from maxr.integrator.shared import SharedArray
+from maxr.ext.coefficients import IntegratorCoeffs, attach
+from maxr.ext import history as cyhistory
+
+
+def integrate_row(args):
+    "Worker: integrate one row of a shared history in place"
+    coeffs, histories, row, step = args
+    histories.array[row, -1] = cyhistory.integral(
+        coeffs, histories.array[row, :-1], step)
+    histories.close()
+    name = coeffs.name
+    coeffs.close()
+    return name
+
+
+class TestSharedArray(unittest.TestCase):
+
+    "Tests for numpy arrays in shared memory"
+
+    def setUp(self):
+        self.shared = SharedArray.from_array(history.coefficients(100))
+
+    def tearDown(self):
+        self.shared.close()
+        self.shared.unlink()
+
+    def test_values(self):
+        "Shared arrays should hold a copy of the original"
+        self.assertTrue(np.array_equal(self.shared.array,
+                                       history.coefficients(100)))
+
+    def test_pickle(self):
+        "Unpickled arrays should attach to the same block"
+        other = pickle.loads(pickle.dumps(self.shared))
+        self.assertEqual(other.name, self.shared.name)
+        other.array[0] = -1
+        self.assertEqual(self.shared.array[0], -1)
+        other.close()
+
+    def test_attach_too_small(self):
+        "Attaching with too large a shape should fail"
+        self.assertRaises(ValueError, SharedArray, (1000,), float,
+                          self.shared.name)
+
+
+class TestSharedCoefficients(unittest.TestCase):
+
+    "Tests for IntegratorCoeffs in shared memory"
+
+    def setUp(self):
+        self.coeffs = IntegratorCoeffs(200, 3)
+        self.shared = self.coeffs.share()
+
+    def tearDown(self):
+        self.shared.unlink()
+
+    def test_attach(self):
+        "Attached coefficients should use the shared block"
+        other = attach(self.shared.name)
+        self.assertEqual((other.n, other.order), (200, 3))
+        self.assertEqual(other.name, self.shared.name)
+        self.assertTrue(np.array_equal(np.asarray(other),
+                                       np.asarray(self.coeffs)))
+
+    def test_single(self):
+        "Single precision coefficients should be shareable"
+        shared = IntegratorCoeffs(50, 2, dtype='float32').share()
+        self.assertEqual(attach(shared.name).dtype, np.float32)
+        shared.unlink()
+
+    def test_pickle(self):
+        "Coefficients should pickle by name if shared, by value if not"
+        other = pickle.loads(pickle.dumps(self.shared))
+        self.assertEqual(other.name, self.shared.name)
+        copy = pickle.loads(pickle.dumps(self.coeffs))
+        self.assertTrue(copy.name is None)
+        self.assertTrue(np.array_equal(np.asarray(copy),
+                                       np.asarray(self.coeffs)))
+
+    def test_resize(self):
+        "Shared coefficients can't be resized"
+        self.assertRaises(BufferError, self.shared.extend)
+
+    def test_close(self):
+        "Closed coefficients shouldn't be usable"
+        other = attach(self.shared.name)
+        view = np.asarray(other)
+        self.assertRaises(BufferError, other.close)
+        del view
+        other.close()
+        other.close()
+        self.assertRaises(ValueError, np.asarray, other)
+        self.assertRaises(ValueError, other.__getitem__, 0)
+        self.assertRaises(ValueError, cyhistory.integral, other,
+                          np.zeros(201), 0.1)
+        self.assertEqual(self.shared[0], np.asarray(self.coeffs)[0])
+
+    def test_pool(self):
+        "Workers should integrate shared histories in place"
+        times = np.linspace(0, 10, 201)
+        states = np.array([np.sin(times), np.cos(times), times])
+        histories = SharedArray((3, 202))
+        histories.array[:, :-1] = states
+        with Pool(2) as pool:
+            names = pool.map(integrate_row, [
+                (self.shared, histories, row, times[1]) for row in range(3)])
+        self.assertEqual(set(names), {self.shared.name})
+        for row in range(3):
+            self.assertAlmostEqual(
+                histories.array[row, -1],
+                history.integrator(states[row], times))
+        histories.close()
+        histories.unlink()
+
+    def test_pool_clean_exit(self):
+        "Workers shouldn't complain about shared memory when they exit"
+        script = '\n'.join([
+            'import numpy as np',
+            'from multiprocessing import get_context',
+            'from maxr.ext.coefficients import IntegratorCoeffs',
+            'from maxr.integrator.shared import SharedArray',
+            'from tests.test_shared import integrate_row',
+            'coeffs = IntegratorCoeffs(100, 3).share()',
+            'histories = SharedArray((2, 102))',
+            'for method in ("fork", "spawn"):',
+            '    with get_context(method).Pool(2) as pool:',
+            '        pool.map(integrate_row, [(coeffs, histories, row, 0.1)',
+            '                                 for row in range(2)])',
+            'histories.close()',
+            'histories.unlink()',
+            'coeffs.unlink()'])
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, '-c', script], cwd=root,
+                                capture_output=True, text=True,
+                                env=dict(os.environ, PYTHONPATH=root))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stderr, '')
+
+    def test_optional(self):
+        "The integrators should import without shared memory support"
+        script = '\n'.join([
+            'import sys',
+            'sys.modules["multiprocessing.shared_memory"] = None',
+            'import maxr.integrator',
+            'from maxr.integrator import history, integrator, writer',
+            'print(history.integrator([1., 1.], [0., 1.]))'])
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, '-c', script], cwd=root,
+                                capture_output=True, text=True,
+                                env=dict(os.environ, PYTHONPATH=root))
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
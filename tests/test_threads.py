@@ -0,0 +1,74 @@
+""" file: test_threads.py
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+import numpy as np
+
+from maxr import ext
+from maxr.ext.coefficients import IntegratorCoeffs
+from maxr.ext import history
+
+class TestThreads(unittest.TestCase):
+
+    "Check the runtime thread count configuration"
+
+    def setUp(self):
+        self.default = ext.get_num_threads()
+
+    def tearDown(self):
+        ext.set_num_threads(self.default)
+
+    def test_default(self):
+        "Default thread count should be positive"
+        self.assertTrue(self.default >= 1)
+
+    def test_set(self):
+        "Setting the thread count should be seen by the getter"
+        ext.set_num_threads(3)
+        self.assertEqual(ext.get_num_threads(), 3)
+
+    def test_set_bad(self):
+        "Thread counts less than one should be rejected"
+        for bad in (0, -2):
+            self.assertRaises(ValueError, ext.set_num_threads, bad)
+        self.assertEqual(ext.get_num_threads(), self.default)
+
+    def test_context(self):
+        "Context manager should restore the old thread count"
+        with ext.num_threads(2):
+            self.assertEqual(ext.get_num_threads(), 2)
+        self.assertEqual(ext.get_num_threads(), self.default)
+
+    def test_context_error(self):
+        "Context manager should restore the thread count on errors"
+        with self.assertRaises(RuntimeError):
+            with ext.num_threads(2):
+                raise RuntimeError
+        self.assertEqual(ext.get_num_threads(), self.default)
+
+    def test_results(self):
+        "Results shouldn't depend on the thread count"
+        num = 50000
+        states = np.random.random(num + 1)
+        expected = history.dot(IntegratorCoeffs(num, 3), states)
+        for nthreads in (1, 2, 4):
+            with ext.num_threads(nthreads):
+                coeffs = IntegratorCoeffs(num, 3)
+                self.assertTrue(np.allclose(
+                    history.dot(coeffs, states), expected))
+
+    def test_environment(self):
+        "MAXR_NUM_THREADS should set the default thread count"
+        env = dict(os.environ, MAXR_NUM_THREADS='5')
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'from maxr import ext; print(ext.get_num_threads())'],
+            env=env)
+        self.assertEqual(int(output), 5)
+
+if __name__ == '__main__':
+    unittest.main()